@@ -0,0 +1,232 @@
+"""
+Vectorized version of the per-character attribute math.
+
+compute_batch() evaluates final_attack (see final_attack.py) and the
+training degrees of calculate_character_attributes() for many characters
+at once. Every operation is applied in the same order as the scalar code,
+so results are bit-for-bit identical to it.
+
+final_attack is evaluated once per distinct final_attack.ATTACK_KEY_FIELDS
+combination in a batch, and combinations seen before are served from the
+shared final_attack.attack_cache.
+
+The NumPy tables are rebuilt whenever the catalog they are asked for is
+not the one they were built from, such as after utils.reload_static_data().
+"""
+from typing import Optional
+
+import numpy as np
+
+from backend.final_attack import ITEM_RARE_CODES, SSR_ITEM_ATTACK, attack_cache
+from backend.utils import StaticCatalog, get_catalog
+
+CLASSES = StaticCatalog.CLASSES
+CLASS_INDEX = StaticCatalog.CLASS_INDEX
+
+# Column names expected by compute_batch().
+INPUT_COLUMNS = (
+    "sync_level", "class_index", "grade", "core", "uncapped_favor",
+    "item_rare", "item_level", "cube_level", "coor_level",
+    "total_stat_atk", "total_inc_element_dmg",
+)
+
+
+class _Tables:
+    """
+    NumPy copies of the catalog tables.
+    Row -1 of every per-class table, and the last entry of every other
+    table, is zero and serves unknown classes and out-of-range indexes.
+    """
+    def __init__(self, catalog: StaticCatalog):
+        self.catalog = catalog
+
+        self.sync_lengths = np.array([len(values) for values in catalog.sync_attack] + [0])
+        self.sync_attack = np.zeros((len(CLASSES) + 1, max(self.sync_lengths.max(), 1)))
+        for index, values in enumerate(catalog.sync_attack):
+            self.sync_attack[index, :len(values)] = values
+
+        self.favor_attack = np.zeros((len(CLASSES) + 1, len(catalog.favor_attack[0])))
+        self.favor_attack[:len(CLASSES)] = catalog.favor_attack
+
+        self.equipment_attack = np.array(catalog.equipment_attack + (0,), dtype=float)
+        self.sr_item_attack = np.array(catalog.sr_item_attack + (0,), dtype=float)
+        self.cube_attack = np.array(catalog.cube_attack + (0,), dtype=float)
+        self.cube_superiority = np.array(catalog.cube_superiority + (0,), dtype=float)
+
+
+_tables = None
+
+
+def _current_tables(catalog: Optional[StaticCatalog] = None) -> _Tables:
+    global _tables
+    tables = _tables
+    if catalog is None:
+        catalog = get_catalog()
+    if tables is None or tables.catalog is not catalog:
+        tables = _tables = _Tables(catalog)
+    return tables
+
+
+def _lookup(table: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """
+    table[index] with 0 for indexes outside the table.
+    """
+    valid = (index >= 0) & (index < len(table) - 1)
+    return np.where(valid, table[np.where(valid, index, len(table) - 1)], 0.0)
+
+
+def character_inputs(
+    sync_level: int, character_class: str, grade: int, core: int, corporation: str, character_id: int,
+    item_rare: str, item_level: int, cube_level: int, coor_level: int,
+    total_stat_atk: float, total_inc_element_dmg: float, catalog: Optional[StaticCatalog] = None,
+) -> tuple:
+    """
+    Encodes one character as a tuple in INPUT_COLUMNS order.
+    """
+    if catalog is None:
+        catalog = get_catalog()
+    return (
+        sync_level,
+        CLASS_INDEX.get(character_class, -1),
+        grade,
+        core,
+        catalog.is_uncapped_favor(corporation, character_id),
+        ITEM_RARE_CODES.get(item_rare, 0),
+        item_level,
+        cube_level,
+        coor_level,
+        total_stat_atk,
+        total_inc_element_dmg,
+    )
+
+
+def to_columns(inputs: list) -> dict:
+    """
+    Turns a list of character_inputs() tuples into the columnar arrays compute_batch() takes.
+    """
+    if not inputs:
+        return {name: np.zeros(0) for name in INPUT_COLUMNS}
+    arrays = list(zip(*inputs))
+    columns = {name: np.asarray(values) for name, values in zip(INPUT_COLUMNS, arrays)}
+    for name in ("total_stat_atk", "total_inc_element_dmg"):
+        columns[name] = columns[name].astype(float)
+    return columns
+
+
+def _final_attack(t: _Tables, keys: np.ndarray) -> np.ndarray:
+    """
+    final_attack for rows laid out as final_attack.ATTACK_KEY_FIELDS.
+    """
+    sync_attack = keys[:, 0]
+    grade = keys[:, 1].astype(np.int64)
+    uncapped_favor = keys[:, 2].astype(bool)
+    class_index = keys[:, 3].astype(np.int64)
+    coor_level = keys[:, 4].astype(np.int64)
+    item_rare = keys[:, 5].astype(np.int64)
+    item_level = keys[:, 6].astype(np.int64)
+    core = keys[:, 7].astype(np.int64)
+    cube_level = keys[:, 8].astype(np.int64)
+    class_row = np.where(class_index < 0, len(CLASSES), class_index)
+
+    base_breakthrough_attack = sync_attack * (1 + 0.02 * grade) + (20 * grade)
+
+    favor_rank = (grade + 1) * 10
+    favor_rank = np.where(uncapped_favor, favor_rank, np.minimum(favor_rank, 30))
+    favor_valid = (favor_rank >= 0) & (favor_rank < t.favor_attack.shape[1])
+    favor_attack_bonus = np.where(
+        favor_valid,
+        t.favor_attack[class_row, np.where(favor_valid, favor_rank, 0)],
+        0.0,
+    )
+
+    coor_bonus = coor_level * 25
+
+    base_sum = base_breakthrough_attack + favor_attack_bonus + coor_bonus
+    multiplied_sum = base_sum * (1 + 0.02 * core)
+
+    equipment_attack = t.equipment_attack[class_row]
+    item_attack = np.where(
+        item_rare == ITEM_RARE_CODES["SSR"],
+        float(SSR_ITEM_ATTACK),
+        np.where(item_rare == ITEM_RARE_CODES["SR"], _lookup(t.sr_item_attack, item_level - 1), 0.0),
+    )
+    cube_attack = _lookup(t.cube_attack, cube_level)
+
+    return multiplied_sum + equipment_attack + item_attack + cube_attack
+
+
+def _cached_final_attack(t: _Tables, keys: np.ndarray) -> np.ndarray:
+    """
+    _final_attack() computed once per distinct key row, reusing attack_cache entries.
+    """
+    version = t.catalog.version
+    positions = {}
+    inverse = [positions.setdefault((version, *row), len(positions)) for row in keys.tolist()]
+    values = np.empty(len(positions))
+    missing = []
+    for index, key in enumerate(positions):
+        value = attack_cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            values[index] = value
+    if missing:
+        computed = _final_attack(t, np.array([key[1:] for key in missing], dtype=float)).tolist()
+        for key, value in zip(missing, computed):
+            values[positions[key]] = value
+            attack_cache.put(key, value)
+    return values[np.array(inverse, dtype=np.int64)]
+
+
+def compute_batch(columns: dict, catalog: Optional[StaticCatalog] = None) -> dict:
+    """
+    Returns arrays of final_attack, total_superiority, sync_attack,
+    breakthrough_coefficient and the relative/absolute/general training
+    degrees for columnar inputs keyed by INPUT_COLUMNS, from `catalog`
+    or the live one.
+    """
+    t = _current_tables(catalog)
+    sync_level = columns["sync_level"].astype(np.int64)
+    class_index = columns["class_index"].astype(np.int64)
+    grade = columns["grade"].astype(np.int64)
+    core = columns["core"].astype(np.int64)
+    item_level = columns["item_level"].astype(np.int64)
+    item_rare = columns["item_rare"].astype(np.int64)
+    coor_level = columns["coor_level"].astype(np.int64)
+    cube_level = columns["cube_level"].astype(np.int64)
+    total_stat_atk = columns["total_stat_atk"]
+    total_inc_element_dmg = columns["total_inc_element_dmg"]
+
+    # Scalar code indexes the level list with sync_level - 1 and, like any
+    # Python list, wraps negative indexes around.
+    class_row = np.where(class_index < 0, len(CLASSES), class_index)
+    lengths = t.sync_lengths[class_row]
+    sync_index = sync_level - 1
+    sync_valid = (sync_index < lengths) & (sync_index >= -lengths)
+    sync_attack = np.where(
+        sync_valid,
+        t.sync_attack[class_row, np.where(sync_valid, sync_index % np.maximum(lengths, 1), 0)],
+        0.0,
+    )
+
+    breakthrough_coefficient = 1 + (grade * 0.03) + (core * 0.02)
+
+    final_attack = _cached_final_attack(t, np.column_stack([
+        sync_attack, grade, columns["uncapped_favor"].astype(bool), class_index, coor_level,
+        item_rare, item_level, core, cube_level,
+    ]).astype(float))
+
+    total_superiority = total_inc_element_dmg + 10 + _lookup(t.cube_superiority, cube_level)
+    relative_training_degree = breakthrough_coefficient * (1 + total_stat_atk / 100) * (1 + total_superiority / 100)
+    absolute_training_degree = sync_attack * relative_training_degree
+    general_relative_training_degree = breakthrough_coefficient * (1 + total_stat_atk)
+
+    return {
+        "final_attack": final_attack,
+        "total_superiority": total_superiority,
+        "sync_attack": sync_attack,
+        "breakthrough_coefficient": breakthrough_coefficient,
+        "relative_training_degree": relative_training_degree,
+        "absolute_training_degree": absolute_training_degree,
+        "general_relative_training_degree": general_relative_training_degree,
+    }
@@ -0,0 +1,870 @@
+"""
+Ad-hoc benchmarks against the sample exports in input/.
+
+Run from the repository root, e.g.:
+    python -m backend.benchmarks ingest --copies 6
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from sqlalchemy import event, func, select
+
+from backend import batch_engine, compute_pool, models, schemas, serialization, services
+from backend.final_attack import attack_cache
+from backend.response_cache import response_cache
+from backend.utils import CUBE_LEVEL_MAP, NIKKE_STATIC_DATA, get_catalog
+
+INPUT_DIR = Path(__file__).parent.parent / "input"
+
+
+def iter_sample_documents(copies: int = 1):
+    """
+    Yields input/*.json `copies` times, renaming players so every copy is a distinct player.
+    Documents are decoded lazily, one at a time, like files of a streamed upload.
+    """
+    raw_files = [path.read_bytes() for path in sorted(INPUT_DIR.glob("*.json"))]
+    for i in range(copies):
+        for raw in raw_files:
+            data = json.loads(raw)
+            data["name"] = f"{data['name']}-{i}"
+            yield data
+
+
+def load_sample_documents(copies: int = 1) -> list:
+    return list(iter_sample_documents(copies))
+
+
+def batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class StatementCounter:
+    """
+    Counts SQL statements sent through the engine while active.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def bench_ingest(args):
+    models.create_db_and_tables()
+    db = models.SessionLocal()
+    if args.trace_memory:
+        tracemalloc.start()
+    try:
+        # The first round creates every player, the second one re-syncs them.
+        for label in ("create", "resync"):
+            if args.trace_memory:
+                tracemalloc.reset_peak()
+            stats = services.IngestStats()
+            settings = services.CharacterSettingsCache(db)
+            with StatementCounter(models.engine) as counter:
+                start = time.perf_counter()
+                for batch in batched(iter_sample_documents(args.copies), args.batch_size):
+                    services.ingest_documents(db, batch, None, settings, stats)
+                db.commit()
+                elapsed = time.perf_counter() - start
+            players = stats.players_created + stats.players_updated
+            print(f"{label}: {players} players in {elapsed * 1000:.1f} ms, {counter.count} statements")
+            print(f"  {stats.as_dict()}")
+            print(f"  attack cache: {attack_cache.stats()}")
+            if args.trace_memory:
+                print(f"  peak traced memory: {tracemalloc.get_traced_memory()[1] / 1024:.0f} KiB")
+    finally:
+        db.close()
+
+
+def bench_compute(args):
+    documents = load_sample_documents(args.copies)
+
+    start = time.perf_counter()
+    serial = [services.compute_document_rows(data) for data in documents]
+    serial_elapsed = time.perf_counter() - start
+    print(f"serial: {len(documents)} players in {serial_elapsed * 1000:.1f} ms")
+
+    pool = compute_pool.get_compute_pool(args.workers)
+    try:
+        # Start every worker before timing so spawn cost is not counted.
+        list(pool.map(abs, range(args.workers * 4)))
+        start = time.perf_counter()
+        pooled = list(pool.map(services.compute_document_rows, documents))
+        pooled_elapsed = time.perf_counter() - start
+    finally:
+        compute_pool.shutdown_compute_pool()
+    assert pooled == serial
+    print(f"pool ({args.workers} workers): {len(documents)} players in {pooled_elapsed * 1000:.1f} ms "
+          f"({serial_elapsed / pooled_elapsed:.2f}x)")
+
+
+def check_parity(args):
+    """
+    Compares batch_engine against the scalar calculate_character_attributes()
+    for every character in input/*.json plus randomized inputs, some without
+    an item level, and exits non-zero on the first value that is not
+    bit-for-bit identical. The same characters encoded from stored rows, as
+    the recompute and what-if paths do, must agree too.
+    """
+    checked_columns = (
+        "final_attack", "total_superiority", "breakthrough_coefficient",
+        "relative_training_degree", "absolute_training_degree", "general_relative_training_degree",
+    )
+    cases = []
+    for data in load_sample_documents():
+        _, _, max_cube_level = services.extract_cube_levels(data)
+        for characters in data.get("elements", {}).values():
+            for char_data in characters:
+                if "skill1_level" in char_data and "id" in char_data:
+                    cases.append((char_data, data.get("synchroLevel", 1), max_cube_level))
+
+    rng = random.Random(args.seed)
+    character_ids = list(NIKKE_STATIC_DATA) + [0]
+    for _ in range(args.random_cases):
+        char_data = {
+            "id": rng.choice(character_ids),
+            "limit_break": {"grade": rng.randint(0, 3), "core": rng.randint(0, 10)},
+            "item_rare": rng.choice(["SSR", "SR", "R", None]),
+            "item_level": rng.randint(0, 18),
+            "coor_level": rng.randint(0, 10),
+            "equipments": {"0": [
+                {"function_type": "StatAtk", "function_value": round(rng.uniform(0, 30), 2)},
+                {"function_type": "IncElementDmg", "function_value": round(rng.uniform(0, 60), 2)},
+            ]},
+        }
+        if rng.random() < 0.2:
+            # Exports without an item level, or with a null one, store NULL.
+            if rng.random() < 0.5:
+                del char_data["item_level"]
+            else:
+                char_data["item_level"] = None
+        cases.append((char_data, rng.randint(0, 1001), rng.randint(0, 16)))
+
+    # Fresh caches on both sides so neither path reads values the other one stored.
+    attack_cache.clear()
+    inputs = [
+        services.character_engine_inputs(char_data, sync_level, max_cube_level, services.sum_equipment_stats(char_data))
+        for char_data, sync_level, max_cube_level in cases
+    ]
+    results = batch_engine.compute_batch(batch_engine.to_columns(inputs))
+    # A second pass is served from attack_cache and must agree as well.
+    cached_final_attack = batch_engine.compute_batch(batch_engine.to_columns(inputs))["final_attack"]
+
+    catalog = get_catalog()
+    stored_inputs = []
+    for char_data, sync_level, max_cube_level in cases:
+        total_stat_atk, total_inc_element_dmg, _ = services.sum_equipment_stats(char_data)
+        stored_inputs.append(services.stored_engine_inputs({
+            "character_id": char_data["id"],
+            "limit_break_grade": char_data.get("limit_break", {}).get("grade"),
+            "core": char_data.get("limit_break", {}).get("core"),
+            "item_rare": char_data.get("item_rare"),
+            "item_level": char_data.get("item_level"),
+            "coor_level": char_data.get("coor_level", 0),
+            "total_stat_atk": total_stat_atk,
+            "total_inc_element_dmg": total_inc_element_dmg,
+            "synchro_level": sync_level,
+            "max_cube_level": max_cube_level,
+        }, catalog))
+    stored_results = batch_engine.compute_batch(batch_engine.to_columns(stored_inputs))
+
+    attack_cache.clear()
+    expected = []
+    for char_data, sync_level, max_cube_level in cases:
+        cube_superiority_increase = CUBE_LEVEL_MAP.get(max_cube_level, {}).get("IncElementDmg", 0)
+        expected.append(services.calculate_character_attributes(
+            char_data, sync_level, cube_superiority_increase, max_cube_level, char_data.get("coor_level", 0)
+        ))
+
+    for index, attributes in enumerate(expected):
+        if cached_final_attack[index].item() != attributes["final_attack"]:
+            raise SystemExit(f"mismatch in cached final_attack for case {cases[index]}")
+        for column in checked_columns:
+            actual = results[column][index].item()
+            if actual != attributes[column]:
+                raise SystemExit(f"mismatch in {column} for case {cases[index]}: scalar {attributes[column]!r}, batch {actual!r}")
+            stored = stored_results[column][index].item()
+            # Stored virtual Red Hood rows are computed as the real character, so only ingest can be checked.
+            if cases[index][0]["id"] != services.RED_HOOD_VIRTUAL_ID and stored != actual:
+                raise SystemExit(f"mismatch in {column} for case {cases[index]}: upload {actual!r}, stored row {stored!r}")
+    print(f"parity ok: {len(cases)} characters, {len(checked_columns)} columns identical")
+
+
+def bench_characters(args):
+    """
+    GET /api/characters/ through the pydantic response_model path versus
+    format=json and format=columnar, checking format=json is byte-identical,
+    and the same request replayed from the response cache and revalidated
+    with If-None-Match. Needs httpx for FastAPI's TestClient.
+    """
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    with TestClient(app) as client:
+        db = models.SessionLocal()
+        try:
+            for batch in batched(iter_sample_documents(args.copies), services.UPLOAD_BATCH_SIZE):
+                services.ingest_documents(db, batch, None, services.CharacterSettingsCache(db))
+            db.commit()
+        finally:
+            db.close()
+
+        variants = [
+            ("full list", {}),
+            ("page of 200, 6 fields", {"limit": 200, "fields": "name_cn,player_name,element,total_superiority,absolute_training_degree,breakthrough_coefficient"}),
+        ]
+        for label, params in variants:
+            timings = {}
+            bodies = {}
+            for mode in ("pydantic", "json", "columnar"):
+                mode_params = dict(params) if mode == "pydantic" else dict(params, format=mode)
+                elapsed = 0.0
+                for _ in range(args.repeat):
+                    response_cache.clear()
+                    start = time.perf_counter()
+                    response = client.get("/api/characters/", params=mode_params)
+                    elapsed += time.perf_counter() - start
+                    response.raise_for_status()
+                timings[mode] = elapsed / args.repeat
+                bodies[mode] = response.content
+                if mode == "pydantic":
+                    etag = response.headers["etag"]
+            if bodies["json"] != bodies["pydantic"]:
+                raise SystemExit(f"{label}: format=json body differs from the pydantic response")
+
+            for mode, headers in (("cached", {}), ("304", {"If-None-Match": etag})):
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    response = client.get("/api/characters/", params=params, headers=headers)
+                timings[mode] = (time.perf_counter() - start) / args.repeat
+                bodies[mode] = response.content
+            if response.status_code != 304:
+                raise SystemExit(f"{label}: If-None-Match with the current ETag returned {response.status_code}")
+            if bodies["cached"] != bodies["pydantic"]:
+                raise SystemExit(f"{label}: cached body differs from the pydantic response")
+            rows = len(json.loads(bodies["pydantic"]))
+            print(f"{label} ({rows} rows): " + ", ".join(
+                f"{mode} {timings[mode] * 1000:.1f} ms / {len(bodies[mode]) / 1024:.0f} KiB" for mode in timings
+            ) + f"; json {timings['pydantic'] / timings['json']:.1f}x faster, byte-identical")
+
+
+def bench_search(args):
+    """
+    character_name filtering via the static catalog versus the old
+    LIKE '%name%' scan, checking both select the same characters.
+    """
+    models.create_db_and_tables()
+    db = models.SessionLocal()
+    try:
+        for batch in batched(iter_sample_documents(args.copies), services.UPLOAD_BATCH_SIZE):
+            services.ingest_documents(db, batch, None, services.CharacterSettingsCache(db))
+        db.commit()
+
+        stored_names = sorted(db.scalars(select(models.Character.name_cn).distinct()))
+        rng = random.Random(args.seed)
+        terms = [name[:length] for name in rng.sample(stored_names, min(args.terms, len(stored_names))) for length in (1, 2)]
+        timings = {"like": 0.0, "catalog": 0.0}
+        for term in terms:
+            results = {}
+            for mode in timings:
+                start = time.perf_counter()
+                if mode == "like":
+                    conditions = [models.Character.name_cn.contains(term)]
+                else:
+                    conditions, _ = services._character_filters(character_name=term)
+                results[mode] = db.scalars(select(models.Character.id).where(*conditions).order_by(models.Character.id)).all()
+                timings[mode] += time.perf_counter() - start
+            if results["like"] != results["catalog"]:
+                raise SystemExit(f"search for {term!r} differs: {len(results['like'])} rows with LIKE, {len(results['catalog'])} via the catalog")
+        rows = db.scalar(select(func.count()).select_from(models.Character))
+        print(f"{len(terms)} searches over {rows} characters: " + ", ".join(
+            f"{mode} {elapsed / len(terms) * 1000:.2f} ms" for mode, elapsed in timings.items()
+        ) + "; same rows")
+    finally:
+        db.close()
+
+
+def _python_element_training_analysis(db, coefficients: dict, training_type: str) -> list:
+    """
+    The previous /api/element-training-analysis/ implementation (without union filtering):
+    ORM characters, a lazy load of each character's player and sums in Python.
+    """
+    players = db.query(models.Player).all()
+    characters = db.query(models.Character).filter(
+        models.Character.player_id.in_([player.id for player in players]),
+        models.Character.character_id.in_([int(key) for key in coefficients]),
+    ).all()
+    results = {
+        player.name: {"player_name": player.name, "elements": {element: 0 for element in services.ANALYSIS_ELEMENTS}}
+        for player in players
+    }
+    for character in characters:
+        coefficient = coefficients.get(str(character.character_id))
+        if coefficient is not None:
+            results[character.player.name]["elements"][character.element] += getattr(character, training_type, 0) * float(coefficient)
+    return list(results.values())
+
+
+def bench_training(args):
+    """
+    /api/element-training-analysis/ as one grouped query versus the
+    previous ORM loop, checking both give the same sums.
+    """
+    models.create_db_and_tables()
+    db = models.SessionLocal()
+    try:
+        for batch in batched(iter_sample_documents(args.copies), services.UPLOAD_BATCH_SIZE):
+            services.ingest_documents(db, batch, None, services.CharacterSettingsCache(db))
+        db.commit()
+        character_ids = db.scalars(select(models.Character.character_id).distinct().order_by(models.Character.character_id)).all()
+        rng = random.Random(args.seed)
+        coefficients = {str(character_id): rng.choice([1, 1, 0.5, 2]) for character_id in rng.sample(character_ids, min(args.characters, len(character_ids)))}
+
+        results = {}
+        for label, run in (
+            ("python", lambda: _python_element_training_analysis(db, coefficients, "relative_training_degree")),
+            ("sql", lambda: services.element_training_analysis(db, None, coefficients, "relative_training_degree")),
+        ):
+            db.expire_all()
+            with StatementCounter(models.engine) as counter:
+                start = time.perf_counter()
+                results[label] = run()
+                elapsed = time.perf_counter() - start
+            print(f"{label}: {elapsed * 1000:.1f} ms, {counter.count} statements")
+        for expected, found in zip(results["python"], results["sql"]):
+            if expected["player_name"] != found["player_name"] or any(
+                not math.isclose(value, found["elements"][element], rel_tol=1e-12) for element, value in expected["elements"].items()
+            ):
+                raise SystemExit(f"sums differ for {expected['player_name']}: {expected['elements']} vs {found['elements']}")
+        if len(results["python"]) != len(results["sql"]):
+            raise SystemExit("the two implementations list different players")
+        rows = db.scalar(select(func.count()).select_from(models.Character))
+        print(f"{len(results['sql'])} players, {len(coefficients)} characters weighted, {rows} stored: same sums "
+              "(up to summation order)")
+    finally:
+        db.close()
+
+
+def bench_export(args):
+    """
+    Streams each export format at two database sizes and reports the peak
+    Python heap, which should not grow with the number of rows.
+    """
+    from backend import export
+
+    models.create_db_and_tables()
+    db = models.SessionLocal()
+    try:
+        copies_done = 0
+        for copies in (args.copies // 4, args.copies):
+            for batch in batched(iter_sample_documents(copies - copies_done), services.UPLOAD_BATCH_SIZE):
+                for data in batch:
+                    data["name"] = f"{data['name']}-{copies}"
+                services.ingest_documents(db, batch, None, services.CharacterSettingsCache(db))
+            db.commit()
+            copies_done = copies
+            for table in export.EXPORT_TABLES:
+                for format in export.EXPORT_FORMATS:
+                    try:
+                        export.check_format(format)
+                    except ValueError as e:
+                        print(f"{table} {format}: skipped, {e}")
+                        continue
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    size = sum(len(chunk) for chunk in export.iter_export(format, table, {}, args.batch_size))
+                    elapsed = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    print(f"{copies} copies, {table} {format}: {size / 1024:.0f} KiB in {elapsed * 1000:.1f} ms, "
+                          f"peak traced memory {peak / 1024:.0f} KiB")
+    finally:
+        db.close()
+
+
+def _per_query_damage_simulation(db, request):
+    """
+    The damage simulation as it was before backend/simulation.py, minus its
+    per-character logging: one query per base character, then one per
+    player and team. Kept as the reference for bench_simulation.
+    """
+    att_weights = {}
+    for team in request.teams:
+        for char_input in team.characters:
+            base_char_stats = db.query(models.Character).filter(
+                models.Character.player_id == request.base_player_id,
+                models.Character.character_id == char_input.character_id
+            ).first()
+            if not base_char_stats:
+                continue
+            if not base_char_stats.final_attack:
+                att_weights[char_input.character_id] = 0
+                continue
+            element_weight = 1 if base_char_stats.element == team.element else 0
+            superiority_multiplier = 1 + (element_weight * (base_char_stats.total_superiority or 0) / 100)
+            attack_multiplier = 1 + ((base_char_stats.total_stat_atk or 0) / 100)
+            denominator = base_char_stats.final_attack * superiority_multiplier * attack_multiplier
+            if denominator == 0:
+                att_weights[char_input.character_id] = 0
+                continue
+            att_weights[char_input.character_id] = char_input.damage / denominator
+
+    simulation_results = []
+    for player in db.query(models.Player).filter(models.Player.union_id == request.union_id).all():
+        player_team_damages = {}
+        for team in request.teams:
+            team_total_damage = 0
+            character_details = []
+            team_is_valid = True
+            player_chars_map = {
+                char.character_id: char
+                for char in db.query(models.Character).filter(
+                    models.Character.player_id == player.id,
+                    models.Character.character_id.in_([char.character_id for char in team.characters])
+                ).all()
+            }
+            for char_input in team.characters:
+                att_weight = att_weights.get(char_input.character_id)
+                if att_weight is None:
+                    continue
+                target_char_stats = player_chars_map.get(char_input.character_id)
+                if not target_char_stats:
+                    team_is_valid = False
+                    break
+                if not target_char_stats.final_attack:
+                    simulated_damage = 0
+                else:
+                    element_weight = 1 if target_char_stats.element == team.element else 0
+                    attack_multiplier = (1 + (target_char_stats.total_stat_atk or 0) / 100)
+                    superiority_multiplier_forward = (1 + element_weight * (target_char_stats.total_superiority or 0) / 100)
+                    simulated_damage = max(0, (
+                        target_char_stats.final_attack * attack_multiplier * superiority_multiplier_forward * att_weight
+                    ))
+                team_total_damage += simulated_damage
+                character_details.append(schemas.SimulatedCharacterDetail(
+                    character_id=char_input.character_id,
+                    name_cn=target_char_stats.name_cn,
+                    simulated_damage=simulated_damage
+                ))
+            player_team_damages[team.element] = schemas.SimulatedTeamDamage(
+                total_damage=team_total_damage if team_is_valid else None,
+                characters=character_details
+            )
+        simulation_results.append(schemas.SimulationPlayerResult(
+            player_id=player.id, player_name=player.name, team_damages=player_team_damages
+        ))
+    return schemas.DamageSimulationResponse(simulation_results=simulation_results)
+
+
+def sample_simulation_request(db, union_id: int, base_player_id: int, rng: random.Random, team_size: int = 5):
+    """
+    One team per element from the base player's characters, with a random
+    recorded damage per member and one member of another element per team.
+    """
+    by_element = {}
+    for character_id, element in db.execute(
+        select(models.Character.character_id, models.Character.element)
+        .where(models.Character.player_id == base_player_id)
+        .order_by(models.Character.character_id)
+    ):
+        by_element.setdefault(element, []).append(character_id)
+    all_ids = [character_id for ids in by_element.values() for character_id in ids]
+    teams = []
+    for element, ids in sorted(by_element.items()):
+        members = rng.sample(ids, min(team_size - 1, len(ids))) + [rng.choice(all_ids)]
+        teams.append(schemas.SimulationTeam(element=element, characters=[
+            schemas.SimulationCharacter(character_id=character_id, damage=rng.uniform(1e5, 1e7)) for character_id in members
+        ]))
+    return schemas.DamageSimulationRequest(union_id=union_id, base_player_id=base_player_id, teams=teams)
+
+
+def bench_simulation(args):
+    from backend import simulation
+
+    models.create_db_and_tables()
+    db = models.SessionLocal()
+    try:
+        union = models.Union(name="bench")
+        db.add(union)
+        db.flush()
+        for batch in batched(iter_sample_documents(args.copies), services.UPLOAD_BATCH_SIZE):
+            services.ingest_documents(db, batch, union.id, services.CharacterSettingsCache(db))
+        db.commit()
+        player_ids = db.scalars(select(models.Player.id).order_by(models.Player.id)).all()
+
+        rng = random.Random(args.seed)
+        requests = [sample_simulation_request(db, union.id, rng.choice(player_ids), rng) for _ in range(args.requests)]
+        timings = {}
+        statements = {}
+        results = {}
+        simulation.simulation_cache.clear()
+        for label, run in (("per-query", _per_query_damage_simulation), ("set-based", simulation.run_damage_simulation)):
+            with StatementCounter(models.engine) as counter:
+                start = time.perf_counter()
+                results[label] = [run(db, request).model_dump() for request in requests]
+                timings[label] = (time.perf_counter() - start) / len(requests)
+            statements[label] = counter.count / len(requests)
+        if results["per-query"] != results["set-based"]:
+            raise SystemExit("set-based simulation differs from the per-query reference")
+        incomplete = sum(
+            team["total_damage"] is None
+            for result in results["set-based"] for player in result["simulation_results"] for team in player["team_damages"].values()
+        )
+        print(f"{len(player_ids)} players, {len(requests[0].teams)} teams, {args.requests} requests "
+              f"({incomplete} incomplete teams): identical results")
+        for label in timings:
+            print(f"  {label}: {timings[label] * 1000:.1f} ms, {statements[label]:.0f} statements per request")
+
+        batch = schemas.BatchSimulationRequest(scenarios=[
+            schemas.SimulationScenario(base_player_id=request.base_player_id, union_ids=[request.union_id], teams=request.teams)
+            for request in requests
+        ])
+        with StatementCounter(models.engine) as counter:
+            start = time.perf_counter()
+            batch_results = simulation.run_batch_simulation(db, batch).model_dump()["scenarios"]
+            elapsed = time.perf_counter() - start
+        if [scenario["simulation_results"] for scenario in batch_results] != [result["simulation_results"] for result in results["set-based"]]:
+            raise SystemExit("batch simulation differs from the single-request results")
+        print(f"  batch of {len(requests)} scenarios: {elapsed * 1000:.1f} ms, {counter.count} statements in total")
+
+        def full_response(request):
+            yield serialization._encode(simulation.run_damage_simulation(db, request).model_dump()).encode("utf-8")
+
+        def ndjson_lines(request):
+            return serialization.iter_ndjson(result.model_dump() for result in simulation.iter_damage_simulation(db, request))
+
+        for label, encode in (("full response", full_response), ("ndjson", ndjson_lines)):
+            first_chunk = total = peak = 0.0
+            for request in requests:
+                simulation.simulation_cache.clear()
+                start = time.perf_counter()
+                chunks = encode(request)
+                next(chunks)
+                first_chunk += time.perf_counter() - start
+                for _ in chunks:
+                    pass
+                total += time.perf_counter() - start
+                simulation.simulation_cache.clear()
+                tracemalloc.start()
+                for _ in encode(request):
+                    pass
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            print(f"  {label}: first chunk after {first_chunk / len(requests) * 1000:.1f} ms, "
+                  f"complete after {total / len(requests) * 1000:.1f} ms, peak heap {peak / 1024:.0f} KiB")
+
+        simulation.simulation_cache.clear()
+        uncached = [simulation.run_damage_simulation(db, request).model_dump() for request in requests]
+        with StatementCounter(models.engine) as counter:
+            start = time.perf_counter()
+            cached = [simulation.run_damage_simulation(db, request).model_dump() for request in requests]
+            elapsed = (time.perf_counter() - start) / len(requests)
+        if cached != uncached:
+            raise SystemExit("cached simulation differs from the computed one")
+        print(f"  cached: {elapsed * 1000:.1f} ms, {counter.count / len(requests):.0f} statements per request")
+    finally:
+        db.close()
+
+
+def _exhaustive_assignment(values, capacities) -> float:
+    """
+    Best total of best_assignment()'s problem by trying every assignment; only for tiny inputs.
+    """
+    best = 0.0
+
+    def visit(item, total, caps):
+        nonlocal best
+        if item == len(values):
+            best = max(best, total)
+            return
+        visit(item + 1, total, caps)
+        for team, value in enumerate(values[item]):
+            if value is not None and caps[team]:
+                caps[team] -= 1
+                visit(item + 1, total + value, caps)
+                caps[team] += 1
+
+    visit(0, 0.0, list(capacities))
+    return best
+
+
+def sample_optimization_request(db, union_id: int, base_player_id: int, rng: random.Random, team_size: int = 5):
+    """
+    One team per element with every character of the base player as a
+    candidate, recorded damage being higher in the character's own element.
+    """
+    owned = db.execute(
+        select(models.Character.character_id, models.Character.element)
+        .where(models.Character.player_id == base_player_id)
+        .order_by(models.Character.character_id)
+    ).all()
+    teams = [
+        schemas.SimulationTeam(element=element, characters=[
+            schemas.SimulationCharacter(
+                character_id=character_id,
+                damage=rng.uniform(1e5, 1e7) * (1.5 if character_element == element else 1),
+            )
+            for character_id, character_element in owned
+        ])
+        for element in sorted({element for _, element in owned})
+    ]
+    return schemas.TeamOptimizationRequest(union_id=union_id, base_player_id=base_player_id, teams=teams, team_size=team_size)
+
+
+def bench_optimize(args):
+    from backend import optimizer
+
+    rng = random.Random(args.seed)
+    for _ in range(args.random_cases):
+        items, teams = rng.randint(1, 9), rng.randint(1, 3)
+        values = [[rng.choice([None, rng.uniform(0, 100)]) for _ in range(teams)] for _ in range(items)]
+        capacities = [rng.randint(1, 3) for _ in range(teams)]
+        _, found, optimal, _ = optimizer.best_assignment(values, capacities, time.time() + 60)
+        if not optimal or abs(found - _exhaustive_assignment(values, capacities)) > 1e-9:
+            raise SystemExit(f"best_assignment is not optimal for {values} {capacities}")
+    print(f"{args.random_cases} random small cases: branch-and-bound matches exhaustive search")
+
+    models.create_db_and_tables()
+    db = models.SessionLocal()
+    try:
+        union = models.Union(name="bench")
+        db.add(union)
+        db.flush()
+        for batch in batched(iter_sample_documents(args.copies), services.UPLOAD_BATCH_SIZE):
+            services.ingest_documents(db, batch, union.id, services.CharacterSettingsCache(db))
+        db.commit()
+        player_ids = db.scalars(select(models.Player.id).order_by(models.Player.id)).all()
+        request = sample_optimization_request(db, union.id, rng.choice(player_ids), rng, args.team_size)
+        request.time_budget_ms = args.budget_ms
+        candidates = len(request.teams[0].characters)
+
+        results = {}
+        try:
+            for label, workers in (("in-process", 0), (f"{args.workers} workers", args.workers)):
+                if workers:
+                    # Start every worker before timing so spawn cost is not counted.
+                    list(compute_pool.get_compute_pool(workers).map(abs, range(workers * 4)))
+                start = time.perf_counter()
+                response = optimizer.optimize_teams(db, request, workers)
+                elapsed = time.perf_counter() - start
+                nodes = [result.nodes for result in response.results]
+                print(f"{label}: {len(response.results)} players, {len(request.teams)} teams of {args.team_size} "
+                      f"from {candidates} candidates in {elapsed * 1000:.0f} ms, "
+                      f"{sum(result.optimal for result in response.results)} proven optimal, "
+                      f"nodes median {statistics.median(nodes):.0f} max {max(nodes)}")
+                results[label] = response.model_dump()["results"]
+        finally:
+            compute_pool.shutdown_compute_pool()
+        first, second = results.values()
+        if all(result["optimal"] for result in first + second) and first != second:
+            raise SystemExit("pooled optimization differs from the in-process one")
+    finally:
+        db.close()
+
+
+def check_jobs(args):
+    """
+    Uploads the sample exports through /api/upload/jobs while other
+    threads keep reading, then checks every player and character was
+    stored. Runs itself again against a temporary SQLite file when the
+    configured database is the in-memory one, which refuses jobs.
+    """
+    from fastapi.testclient import TestClient
+
+    from backend import main
+
+    if models.SHARED_CONNECTION:
+        models.create_db_and_tables()
+        with TestClient(main.app) as client:
+            response = client.post("/api/upload/jobs", files=[("files", ("a.json", b"{}", "application/json"))])
+        if response.status_code != 409:
+            raise SystemExit(f"in-memory database accepted an upload job ({response.status_code})")
+        print("in-memory database: upload jobs refused with 409")
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/jobs.db")
+            subprocess.run([sys.executable, "-m", "backend.benchmarks", *sys.argv[1:]], cwd=INPUT_DIR.parent, env=env, check=True)
+        return
+
+    documents = load_sample_documents(args.copies)
+    files = [
+        ("files", (f"{index}.json", json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json"))
+        for index, data in enumerate(documents)
+    ]
+    with TestClient(main.app) as client:
+        stop = threading.Event()
+        reads = []
+
+        def read():
+            while not stop.is_set():
+                reads.append(client.get("/api/players/").status_code)
+                reads.append(client.get("/api/characters/", params={"limit": 5}).status_code)
+
+        readers = [threading.Thread(target=read) for _ in range(args.readers)]
+        for reader in readers:
+            reader.start()
+        try:
+            job_id = client.post("/api/upload/jobs", files=files).json()["job_id"]
+            while True:
+                job = client.get(f"/api/upload/jobs/{job_id}").json()
+                if job["finished_at"] is not None:
+                    break
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+
+    db = models.SessionLocal()
+    try:
+        players = db.scalar(select(func.count()).select_from(models.Player))
+        characters = db.scalar(select(func.count()).select_from(models.Character))
+        orphans = db.scalar(select(func.count()).select_from(models.Character).where(
+            models.Character.player_id.not_in(select(models.Player.id))
+        ))
+    finally:
+        db.close()
+    expected_characters = job["ingest"]["characters"]["added"]
+    print(f"job {job['status']}: {job['progress']['successful_files']}/{len(documents)} files, "
+          f"{players} players, {characters} characters ({expected_characters} reported), "
+          f"{orphans} without a player, {len(reads)} concurrent reads")
+    if job["status"] != "succeeded" or players != len(documents) or characters != expected_characters or orphans:
+        raise SystemExit("upload job lost data while other requests ran")
+
+
+_STARTUP_SCRIPT = """
+import time
+{setup}
+start = time.perf_counter()
+{statement}
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def _time_in_fresh_process(setup: str, statement: str, runs: int, env: dict = None) -> float:
+    """
+    Median milliseconds `statement` takes in a new interpreter, after one discarded warm-up run.
+    """
+    script = _STARTUP_SCRIPT.format(setup=setup, statement=statement)
+    env = dict(os.environ, **(env or {}))
+    timings = []
+    for _ in range(runs + 1):
+        output = subprocess.run(
+            [sys.executable, "-c", script], cwd=INPUT_DIR.parent, env=env,
+            check=True, capture_output=True, text=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings[1:])
+
+
+def bench_startup(args):
+    cases = [
+        ("import backend.main", "", "import backend.main", {}),
+        ("static catalog, no snapshot", "from backend.utils import get_catalog", "get_catalog()", {"STATIC_SNAPSHOT_PATH": ""}),
+        ("static catalog, from snapshot", "from backend.utils import get_catalog", "get_catalog()", {}),
+        ("create_db_and_tables()", "from backend import models", "models.create_db_and_tables()", {}),
+    ]
+    for label, setup, statement, env in cases:
+        elapsed = _time_in_fresh_process(setup, statement, args.runs, env)
+        print(f"{label}: {elapsed:.1f} ms (median of {args.runs})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="bulk ingest of the sample exports")
+    ingest.add_argument("--copies", type=int, default=6, help="how many renamed copies of input/ to upload at once")
+    ingest.add_argument("--batch-size", type=int, default=services.UPLOAD_BATCH_SIZE, help="files written per batch")
+    ingest.add_argument("--trace-memory", action="store_true", help="report peak Python heap usage (slow)")
+    ingest.set_defaults(func=bench_ingest)
+
+    compute = subparsers.add_parser("compute", help="serial vs process-pool attribute computation")
+    compute.add_argument("--copies", type=int, default=20)
+    compute.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    compute.set_defaults(func=bench_compute)
+
+    parity = subparsers.add_parser("parity", help="batch_engine vs scalar attribute math")
+    parity.add_argument("--random-cases", type=int, default=5000)
+    parity.add_argument("--seed", type=int, default=0)
+    parity.set_defaults(func=check_parity)
+
+    characters = subparsers.add_parser("characters", help="pydantic vs fast JSON listing of /api/characters/")
+    characters.add_argument("--copies", type=int, default=20)
+    characters.add_argument("--repeat", type=int, default=5)
+    characters.set_defaults(func=bench_characters)
+
+    search = subparsers.add_parser("search", help="character_name filter via the catalog vs LIKE")
+    search.add_argument("--copies", type=int, default=100)
+    search.add_argument("--terms", type=int, default=20, help="stored names to search prefixes of")
+    search.add_argument("--seed", type=int, default=0)
+    search.set_defaults(func=bench_search)
+
+    training = subparsers.add_parser("training", help="element training analysis as one grouped query vs the ORM loop")
+    training.add_argument("--copies", type=int, default=40)
+    training.add_argument("--characters", type=int, default=40, help="characters given a coefficient")
+    training.add_argument("--seed", type=int, default=0)
+    training.set_defaults(func=bench_training)
+
+    export = subparsers.add_parser("export", help="streaming export memory use at two database sizes")
+    export.add_argument("--copies", type=int, default=40)
+    export.add_argument("--batch-size", type=int, default=1000)
+    export.set_defaults(func=bench_export)
+
+    simulate = subparsers.add_parser("simulation", help="set-based vs per-query damage simulation")
+    simulate.add_argument("--copies", type=int, default=7, help="copies of input/ in the union (5 players each)")
+    simulate.add_argument("--requests", type=int, default=10)
+    simulate.add_argument("--seed", type=int, default=0)
+    simulate.set_defaults(func=bench_simulation)
+
+    optimize = subparsers.add_parser("optimize", help="team assignment optimizer: optimality and union run time")
+    optimize.add_argument("--copies", type=int, default=7, help="copies of input/ in the union (5 players each)")
+    optimize.add_argument("--team-size", type=int, default=5)
+    optimize.add_argument("--budget-ms", type=int, default=5000)
+    optimize.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    optimize.add_argument("--random-cases", type=int, default=300)
+    optimize.add_argument("--seed", type=int, default=0)
+    optimize.set_defaults(func=bench_optimize)
+
+    jobs_check = subparsers.add_parser("jobs", help="upload job under concurrent reads stores every row")
+    jobs_check.add_argument("--copies", type=int, default=4)
+    jobs_check.add_argument("--readers", type=int, default=3)
+    jobs_check.set_defaults(func=check_jobs)
+
+    startup = subparsers.add_parser("startup", help="import and first-use latency in fresh interpreters")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
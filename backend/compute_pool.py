@@ -0,0 +1,48 @@
+"""
+Process pool for the CPU-bound parts of ingest.
+
+The pool is disabled unless COMPUTE_WORKERS is set to a positive number.
+Workers are spawned (not forked) so they never inherit database connections
+or server threads; each one loads the static game catalog once on start-up.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", "0"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    from backend.utils import get_catalog
+    get_catalog()
+
+
+def get_compute_pool(workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the shared process pool, or None when computation should stay in-process.
+    """
+    global _pool
+    workers = COMPUTE_WORKERS if workers is None else workers
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def shutdown_compute_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
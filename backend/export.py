@@ -0,0 +1,197 @@
+"""
+Streaming bulk export of stored characters and equipment lines.
+
+Rows are read through a server-side cursor `EXPORT_BATCH_SIZE` at a time
+and encoded batch by batch, so memory use does not depend on how many
+rows are exported. CSV needs nothing beyond the standard library; Parquet
+and Arrow IPC need pyarrow, which is imported only when one of them is
+requested.
+"""
+import csv
+import io
+import os
+from typing import Iterator, List
+
+from sqlalchemy import Float, func, select, type_coerce
+
+from backend import models, services
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+EXPORT_TABLES = ("characters", "equipments")
+
+# Character columns identifying the character an equipment line belongs to.
+EQUIPMENT_CHARACTER_FIELDS = ("character_id", "name_cn", "element", "element_from_user")
+
+
+def check_format(format: str):
+    """
+    Raises ValueError for unknown formats, or when the format needs pyarrow and it is not installed.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}.")
+    if format != "csv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"format={format} needs the pyarrow package, which is not installed.")
+
+
+def _player_columns() -> dict:
+    return dict(services.PLAYER_FIELDS, **services.UNION_FIELDS)
+
+
+def character_export_query(filters: dict):
+    """
+    Every CharacterResponse field of the characters matching the
+    /api/characters/ filters, in id order.
+    """
+    conditions, _ = services._character_filters(**filters)
+    joined = _player_columns()
+    grade = func.coalesce(models.Character.limit_break_grade, 0)
+    core = func.coalesce(models.Character.core, 0)
+    # Same operations in the same order as the API, so the values match it exactly.
+    joined["breakthrough_coefficient"] = type_coerce(1 + (grade * 0.03) + (core * 0.02), Float)
+    columns = [
+        joined.get(field, getattr(models.Character, field, None)).label(field)
+        for field in services.character_response_fields()
+    ]
+    return (
+        select(*columns)
+        .select_from(models.Character)
+        .outerjoin(models.Player, models.Character.player_id == models.Player.id)
+        .outerjoin(models.Union, models.Player.union_id == models.Union.id)
+        .where(*conditions)
+        .order_by(models.Character.id)
+    )
+
+
+def equipment_export_query(filters: dict):
+    """
+    Equipment lines of the characters matching the /api/characters/ filters,
+    with their character, player and union, in character then line order.
+    """
+    conditions, _ = services._character_filters(**filters)
+    columns = [
+        models.Equipment.id.label("id"),
+        models.Character.id.label("character_db_id"),
+        *(column.label(field) for field, column in _player_columns().items()),
+        *(getattr(models.Character, field).label(field) for field in EQUIPMENT_CHARACTER_FIELDS),
+        models.Equipment.equipment_slot,
+        models.Equipment.function_type,
+        models.Equipment.function_value,
+        models.Equipment.level,
+    ]
+    return (
+        select(*columns)
+        .select_from(models.Equipment)
+        .join(models.Character, models.Equipment.character_id == models.Character.id)
+        .outerjoin(models.Player, models.Character.player_id == models.Player.id)
+        .outerjoin(models.Union, models.Player.union_id == models.Union.id)
+        .where(*conditions)
+        .order_by(models.Character.id, models.Equipment.id)
+    )
+
+
+def _iter_batches(query, batch_size: int) -> Iterator[List[tuple]]:
+    """
+    Yields the rows of `query` in lists of at most `batch_size`, from a
+    session of its own that lives as long as the iteration.
+    """
+    db = models.SessionLocal()
+    try:
+        result = db.connection().execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        try:
+            for partition in result.partitions():
+                yield partition
+        finally:
+            result.close()
+    finally:
+        db.close()
+
+
+def _iter_csv(fields: List[str], batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The byte order mark makes spreadsheet programs read the Chinese names as UTF-8.
+    buffer.write("\ufeff")
+    writer.writerow(fields)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file collecting what pyarrow writes until drain() is called.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema(query):
+    import pyarrow as pa
+
+    arrow_types = {int: pa.int64(), float: pa.float64(), bool: pa.bool_(), str: pa.string()}
+    return pa.schema([
+        (column.name, arrow_types.get(column.type.python_type, pa.string()))
+        for column in query.selected_columns
+    ])
+
+
+def _iter_arrow(format: str, query, batches) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(query)
+    sink = _ChunkSink()
+    if format == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(format: str, table: str, filters: dict, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Validates the request and returns an iterator of the encoded export.
+    Errors in the format, table or filters raise ValueError here, before anything is streamed.
+    """
+    check_format(format)
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"table must be one of: {', '.join(EXPORT_TABLES)}.")
+    query = character_export_query(filters) if table == "characters" else equipment_export_query(filters)
+    batches = _iter_batches(query, batch_size)
+    if format == "csv":
+        return _iter_csv(list(query.selected_columns.keys()), batches)
+    return _iter_arrow(format, query, batches)
@@ -1,15 +1,21 @@
 # backend/final_attack.py
+import os
 
-def translate_class_name(class_en: str) -> str:
-    """
-    将英文职业名称转换为中文。
-    """
-    translation_map = {
-        "Attacker": "火力型",
-        "Supporter": "辅助型",
-        "Defender": "防御型",
-    }
-    return translation_map.get(class_en, "")
+from backend.cache import LRUCache
+from backend.utils import StaticCatalog, get_catalog
+
+SSR_ITEM_ATTACK = 9688
+
+ITEM_RARE_CODES = {"SR": 1, "SSR": 2}
+
+# final_attack 只取决于以下输入，相同组合的角色共用一个缓存条目。
+# 缓存键为 (静态数据版本, *ATTACK_KEY_FIELDS)。
+ATTACK_KEY_FIELDS = (
+    "sync_attack", "grade", "uncapped_favor", "class_index", "coor_level",
+    "item_rare", "item_level", "core", "cube_level",
+)
+ATTACK_CACHE_SIZE = int(os.getenv("ATTACK_CACHE_SIZE", "4096"))
+attack_cache = LRUCache(ATTACK_CACHE_SIZE)
 
 def calculate_base_breakthrough_attack(sync_attack: float, grade: int) -> float:
     """
@@ -17,28 +23,20 @@ def calculate_base_breakthrough_attack(sync_attack: float, grade: int) -> float:
     """
     return sync_attack * (1 + 0.02 * grade) + (20 * grade)
 
-def calculate_favor_rank(grade: int, corporation: str, character_id: int, super_character_ids: list) -> int:
+def calculate_favor_rank(grade: int, corporation: str, character_id: int, catalog: StaticCatalog) -> int:
     """
     计算好感度等级。
     """
     rank = (grade + 1) * 10
-    is_pilgrim = (corporation == 'PILGRIM')
-    is_super = (character_id in super_character_ids)
-    if not is_pilgrim and not is_super:
+    if not catalog.is_uncapped_favor(corporation, character_id):
         return min(rank, 30)
     return rank
 
-def get_favor_attack_bonus(rank: int, character_class_en: str, rank_data: dict) -> float:
+def get_favor_attack_bonus(rank: int, character_class_en: str, catalog: StaticCatalog) -> float:
     """
     根据好感度等级和职业查找攻击力加成。
     """
-    class_cn = translate_class_name(character_class_en)
-    if not class_cn:
-        return 0.0
-    try:
-        return float(rank_data.get(str(rank), {}).get(class_cn, {}).get('attack', 0))
-    except (KeyError, TypeError, ValueError):
-        return 0.0
+    return catalog.favor_attack_for(character_class_en, rank)
 
 def calculate_coor_bonus(coor_level: int) -> int:
     """
@@ -52,74 +50,56 @@ def apply_core_multiplier(current_attack_sum: float, core: int) -> float:
     """
     return current_attack_sum * (1 + 0.02 * core)
 
-def get_equipment_attack(character_class_en: str, equipment_data: dict) -> int:
+def get_equipment_attack(character_class_en: str, catalog: StaticCatalog) -> int:
     """
     获取装备攻击力。
     """
-    key_map = {
-        "Attacker": "attackers",
-        "Defender": "defenders",
-        "Supporter": "supports",
-    }
-    lookup_key = key_map.get(character_class_en)
-    if not lookup_key:
-        return 0
-    return int(equipment_data.get(lookup_key, 0))
+    return catalog.equipment_attack_for(character_class_en)
 
-def get_item_attack(item_rare: str, item_level: int, number_data: dict) -> int:
+def get_item_attack(item_rare: str, item_level: int, catalog: StaticCatalog) -> int:
     """
     根据物品稀有度和等级查找攻击力。
     """
     if item_rare == "SSR":
-        return 9688
+        return SSR_ITEM_ATTACK
     elif item_rare == "SR":
-        item_atk_list = number_data.get("item_atk", [])
-        item_level_idx = item_level - 1
-        if 0 <= item_level_idx < len(item_atk_list):
-            return item_atk_list[item_level_idx]
+        return catalog.sr_item_attack_for(item_level)
     return 0
 
-def get_cube_attack(cube_level: int, cube_data: list) -> int:
+def get_cube_attack(cube_level: int, catalog: StaticCatalog) -> int:
     """
     根据魔方等级查找攻击力。
     """
-    for item in cube_data:
-        if item.get("cube_level") == cube_level:
-            return item.get("atk", 0)
-    return 0
+    return catalog.cube_attack_for(cube_level)
 
 def _prepare_attack_components(
     sync_attack: float,
     grade: int,
     corporation: str,
     character_id: int,
-    super_character_ids: list,
     character_class_en: str,
-    rank_data: dict,
     coor_level: int,
-    equipment_data: dict,
     item_rare: str,
     item_level: int,
-    number_data: dict,
     core: int,
     cube_level: int,
-    cube_data: list
+    catalog: StaticCatalog
 ) -> dict:
     """
     阶段一：准备所有攻击力组件。
     """
     base_breakthrough_attack = calculate_base_breakthrough_attack(sync_attack, grade)
     
-    favor_rank = calculate_favor_rank(grade, corporation, character_id, super_character_ids)
-    favor_attack_bonus = get_favor_attack_bonus(favor_rank, character_class_en, rank_data)
+    favor_rank = calculate_favor_rank(grade, corporation, character_id, catalog)
+    favor_attack_bonus = get_favor_attack_bonus(favor_rank, character_class_en, catalog)
     
     coor_bonus = calculate_coor_bonus(coor_level)
     
-    equipment_attack = get_equipment_attack(character_class_en, equipment_data)
+    equipment_attack = get_equipment_attack(character_class_en, catalog)
     
-    item_attack = get_item_attack(item_rare, item_level, number_data)
+    item_attack = get_item_attack(item_rare, item_level, catalog)
     
-    cube_attack = get_cube_attack(cube_level, cube_data)
+    cube_attack = get_cube_attack(cube_level, catalog)
     
     return {
         "base_breakthrough_attack": base_breakthrough_attack,
@@ -157,27 +137,35 @@ def calculate_final_attack(
     grade: int,
     corporation: str,
     character_id: int,
-    super_character_ids: list,
     character_class_en: str,
-    rank_data: dict,
     coor_level: int,
-    equipment_data: dict,
     item_rare: str,
     item_level: int,
-    number_data: dict,
     core: int,
     cube_level: int,
-    cube_data: list
+    catalog: StaticCatalog = None
 ) -> float:
     """
     主函数：计算最终攻击力。
     """
+    if catalog is None:
+        catalog = get_catalog()
+    key = (
+        catalog.version, sync_attack, grade, catalog.is_uncapped_favor(corporation, character_id),
+        catalog.class_index(character_class_en), coor_level,
+        ITEM_RARE_CODES.get(item_rare, 0), item_level, core, cube_level,
+    )
+    final_attack = attack_cache.get(key)
+    if final_attack is not None:
+        return final_attack
+
     components = _prepare_attack_components(
-        sync_attack, grade, corporation, character_id, super_character_ids,
-        character_class_en, rank_data, coor_level, equipment_data,
-        item_rare, item_level, number_data, core, cube_level, cube_data
+        sync_attack, grade, corporation, character_id,
+        character_class_en, coor_level,
+        item_rare, item_level, core, cube_level, catalog
     )
     
     final_attack = _execute_final_calculation(components)
+    attack_cache.put(key, final_attack)
     
     return final_attack
\ No newline at end of file
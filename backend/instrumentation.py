@@ -0,0 +1,294 @@
+"""
+Per-request instrumentation: latency, SQL statements and phase timings.
+
+InstrumentationMiddleware opens a RequestStats for every HTTP request in a
+context variable. SQLAlchemy engine events count each statement and its
+time against it, and phase() adds named timings. Sync endpoints and
+streaming iterators run in a copy of the request's context, so their work
+is attributed to the request too; background jobs are not.
+
+Every response carries a Server-Timing header with the time until its
+headers were sent, the SQL time and statement count, and the phases so far.
+Totals per route are kept in memory and rendered in the Prometheus text
+format for /metrics. A request running more than SQL_QUERY_WARN_THRESHOLD
+statements is logged as a likely N+1 query pattern.
+
+span() is a sampled trace of one block: it logs the block's duration and
+attributes for TRACE_SAMPLE_RATE of the calls, and with the default rate
+of 0 returns a shared no-op context manager.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+SQL_QUERY_WARN_THRESHOLD = int(os.getenv("SQL_QUERY_WARN_THRESHOLD", "100"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """
+    What one request has spent so far, in seconds.
+    """
+    __slots__ = ("start", "statements", "sql_seconds", "phases")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.phases = {}
+
+    def server_timing(self) -> str:
+        entries = [
+            "app;dur=%.1f" % ((time.perf_counter() - self.start) * 1000),
+            'db;dur=%.1f;desc="%d SQL statement%s"' % (self.sql_seconds * 1000, self.statements, "" if self.statements == 1 else "s"),
+        ]
+        entries.extend("%s;dur=%.1f" % (name, seconds * 1000) for name, seconds in list(self.phases.items()))
+        return ", ".join(entries)
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def record_phase(name: str, seconds: float):
+    """
+    Adds `seconds` to the current request's phase `name`, if there is a request.
+    """
+    stats = _current.get()
+    if stats is not None:
+        stats.phases[name] = stats.phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "start")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stats = _current.get()
+        logger.info(
+            "span %s %.3f ms statements=%s %s", self.name, elapsed * 1000,
+            stats.statements if stats is not None else None, self.attributes,
+        )
+        return False
+
+
+_NO_SPAN = nullcontext()
+
+
+def span(name: str, **attributes):
+    """
+    Context manager logging the duration of its block with `attributes`
+    for a TRACE_SAMPLE_RATE share of the calls; a no-op otherwise.
+    """
+    if TRACE_SAMPLE_RATE <= 0 or (TRACE_SAMPLE_RATE < 1 and random.random() >= TRACE_SAMPLE_RATE):
+        return _NO_SPAN
+    return _Span(name, attributes)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    start = getattr(context, "_instrumentation_start", None)
+    if stats is not None and start is not None:
+        stats.statements += 1
+        stats.sql_seconds += time.perf_counter() - start
+
+
+def install(engine):
+    """
+    Counts the statements `engine` executes against the current request.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class _RouteTotals:
+    __slots__ = ("buckets", "count", "seconds", "statements", "sql_seconds", "over_threshold")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.over_threshold = 0
+
+
+class MetricsRegistry:
+    """
+    Request totals per (method, route template), and response counts per status.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[tuple, _RouteTotals] = {}
+        self._responses: Dict[tuple, int] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats, over_threshold: bool):
+        with self._lock:
+            totals = self._routes.get((method, route))
+            if totals is None:
+                totals = self._routes[(method, route)] = _RouteTotals()
+            totals.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            totals.count += 1
+            totals.seconds += seconds
+            totals.statements += stats.statements
+            totals.sql_seconds += stats.sql_seconds
+            totals.over_threshold += over_threshold
+            key = (method, route, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+            self._responses.clear()
+
+    def render(self, caches: Optional[dict] = None) -> str:
+        """
+        The metrics in the Prometheus text exposition format, with the
+        stats() counters of the given {name: LRUCache} caches.
+        """
+        with self._lock:
+            routes = sorted(self._routes.items())
+            responses = sorted(self._responses.items())
+            snapshot = [
+                (key, list(totals.buckets), totals.count, totals.seconds, totals.statements, totals.sql_seconds, totals.over_threshold)
+                for key, totals in routes
+            ]
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("http_requests_total", "counter", "HTTP responses by route template and status.")
+        for (method, route, status), count in responses:
+            lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+
+        family("http_request_duration_seconds", "histogram", "Time until the response was complete.")
+        for (method, route), buckets, count, seconds, *_ in snapshot:
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {seconds!r}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {count}")
+
+        for name, position, help_text in (
+            ("db_statements_total", 4, "SQL statements executed while serving the route."),
+            ("db_statement_duration_seconds_total", 5, "Time spent in SQL statements while serving the route."),
+            ("http_requests_over_query_threshold_total", 6, "Requests running more than SQL_QUERY_WARN_THRESHOLD statements."),
+        ):
+            family(name, "counter", help_text)
+            for row in snapshot:
+                (method, route) = row[0]
+                lines.append(f'{name}{{method="{method}",route="{_escape(route)}"}} {row[position]!r}')
+
+        if caches:
+            stats = {name: cache.stats() for name, cache in caches.items()}
+            for name, field, kind, help_text in (
+                ("cache_hits_total", "hits", "counter", "In-process cache hits."),
+                ("cache_misses_total", "misses", "counter", "In-process cache misses."),
+                ("cache_evictions_total", "evictions", "counter", "In-process cache evictions."),
+                ("cache_entries", "size", "gauge", "Entries held by the in-process cache."),
+            ):
+                family(name, kind, help_text)
+                for cache_name, values in stats.items():
+                    lines.append(f'{name}{{cache="{_escape(cache_name)}"}} {values[field]}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = MetricsRegistry()
+
+
+def _route_template(scope) -> str:
+    """
+    Path template of the route that served the request, or would have for
+    responses answered before routing (such as response cache hits).
+    """
+    route = scope.get("route")
+    if route is None and "app" in scope:
+        for candidate in scope["app"].router.routes:
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", None) or "unmatched"
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware measuring every HTTP request; see the module docstring.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", stats.server_timing().encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            seconds = time.perf_counter() - stats.start
+            route = _route_template(scope)
+            over_threshold = stats.statements > SQL_QUERY_WARN_THRESHOLD
+            if over_threshold:
+                logger.warning(
+                    "%s %s ran %d SQL statements (threshold %d), likely an N+1 query pattern",
+                    scope["method"], route, stats.statements, SQL_QUERY_WARN_THRESHOLD,
+                )
+            metrics.observe(scope["method"], route, status, seconds, stats, over_threshold)
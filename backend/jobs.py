@@ -0,0 +1,189 @@
+"""
+In-process queue for background upload ingest.
+
+Uploaded files are copied to temporary files so the request can return at
+once; a small thread pool then streams them through services.ingest_files,
+committing one batch at a time. Job state lives in memory only, so jobs
+still queued when the server stops are lost.
+
+Jobs need a session with a connection of its own: on the in-memory SQLite
+database every session shares one connection, and any request closing
+its session would roll back the job's uncommitted batch. Submitting a
+job there raises JobsUnavailable.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from backend import models, services
+
+# SQLite allows one writer at a time, so keep one worker by default.
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+# Finished jobs kept for the progress endpoints before the oldest are dropped.
+MAX_FINISHED_JOBS = int(os.getenv("MAX_FINISHED_JOBS", "100"))
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = None
+
+
+class JobsUnavailable(Exception):
+    pass
+
+
+class IngestJob:
+    """
+    Progress of one queued upload. Mutated by the worker, read by the API.
+    """
+    def __init__(self, union_id: Optional[int], filenames: List[str], force: bool = False):
+        self.id = uuid.uuid4().hex
+        self.union_id = union_id
+        self.force = force
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stats = services.IngestStats()
+        self.files = [{"filename": filename, "status": "pending", "error": None, "timings_ms": {}} for filename in filenames]
+        self._paths = []
+
+    def _file_done(self, index: int, status: str, error: Optional[str], timings: dict):
+        with _jobs_lock:
+            entry = self.files[index]
+            entry["status"] = status
+            entry["error"] = error
+            entry["timings_ms"] = timings
+
+    def as_dict(self) -> dict:
+        with _jobs_lock:
+            files = [dict(entry) for entry in self.files]
+            status = self.status
+            error = self.error
+            finished_at = self.finished_at
+        processed = sum(1 for entry in files if entry["status"] != "pending")
+        return {
+            "job_id": self.id,
+            "status": status,
+            "error": error,
+            "union_id": self.union_id,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": finished_at,
+            "progress": {
+                "total_files": len(files),
+                "processed_files": processed,
+                "successful_files": sum(1 for entry in files if entry["status"] in ("done", "unchanged")),
+                "unchanged_files": sum(1 for entry in files if entry["status"] == "unchanged"),
+                "failed_files": sum(1 for entry in files if entry["status"] == "failed"),
+            },
+            "files": files,
+            "ingest": self.stats.as_dict(),
+        }
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, INGEST_JOB_WORKERS), thread_name_prefix="ingest-job")
+        return _executor
+
+
+def _prune_finished_jobs():
+    finished = sorted(
+        (job for job in _jobs.values() if job.finished_at is not None),
+        key=lambda job: job.finished_at,
+    )
+    for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job.id]
+
+
+def _iter_job_files(job: IngestJob):
+    for path, entry in zip(job._paths, job.files):
+        yield entry["filename"], open(path, "rb")
+
+
+def _run_job(job: IngestJob):
+    with _jobs_lock:
+        job.status = "running"
+        job.started_at = time.time()
+    db = models.SessionLocal()
+    try:
+        services.ingest_files(
+            db, _iter_job_files(job), job.union_id, job.stats,
+            on_file=lambda position, filename, status, error, timings: job._file_done(position, status, error, timings),
+            commit_per_batch=True,
+            force=job.force,
+        )
+        status, error = "succeeded", None
+    except Exception as e:
+        db.rollback()
+        status, error = "failed", str(e)
+    finally:
+        db.close()
+        for path in job._paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        job._paths = []
+
+    with _jobs_lock:
+        if status == "succeeded" and any(entry["status"] == "failed" for entry in job.files):
+            status = "completed_with_errors"
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        _prune_finished_jobs()
+
+
+def submit_upload_job(files, union_id: Optional[int], force: bool = False) -> IngestJob:
+    """
+    Copies (filename, file object) pairs to temporary files and queues them.
+    """
+    if models.SHARED_CONNECTION:
+        raise JobsUnavailable(
+            "Background upload jobs need a database where each session has its own connection. "
+            "Set DATABASE_URL to a SQLite file or a database server, or use /api/upload/."
+        )
+    job = IngestJob(union_id, [filename for filename, _ in files], force)
+    for _, fileobj in files:
+        with tempfile.NamedTemporaryFile(prefix="upload-", suffix=".json", delete=False) as tmp:
+            fileobj.seek(0)
+            shutil.copyfileobj(fileobj, tmp)
+            job._paths.append(tmp.name)
+
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _get_executor().submit(_run_job, job)
+    return job
+
+
+def get_job(job_id: str) -> Optional[IngestJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> list:
+    with _jobs_lock:
+        jobs = sorted(_jobs.values(), key=lambda job: job.created_at, reverse=True)
+    summaries = []
+    for job in jobs:
+        summary = job.as_dict()
+        del summary["files"]
+        summaries.append(summary)
+    return summaries
+
+
+def shutdown_job_workers():
+    global _executor
+    with _jobs_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,24 +1,45 @@
 # Trigger reload
 import json
+import logging
 import os
+import zipfile
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query, Form
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query, Form, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 
-from backend import models, services, schemas
+from backend import export, instrumentation, jobs, models, optimizer, serialization, services, schemas, simulation, utils, versions
+from backend.compute_pool import shutdown_compute_pool
+from backend.final_attack import attack_cache
+from backend.response_cache import ResponseCacheMiddleware, response_cache
 from backend.models import SessionLocal, engine
-from backend.utils import NIKKE_LIST_DATA
 
-models.create_db_and_tables()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    models.create_db_and_tables()
+    yield
+    jobs.shutdown_job_workers()
+    shutdown_compute_pool()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ResponseCacheMiddleware)
+# Outermost, so cached responses are measured as well.
+app.add_middleware(instrumentation.InstrumentationMiddleware)
+instrumentation.install(engine)
 
 
 
 # Dependency to get DB session
-def get_db():
+def get_db(request: Request):
+    # ResponseCacheMiddleware has already opened a session for cached endpoints.
+    db = getattr(request.state, "db", None)
+    if db is not None:
+        yield db
+        return
     db = SessionLocal()
     try:
         yield db
@@ -27,7 +48,7 @@ def get_db():
 
 @app.get("/api/filter-options")
 def get_filter_options():
-    nikkes = NIKKE_LIST_DATA.get('nikkes', [])
+    nikkes = utils.NIKKE_LIST_DATA.get('nikkes', [])
     
     # Use sets to get unique values
     classes = sorted(list(set(n.get('class') for n in nikkes if n.get('class'))))
@@ -43,53 +64,119 @@ def get_filter_options():
     }
 
 @app.post("/api/upload/")
-async def upload_file(files: List[UploadFile] = File(...), union_id: Optional[int] = Form(None), db: Session = Depends(get_db)):
-    successful_files = 0
-    failed_files = 0
-
-    # Step 1: Pre-process to gather all character IDs from all files
-    all_character_ids = set()
-    file_contents = {}
-    for file in files:
-        contents = await file.read()
-        try:
-            data = json.loads(contents)
-            file_contents[file.filename] = data
-            for element, characters_in_element in data.get("elements", {}).items():
-                for char_data in characters_in_element:
-                    if "id" in char_data:
-                        all_character_ids.add(char_data["id"])
-                        if char_data["id"] == 201601: # Rapi: Red Hood
-                            all_character_ids.add(201602)
-        except json.JSONDecodeError:
-            failed_files += 1
-            print(f"Failed to decode JSON from file {file.filename}")
-            continue
-
-    # Step 2: Batch query for CharacterSettings
-    is_c_settings = {}
-    if all_character_ids:
-        settings = db.query(models.CharacterSetting).filter(models.CharacterSetting.character_id.in_(all_character_ids)).all()
-        is_c_settings = {setting.character_id: setting.is_C for setting in settings}
-
-    # Step 3: Process each file using the service layer
-    for file in files:
-        data = file_contents.get(file.filename)
-        if not data:
-            continue # Already handled in pre-processing
+async def upload_file(
+    files: List[UploadFile] = File(...),
+    union_id: Optional[int] = Form(None),
+    force: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    stats = services.IngestStats()
+    error = None
 
+    def ingest():
+        nonlocal stats, error
+        # One transaction per upload: any database error fails every file.
         try:
-            services.process_upload_data(db, data, union_id, is_c_settings)
-            successful_files += 1
+            successful_files, failed_files = services.ingest_files(
+                db, [(file.filename, file.file) for file in files], union_id, stats, force=force
+            )
+            with stats.phase("commit"):
+                db.commit()
+            return successful_files, failed_files
         except Exception as e:
             db.rollback()
-            failed_files += 1
-            print(f"Failed to process file {file.filename}: {e}")
+            logging.exception("Failed to process upload")
+            # Nothing was written: keep the timings but none of the row counts.
+            rolled_back = services.IngestStats()
+            rolled_back.merge(stats, counts=False)
+            stats = rolled_back
+            error = f"Upload rolled back, no file was stored: {e}"
+            return 0, len(files)
+
+    # The ingest is blocking database work, keep it off the event loop.
+    successful_files, failed_files = await run_in_threadpool(ingest)
+    result = {
+        "successful_files": successful_files,
+        "failed_files": failed_files,
+        "unchanged_files": stats.files_unchanged,
+        "ingest": stats.as_dict(),
+    }
+    if error is not None:
+        result["error"] = error
+    return result
+
+@app.post("/api/import/")
+async def import_archive(
+    file: UploadFile = File(...),
+    union_id: Optional[int] = Form(None),
+    format: Optional[str] = Form(None),
+    batch_size: Optional[int] = Form(None),
+    force: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Imports a whole union from one ZIP of player exports or one NDJSON stream
+    (one export per line). Each batch of players is its own transaction.
+    """
+    archive_format = format or services.detect_archive_format(file.filename, file.file)
+    if archive_format not in ("zip", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'zip' or 'ndjson'")
+    if batch_size is not None and batch_size < 1:
+        raise HTTPException(status_code=400, detail="batch_size must be positive")
+
+    stats = services.IngestStats()
+    failures = []
+
+    def on_file(position, filename, status, error, timings):
+        if status == "failed":
+            failures.append({"entry": filename, "error": error})
+
+    def ingest():
+        return services.ingest_files(
+            db, services.iter_archive_files(file.file, archive_format), union_id, stats,
+            on_file=on_file, commit_per_batch=True, force=force, batch_size=batch_size,
+        )
+
+    try:
+        successful_files, failed_files = await run_in_threadpool(ingest)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid ZIP archive")
 
-    return {"successful_files": successful_files, "failed_files": failed_files}
+    return {
+        "format": archive_format,
+        "total_files": successful_files + failed_files,
+        "successful_files": successful_files,
+        "failed_files": failed_files,
+        "unchanged_files": stats.files_unchanged,
+        "failures": failures,
+        "ingest": stats.as_dict(),
+    }
 
-@app.get("/api/characters/", response_model=List[schemas.CharacterResponse])
+@app.post("/api/upload/jobs", status_code=202)
+async def submit_upload_job(files: List[UploadFile] = File(...), union_id: Optional[int] = Form(None), force: bool = Form(False)):
+    """
+    Queues the files for background ingest and returns the job id immediately.
+    """
+    try:
+        job = await run_in_threadpool(jobs.submit_upload_job, [(file.filename, file.file) for file in files], union_id, force)
+    except jobs.JobsUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/api/upload/jobs")
+def list_upload_jobs():
+    return jobs.list_jobs()
+
+@app.get("/api/upload/jobs/{job_id}")
+def get_upload_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.as_dict()
+
+@app.get("/api/characters/", response_model=List[schemas.CharacterResponse], response_model_exclude_unset=True)
 def get_characters(
+    response: Response,
     player_name: Optional[str] = Query(None),
     union_ids: Optional[str] = Query(None),
     character_name: Optional[str] = Query(None),
@@ -99,8 +186,64 @@ def get_characters(
     use_burst_skill: Optional[str] = Query(None),
     sort_by: Optional[str] = Query("absolute_training_degree"),
     order: Optional[str] = Query("desc"),
+    limit: Optional[int] = Query(None, ge=1, le=services.MAX_CHARACTER_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    include_total: bool = Query(False),
+    format: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
+    """
+    Rows are ordered by sort_by, NULLs last, then id. Without limit,
+    cursor, fields or include_total this returns every matching character.
+    character_name matches a case-insensitive substring of the name, with
+    no LIKE wildcards.
+
+    With any of them, only the comma-separated `fields` (plus id) are returned. Pages of
+    `limit` rows continue from the X-Next-Cursor header of the previous
+    page; include_total=true adds the X-Total-Count header.
+
+    format=json streams the same bytes straight from SQL rows without
+    building pydantic models; format=columnar streams
+    {"count": n, "columns": {field: [values, ...]}} instead.
+    """
+    paginated = limit is not None or cursor or fields or include_total
+    filters = {
+        "player_name": player_name, "union_ids": union_ids, "character_name": character_name,
+        "class_": class_, "element": element, "weapon_type": weapon_type, "use_burst_skill": use_burst_skill,
+    }
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
+    if format is not None:
+        if format not in ("json", "columnar"):
+            raise HTTPException(status_code=400, detail="format must be 'json' or 'columnar'.")
+        try:
+            output_fields, rows, next_cursor, total = services.query_character_rows(
+                db, filters, sort_by, order, field_list, limit, cursor, include_total
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if total is not None:
+            headers["X-Total-Count"] = str(total)
+        encode = serialization.iter_json_columns if format == "columnar" else serialization.iter_json_rows
+        return StreamingResponse(encode(output_fields, rows), media_type="application/json", headers=headers)
+
+    if paginated:
+        try:
+            rows, next_cursor, total = services.get_characters_page(
+                db, filters, sort_by, order, field_list, limit, cursor, include_total
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        if total is not None:
+            response.headers["X-Total-Count"] = str(total)
+        return rows
+
     try:
         characters = services.get_characters_service(
             db, player_name, union_ids, character_name, class_, element,
@@ -150,19 +293,46 @@ def get_characters(
         
     return result
 
+@app.get("/api/export/{table}")
+def export_table(
+    table: str,
+    format: str = Query("csv"),
+    player_name: Optional[str] = Query(None),
+    union_ids: Optional[str] = Query(None),
+    character_name: Optional[str] = Query(None),
+    class_: Optional[str] = Query(None, alias="class"),
+    element: Optional[str] = Query(None),
+    weapon_type: Optional[str] = Query(None),
+    use_burst_skill: Optional[str] = Query(None),
+):
+    """
+    Streams every character (table=characters) or equipment line
+    (table=equipments) matching the /api/characters/ filters as csv,
+    parquet or arrow (IPC stream). Parquet and arrow need pyarrow.
+    """
+    filters = {
+        "player_name": player_name, "union_ids": union_ids, "character_name": character_name,
+        "class_": class_, "element": element, "weapon_type": weapon_type, "use_burst_skill": use_burst_skill,
+    }
+    try:
+        chunks = export.iter_export(format, table, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, extension = export.EXPORT_FORMATS[format]
+    return StreamingResponse(
+        chunks, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{extension}"'},
+    )
+
 @app.get("/api/characters/all-unique")
 def get_all_unique_characters(db: Session = Depends(get_db)):
-    # Query for distinct character_id, name_cn, and element from the Character table
-    query = db.query(models.Character.character_id, models.Character.name_cn, models.Character.element, models.Character.element_from_user).distinct()
-    
-    # Execute the query and format the results
-    unique_characters = [
+    # One catalog row per distinct character_id / element_from_user, so this does not grow with the players.
+    entry = models.CharacterCatalogEntry
+    query = db.query(entry.character_id, entry.name_cn, entry.element, entry.element_from_user).order_by(entry.character_id, entry.element_from_user)
+    return [
         {"id": char_id, "name_cn": name_cn, "element": element, "element_from_user": element_from_user}
         for char_id, name_cn, element, element_from_user in query.all()
     ]
-    
-    # Sort the results by character ID
-    return sorted(unique_characters, key=lambda x: x['id'])
 
 @app.get("/api/settings/is-c")
 def get_is_c_settings(db: Session = Depends(get_db)):
@@ -185,6 +355,7 @@ def update_is_c_settings(settings: dict[int, bool], db: Session = Depends(get_db
             models.Character.character_id == char_id
         ).update({"is_C": is_c})
 
+    versions.bump(db, shared=True)
     db.commit()
     return {"status": "success"}
 
@@ -241,10 +412,13 @@ def delete_player(player_name: str, db: Session = Depends(get_db)):
 
     # Delete all characters associated with the player
     # The cascade delete on equipments will handle those
+    services.release_player_characters(db, [player.id])
     db.query(models.Character).filter(models.Character.player_id == player.id).delete()
+    db.query(models.UploadFingerprint).filter(models.UploadFingerprint.player_id == player.id).delete()
 
     # Now delete the player
     db.delete(player)
+    versions.bump(db, [player.union_id])
     
     db.commit()
     return {"status": "success", "message": f"Player {player_name} and all associated data have been deleted."}
@@ -256,9 +430,12 @@ def clear_all_data(db: Session = Depends(get_db)):
         # Start with Equipment, then Character, then Player.
         db.query(models.Equipment).delete()
         db.query(models.Character).delete()
+        db.query(models.CharacterCatalogEntry).delete()
+        db.query(models.UploadFingerprint).delete()
         db.query(models.Player).delete()
         db.query(models.Union).delete()
         db.query(models.CharacterSetting).delete()
+        versions.bump(db, shared=True)
         db.commit()
         return {"status": "success", "message": "All data has been cleared."}
     except Exception as e:
@@ -266,6 +443,66 @@ def clear_all_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"An error occurred while clearing data: {e}")
 
 
+@app.post("/api/admin/recompute")
+def recompute_all_characters(db: Session = Depends(get_db)):
+    """
+    Recomputes final_attack, total_superiority and the training degrees of
+    every stored character from its stored inputs. Characters stored before
+    their cube or coor level was recorded are skipped and reported by player.
+    """
+    result = services.recompute_characters(db)
+    db.commit()
+    return result
+
+
+@app.get("/api/admin/static-data")
+def get_static_data_version():
+    catalog = utils.get_catalog()
+    return {"version": catalog.version, "fingerprint": catalog.fingerprint, "loaded_at": catalog.loaded_at}
+
+
+@app.post("/api/admin/static-data/reload")
+def reload_static_data(expected_version: Optional[int] = Query(None), db: Session = Depends(get_db)):
+    """
+    Reloads the static game data files from disk. When they changed, the
+    catalog version goes up and only the stored characters affected by the
+    change are recomputed. The new data only goes live once they are
+    committed. Pass expected_version to refuse the reload if someone else
+    reloaded in the meantime.
+    """
+    try:
+        return services.reload_static_data_and_recompute(db, expected_version)
+    except utils.StaticDataVersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+def _caches() -> dict:
+    return {
+        "attack_components": attack_cache,
+        "responses": response_cache,
+        "simulations": simulation.simulation_cache,
+    }
+
+
+@app.get("/api/admin/cache-stats")
+def get_cache_stats():
+    """
+    Hit/miss/eviction counters of the in-process caches. With COMPUTE_WORKERS
+    set, ingest computes in worker processes and their caches are not included.
+    """
+    return {name: cache.stats() for name, cache in _caches().items()}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Request latency, SQL statement and cache counters in the Prometheus text format.
+    """
+    return Response(
+        content=instrumentation.metrics.render(_caches()), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/api/players/", response_model=List[dict])
 def get_players(
     union_ids: Optional[str] = Query(None), # Changed from union_id to union_ids
@@ -313,59 +550,28 @@ def get_element_training_analysis(
     training_type: str = Form("relative_training_degree"),
     db: Session = Depends(get_db)
 ):
+    """
+    Per player and element, the sum of training_type times the given
+    coefficient over the characters in character_coefficients
+    ({character_id: coefficient}), computed in one grouped query.
+    """
     try:
         coeffs = json.loads(character_coefficients)
-        character_ids = [int(k) for k in coeffs.keys()]
-    except (json.JSONDecodeError, ValueError):
+    except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid character_coefficients format.")
-
-    if not character_ids:
-        return []
-
-    # 1. Get players
-    player_query = db.query(models.Player)
-    if union_ids:
-        try:
-            union_id_list = [int(uid.strip()) for uid in union_ids.split(',') if uid.strip()]
-            if union_id_list:
-                player_query = player_query.filter(models.Player.union_id.in_(union_id_list))
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid union_ids format.")
-    
-    players = player_query.all()
-    if not players:
-        return []
-
-    player_ids = [p.id for p in players]
-
-    # 2. Get relevant characters for these players
-    characters = db.query(models.Character).filter(
-        models.Character.player_id.in_(player_ids),
-        models.Character.character_id.in_(character_ids)
-    ).all()
-
-    # 3. Initialize results map
-    analysis_results = {
-        p.name: {"player_name": p.name, "elements": {"Fire": 0, "Water": 0, "Wind": 0, "Electronic": 0, "Iron": 0}}
-        for p in players
-    }
-
-    # 4. Process characters
-    for char in characters:
-        coefficient = coeffs.get(str(char.character_id))
-        if coefficient is not None:
-            training_value = getattr(char, training_type, 0)
-            player_name = char.player.name
-            if player_name in analysis_results:
-                analysis_results[player_name]["elements"][char.element] += training_value * float(coefficient)
-
-    return list(analysis_results.values())
+    if not isinstance(coeffs, dict):
+        raise HTTPException(status_code=400, detail="Invalid character_coefficients format.")
+    try:
+        return services.element_training_analysis(db, union_ids, coeffs, training_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Union CRUD
 @app.post("/api/unions/", response_model=dict)
 async def create_union(union: schemas.UnionCreate, db: Session = Depends(get_db)):
     db_union = models.Union(name=union.name)
     db.add(db_union)
+    versions.bump(db)
     db.commit()
     db.refresh(db_union)
     return {"id": db_union.id, "name": db_union.name}
@@ -381,6 +587,7 @@ def update_union(union_id: int, name: str, db: Session = Depends(get_db)):
     if not db_union:
         raise HTTPException(status_code=404, detail="Union not found")
     db_union.name = name
+    versions.bump(db, [union_id])
     db.commit()
     db.refresh(db_union)
     return {"id": db_union.id, "name": db_union.name}
@@ -396,12 +603,13 @@ def delete_union(union_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Cannot delete union with players in it")
 
     db.delete(db_union)
+    versions.bump(db, [union_id])
     db.commit()
     return {"status": "success"}
 
 @app.get("/api/unions/{union_id}/players", response_model=List[dict])
 def get_union_players_temp_for_logging(union_id: int, db: Session = Depends(get_db)):
-    print(f"DIAGNOSIS: Frontend called the incorrect endpoint /api/unions/{union_id}/players.")
+    logging.warning("DIAGNOSIS: Frontend called the incorrect endpoint /api/unions/%s/players.", union_id)
     # This is a temporary endpoint for diagnosis.
     # The correct endpoint is /api/players/?union_ids={union_id}
     # Returning an empty list to prevent frontend errors during diagnosis.
@@ -424,19 +632,64 @@ def get_union_players_temp_for_logging(union_id: int, db: Session = Depends(get_
 @app.post("/api/damage_simulation", response_model=schemas.DamageSimulationResponse)
 def post_damage_simulation(
     request: schemas.DamageSimulationRequest,
+    format: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
     """
     Receives a damage simulation request and returns the calculated results.
+    format=ndjson streams one SimulationPlayerResult per line instead.
     """
+    if format not in (None, "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson'.")
     try:
-        simulation_results = services.run_damage_simulation(db, request)
+        if format == "ndjson":
+            results = simulation.iter_damage_simulation(db, request)
+            return StreamingResponse(
+                serialization.iter_ndjson(result.model_dump() for result in results), media_type="application/x-ndjson"
+            )
+        simulation_results = simulation.run_damage_simulation(db, request)
         return simulation_results
-    except Exception as e:
-        # It's good practice to log the exception here
-        print(f"Error during damage simulation: {e}")
+    except Exception:
+        logging.exception("Error during damage simulation")
         raise HTTPException(status_code=500, detail="An internal error occurred during damage simulation.")
 
+@app.post("/api/damage_simulation/batch", response_model=schemas.BatchSimulationResponse)
+def post_batch_damage_simulation(
+    request: schemas.BatchSimulationRequest, format: Optional[str] = Query(None), db: Session = Depends(get_db)
+):
+    """
+    Evaluates many simulation scenarios (base player, teams, union_ids and
+    an optional hypothetical coor_level each) over one load of the data.
+    format=ndjson streams one SimulationPlayerResult per line instead,
+    with the index and name of its scenario added as "scenario" and "scenario_name".
+    """
+    if format not in (None, "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson'.")
+    try:
+        if format == "ndjson":
+            results = simulation.iter_batch_simulation(db, request)
+            return StreamingResponse(
+                serialization.iter_ndjson(
+                    dict(scenario=index, scenario_name=request.scenarios[index].name, **result.model_dump())
+                    for index, result in results
+                ),
+                media_type="application/x-ndjson",
+            )
+        return simulation.run_batch_simulation(db, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/damage_simulation/optimize", response_model=schemas.TeamOptimizationResponse)
+def post_team_optimization(request: schemas.TeamOptimizationRequest, db: Session = Depends(get_db)):
+    """
+    Splits every union player's characters over the requested teams, no
+    character used twice, for the highest total simulated damage.
+    """
+    try:
+        return optimizer.optimize_teams(db, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Mount static files only in production. In development, frontend is served by Vite.
 if os.getenv("APP_ENV") == "production":
     app.mount("/", StaticFiles(directory="/app/static", html=True), name="static")
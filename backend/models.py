@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean, DateTime, func, inspect, select, text
 from sqlalchemy.orm import relationship, sessionmaker, DeclarativeBase
 from typing import List
 from sqlalchemy.pool import StaticPool
@@ -10,14 +10,22 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///:memory:")
 
 if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool
-    )
+    if ":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:":
+        # An in-memory database lives in its connection, so every session has to share that one.
+        engine = create_engine(
+            DATABASE_URL,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool
+        )
+    else:
+        engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 else:
     engine = create_engine(DATABASE_URL)
 
+# True when all sessions use the same connection: closing any session then
+# rolls back whatever another thread has not committed yet.
+SHARED_CONNECTION = isinstance(engine.pool, StaticPool)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 class Base(DeclarativeBase):
@@ -36,6 +44,7 @@ class Player(Base):
     synchro_level = Column(Integer)
     resilience_cube_level = Column(Integer, default=0)
     bastion_cube_level = Column(Integer, default=0)
+    max_cube_level = Column(Integer, default=0)
     union_id = Column(Integer, ForeignKey("unions.id"))
     union = relationship("Union", back_populates="players")
     characters = relationship("Character", back_populates="player", cascade="all, delete-orphan")
@@ -43,7 +52,7 @@ class Player(Base):
 class Character(Base):
     __tablename__ = "characters"
     id = Column(Integer, primary_key=True, index=True)
-    player_id = Column(Integer, ForeignKey("players.id"))
+    player_id = Column(Integer, ForeignKey("players.id"), index=True)
     character_id = Column(Integer, index=True)
     name_cn = Column(String, index=True)
     element = Column(String)
@@ -55,6 +64,7 @@ class Character(Base):
     core = Column(Integer)
     item_level = Column(Integer)
     item_rare = Column(String)
+    coor_level = Column(Integer, default=0)
     total_stat_atk = Column(Float, default=0.0)
     total_inc_element_dmg = Column(Float, default=0.0)
     total_stat_ammo_load = Column(Float, default=0.0)
@@ -71,6 +81,9 @@ class Character(Base):
     original_rare = Column(String, index=True)
     use_burst_skill = Column(String, index=True)
     is_C = Column(Boolean, default=True, nullable=False)
+
+    # Hash of the upload inputs for this row, used to skip unchanged characters on re-upload
+    content_hash = Column(String)
     
     player = relationship("Player", back_populates="characters")
     equipments = relationship("Equipment", back_populates="character", cascade="all, delete-orphan")
@@ -92,6 +105,83 @@ class CharacterSetting(Base):
     character_id = Column(Integer, unique=True, index=True)
     is_C = Column(Boolean, default=True, nullable=False)
 
+class UploadFingerprint(Base):
+    """
+    Raw-bytes hash of the last upload processed for each player.
+    """
+    __tablename__ = "upload_fingerprints"
+    id = Column(Integer, primary_key=True, index=True)
+    player_id = Column(Integer, ForeignKey("players.id"), unique=True, index=True)
+    content_hash = Column(String, index=True)
+    processed_at = Column(DateTime(timezone=True))
+
+class DataVersion(Base):
+    """
+    Change counters read by the response caches. "global" moves on every
+    write, "shared" on writes that affect every union, and "union:<id>"
+    on writes to that union's players.
+    """
+    __tablename__ = "data_versions"
+    scope = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class CharacterCatalogEntry(Base):
+    """
+    One row per distinct (character_id, element_from_user) among stored
+    characters, with the number of stored characters sharing it. Kept in
+    step with the characters table by the write paths in services.py.
+    """
+    __tablename__ = "character_catalog"
+    character_id = Column(Integer, primary_key=True)
+    element_from_user = Column(String, primary_key=True)
+    name_cn = Column(String)
+    element = Column(String)
+    character_count = Column(Integer, nullable=False, default=0)
+
+def character_catalog_select(where=None):
+    """
+    (character_id, element_from_user, name_cn, element, character_count) of
+    stored characters grouped like character_catalog, optionally narrowed by `where`.
+    """
+    query = (
+        select(
+            Character.character_id,
+            Character.element_from_user,
+            func.min(Character.name_cn),
+            func.min(Character.element),
+            func.count(),
+        )
+        .where(Character.element_from_user.is_not(None))
+        .group_by(Character.character_id, Character.element_from_user)
+    )
+    return query.where(where) if where is not None else query
+
+def _add_missing_columns():
+    """
+    create_all() never alters existing tables, so add columns introduced
+    after a database was created. New columns are all nullable.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
 def create_db_and_tables():
+    had_character_catalog = inspect(engine).has_table(CharacterCatalogEntry.__tablename__)
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    if not had_character_catalog:
+        # Databases created before the catalog existed already hold characters.
+        table = CharacterCatalogEntry.__table__
+        with engine.begin() as conn:
+            conn.execute(table.insert().from_select(
+                ["character_id", "element_from_user", "name_cn", "element", "character_count"],
+                character_catalog_select(),
+            ))
 
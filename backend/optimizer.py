@@ -0,0 +1,243 @@
+"""
+Union Raid team assignment.
+
+For every player of a union, picks which of their characters go into each
+requested team, at most team_size per team and no character in two teams,
+so the summed simulated damage of simulation.py is as high as possible.
+att_weights come from the base player's recorded damage of each candidate
+in each team, so a character can be worth more in one team than another.
+
+Damage is additive per character in that model, which makes the search
+an assignment problem. best_assignment() solves it by branch-and-bound:
+characters are tried in descending order of their best value, starting
+from a greedy solution, and a branch is cut as soon as an upper bound on
+what it can still reach does not beat the best assignment found so far.
+Players are searched in parallel on the compute pool when one is
+configured; every search stops at a shared deadline and then returns the
+best assignment it has, flagged as not proven optimal.
+"""
+import logging
+import os
+import time
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+from backend import instrumentation, schemas, simulation
+from backend.compute_pool import get_compute_pool, shutdown_compute_pool
+
+OPTIMIZER_TIME_BUDGET_MS = int(os.getenv("OPTIMIZER_TIME_BUDGET_MS", "5000"))
+MAX_OPTIMIZER_TIME_BUDGET_MS = 60000
+# Nodes searched between two deadline checks.
+DEADLINE_CHECK_INTERVAL = 1024
+
+
+def _upper_bound(value: float, start: int, free: int, capacities: list, prefix: list, team_lists: list) -> float:
+    """
+    The smaller of two relaxations over the characters from `start` on:
+    the best `free` values regardless of team capacity, and each team
+    filled with its best values regardless of characters being shared.
+    """
+    by_character = prefix[min(len(prefix) - 1, start + free)] - prefix[start]
+    by_team = 0.0
+    for team, capacity in enumerate(capacities):
+        if not capacity:
+            continue
+        for item_value, item in team_lists[team]:
+            if item >= start:
+                by_team += item_value
+                capacity -= 1
+                if not capacity:
+                    break
+    return value + min(by_character, by_team)
+
+
+def best_assignment(values: Sequence[Sequence[Optional[float]]], capacities: Sequence[int], deadline: float) -> tuple:
+    """
+    values[i][t] is what character i adds to team t, None where it cannot
+    go there. Returns (team index or None per character, total value,
+    whether it is proven optimal, nodes searched). The search gives up at
+    `deadline` (time.time()) and returns the best assignment found by then.
+    """
+    options = [
+        sorted(((value, team) for team, value in enumerate(row) if value is not None and value > 0), reverse=True)
+        for row in values
+    ]
+    order = sorted((i for i in range(len(values)) if options[i]), key=lambda i: -options[i][0][0])
+    options = [options[i] for i in order]
+    count = len(order)
+
+    prefix = [0.0]
+    for item_options in options:
+        prefix.append(prefix[-1] + item_options[0][0])
+    team_lists = [[] for _ in capacities]
+    for item, item_options in enumerate(options):
+        for value, team in item_options:
+            team_lists[team].append((value, item))
+    for team_list in team_lists:
+        team_list.sort(reverse=True)
+
+    # Greedy start: every character takes its best team that still has room.
+    caps = list(capacities)
+    best_choice = [None] * count
+    best_value = 0.0
+    for item, item_options in enumerate(options):
+        for value, team in item_options:
+            if caps[team]:
+                caps[team] -= 1
+                best_choice[item] = team
+                best_value += value
+                break
+
+    caps = list(capacities)
+    choice = [None] * count
+    state = {"nodes": 0, "timed_out": False, "best_value": best_value, "best_choice": best_choice}
+
+    def search(item: int, value: float, free: int):
+        state["nodes"] += 1
+        if state["nodes"] % DEADLINE_CHECK_INTERVAL == 0 and time.time() > deadline:
+            state["timed_out"] = True
+        if state["timed_out"]:
+            return
+        if item == count or free == 0:
+            if value > state["best_value"]:
+                state["best_value"] = value
+                state["best_choice"] = list(choice)
+            return
+        if _upper_bound(value, item, free, caps, prefix, team_lists) <= state["best_value"]:
+            return
+        for item_value, team in options[item]:
+            if caps[team]:
+                caps[team] -= 1
+                choice[item] = team
+                search(item + 1, value + item_value, free - 1)
+                caps[team] += 1
+                choice[item] = None
+        search(item + 1, value, free)
+
+    search(0, 0.0, sum(capacities))
+
+    assignment = [None] * len(values)
+    for item, team in enumerate(state["best_choice"]):
+        assignment[order[item]] = team
+    return assignment, state["best_value"], not state["timed_out"], state["nodes"]
+
+
+def _search_players(tasks: List[list], capacities: list, deadline: float, workers: Optional[int] = None) -> list:
+    """
+    best_assignment() for every player's values, on the compute pool when
+    one is configured (or `workers` asks for one). Results come back in
+    task order, None for a search that had not returned by the deadline.
+    """
+    pool = get_compute_pool(workers)
+    if pool is not None and len(tasks) > 1:
+        try:
+            futures = [pool.submit(best_assignment, values, capacities, deadline) for values in tasks]
+            # Searches stop at the deadline themselves; the grace period covers pickling and scheduling.
+            wait(futures, timeout=max(0.0, deadline - time.time()) + 5)
+            return [future.result(timeout=0) if future.done() else None for future in futures]
+        except BrokenProcessPool:
+            logging.exception("Compute pool broke, falling back to in-process optimization")
+            shutdown_compute_pool()
+        except Exception:
+            # Cancelled by a static reload, or a task that failed to pickle: the search
+            # itself is deterministic, so running it here gives the same result or the real error.
+            logging.exception("Compute pool search failed, falling back to in-process optimization")
+    return [best_assignment(values, capacities, deadline) for values in tasks]
+
+
+def optimize_teams(
+    db: Session, request: schemas.TeamOptimizationRequest, workers: Optional[int] = None,
+) -> schemas.TeamOptimizationResponse:
+    """
+    Finds, for every player of the union, the assignment of their
+    characters to request.teams with the highest total simulated damage.
+    Each team's characters are its candidates, with the base player's
+    recorded damage in that team.
+    """
+    if not request.teams:
+        raise ValueError("At least one team is required.")
+    if request.team_size < 1:
+        raise ValueError("team_size must be at least 1.")
+    budget_ms = OPTIMIZER_TIME_BUDGET_MS if request.time_budget_ms is None else request.time_budget_ms
+    if not 0 < budget_ms <= MAX_OPTIMIZER_TIME_BUDGET_MS:
+        raise ValueError(f"time_budget_ms must be between 1 and {MAX_OPTIMIZER_TIME_BUDGET_MS}.")
+    start = time.time()
+    deadline = start + budget_ms / 1000
+
+    with instrumentation.phase("optimize-load"):
+        players = simulation.load_union_players(db, [request.union_id])
+        player_ids = [player.id for player in players]
+        character_ids = sorted(simulation.requested_character_ids(request.teams))
+        rows = simulation.load_character_rows(db, player_ids + [request.base_player_id], set(character_ids))
+    base_rows = {
+        character_id: rows[(request.base_player_id, character_id)]
+        for character_id in character_ids if (request.base_player_id, character_id) in rows
+    }
+    stats = simulation.stats_by_character(player_ids, set(character_ids), rows)
+
+    # damage[t][character_id]: per-player damage of that candidate in team t.
+    damage = []
+    for team in request.teams:
+        att_weights = simulation.att_weights_for([team], base_rows)
+        damage.append({
+            character_id: simulation.member_damage(stats[character_id], team.element, att_weight)
+            for character_id, att_weight in att_weights.items()
+        })
+
+    tasks = []
+    for index in range(len(players)):
+        tasks.append([
+            [
+                team_damage[character_id][index].item()
+                if character_id in team_damage and stats[character_id].owned[index] else None
+                for team_damage in damage
+            ]
+            for character_id in character_ids
+        ])
+    capacities = [request.team_size] * len(request.teams)
+    with instrumentation.phase("optimize-search"):
+        searched = _search_players(tasks, capacities, deadline, workers)
+
+    results = []
+    for index, ((player_id, player_name, *_), values, outcome) in enumerate(zip(players, tasks, searched)):
+        if outcome is None:
+            # The worker missed the deadline entirely; fall back to the greedy assignment.
+            outcome = best_assignment(values, capacities, 0)
+        assignment, _, optimal, nodes = outcome
+        teams = []
+        for team_index, team in enumerate(request.teams):
+            members = sorted(
+                (
+                    (values[position][team_index], character_id)
+                    for position, character_id in enumerate(character_ids) if assignment[position] == team_index
+                ),
+                reverse=True,
+            )
+            teams.append(schemas.OptimizedTeam(
+                element=team.element,
+                total_damage=sum(value for value, _ in members),
+                characters=[
+                    schemas.SimulatedCharacterDetail(
+                        character_id=character_id,
+                        name_cn=stats[character_id].name_cn[index],
+                        simulated_damage=value,
+                    )
+                    for value, character_id in members
+                ],
+            ))
+        results.append(schemas.OptimizedPlayerResult(
+            player_id=player_id,
+            player_name=player_name,
+            total_damage=sum(team.total_damage for team in teams),
+            optimal=optimal,
+            nodes=nodes,
+            teams=teams,
+        ))
+    return schemas.TeamOptimizationResponse(
+        results=results,
+        all_optimal=all(result.optimal for result in results),
+        elapsed_ms=(time.time() - start) * 1000,
+    )
@@ -0,0 +1,167 @@
+"""
+In-process cache and ETags for the read endpoints the frontend refetches.
+
+A response is keyed on its method and path, the query and form parameters
+the endpoint declares (so cache busters such as `_t` do not count), the
+static catalog version and the data versions (see versions.py) of what it
+can contain: "shared" and each requested union when the request is
+narrowed by union_ids, "global" otherwise. Writes bump those versions in
+their own transaction, so cached entries never have to be invalidated;
+stale ones simply stop being asked for and age out of the LRU.
+
+Every cached 200 response carries a weak ETag derived from that key, and
+a request whose If-None-Match matches gets a 304 without touching the
+endpoint.
+
+The versions are read on a session that is then handed to the endpoint
+through the request state (see get_db() in main.py), so a request opens
+one session in all. On in-memory SQLite every session shares a single
+connection and each close is a rollback for all of them.
+"""
+import hashlib
+import os
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.requests import Request
+
+from backend import versions
+from backend.cache import LRUCache
+from backend.models import SessionLocal
+from backend.utils import get_catalog
+
+CACHED_ENDPOINTS = {
+    ("GET", "/api/characters/"),
+    ("GET", "/api/characters/all-unique"),
+    ("GET", "/api/players/"),
+    ("GET", "/api/filter-options"),
+    ("POST", "/api/element-training-analysis/"),
+}
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+response_cache = LRUCache(RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+
+
+def _declared_params(app, path: str) -> tuple:
+    """
+    Aliases of the query and body parameters of the route serving `path`.
+    """
+    for route in app.routes:
+        if getattr(route, "path", None) == path and hasattr(route, "dependant"):
+            return (
+                frozenset(field.alias for field in route.dependant.query_params),
+                frozenset(field.alias for field in route.dependant.body_params),
+            )
+    return frozenset(), frozenset()
+
+
+def version_scopes(union_ids: list) -> list:
+    """
+    Version scopes a response depends on, given the union_ids parameter values of its request.
+    """
+    try:
+        ids = sorted({int(part) for value in union_ids for part in value.split(",") if part.strip()})
+    except ValueError:
+        ids = []
+    if not ids:
+        return [versions.GLOBAL]
+    return [versions.SHARED] + [versions.union_scope(union_id) for union_id in ids]
+
+
+def _read_versions(db, scopes: list) -> tuple:
+    found = versions.get_versions(db, scopes)
+    return tuple(found[scope] for scope in scopes)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI middleware serving CACHED_ENDPOINTS from response_cache.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._params = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in CACHED_ENDPOINTS:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope, receive)
+        body = await request.body()
+        path = scope["path"]
+        if path not in self._params:
+            self._params[path] = _declared_params(scope["app"], path)
+        query_names, body_names = self._params[path]
+
+        params = [(name, value) for name, value in request.query_params.multi_items() if name in query_names]
+        if body_names:
+            async with request.form() as form:
+                params.extend((name, str(value)) for name, value in form.multi_items() if name in body_names)
+        params.sort()
+
+        db = SessionLocal()
+        scope.setdefault("state", {})["db"] = db
+        try:
+            await self._respond(scope, body, path, params, db, receive, send)
+        finally:
+            scope["state"].pop("db", None)
+            await run_in_threadpool(db.close)
+
+    async def _respond(self, scope, body: bytes, path: str, params: list, db, receive, send):
+        scopes = version_scopes([value for name, value in params if name == "union_ids"])
+        key = (scope["method"], path, tuple(params), get_catalog().version, tuple(scopes), await run_in_threadpool(_read_versions, db, scopes))
+        etag = 'W/"%s"' % hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]
+        validators = [(b"etag", etag.encode("latin-1")), (b"cache-control", b"no-cache")]
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            await send({"type": "http.response.start", "status": 304, "headers": validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cached = response_cache.get(key)
+        if cached is not None:
+            status, headers, content = cached
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": content})
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start = {}
+        chunks = []
+        size = 0
+
+        async def capture_send(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                if message["status"] == 200:
+                    message = dict(message, headers=list(message.get("headers", [])) + validators)
+                start.update(message)
+            elif message["type"] == "http.response.body" and start.get("status") == 200:
+                content = message.get("body", b"")
+                size += len(content)
+                if size <= RESPONSE_CACHE_MAX_BYTES:
+                    chunks.append(content)
+                if not message.get("more_body", False) and size <= RESPONSE_CACHE_MAX_BYTES:
+                    content = b"".join(chunks)
+                    headers = [(name, value) for name, value in start["headers"] if name.lower() != b"content-length"]
+                    headers.append((b"content-length", str(len(content)).encode("latin-1")))
+                    response_cache.put(key, (200, headers, content), len(content))
+            await send(message)
+
+        await self.app(scope, replay_receive, capture_send)
@@ -60,7 +60,8 @@ class SimulatedCharacterDetail(BaseModel):
     simulated_damage: float
 
 class SimulatedTeamDamage(BaseModel):
-    total_damage: float
+    # None when the player is missing one of the team's characters.
+    total_damage: Optional[float] = None
     characters: List[SimulatedCharacterDetail]
 
 class SimulationPlayerResult(BaseModel):
@@ -71,5 +72,51 @@ class SimulationPlayerResult(BaseModel):
 class DamageSimulationResponse(BaseModel):
     simulation_results: List[SimulationPlayerResult]
 
+class SimulationScenario(BaseModel):
+    name: Optional[str] = None
+    base_player_id: int
+    union_ids: List[int]
+    teams: List[SimulationTeam]
+    # Hypothetical coor_level for every simulated player's characters; None keeps the stored ones.
+    coor_level: Optional[int] = None
+
+class BatchSimulationRequest(BaseModel):
+    scenarios: List[SimulationScenario]
+
+class ScenarioResult(BaseModel):
+    name: Optional[str] = None
+    simulation_results: List[SimulationPlayerResult]
+
+class BatchSimulationResponse(BaseModel):
+    scenarios: List[ScenarioResult]
+
+class TeamOptimizationRequest(BaseModel):
+    union_id: int
+    base_player_id: int
+    # Each team's characters are its candidates, with the base player's damage in that team.
+    teams: List[SimulationTeam]
+    team_size: int = 5
+    # Wall-clock budget for the whole union; None uses OPTIMIZER_TIME_BUDGET_MS.
+    time_budget_ms: Optional[int] = None
+
+class OptimizedTeam(BaseModel):
+    element: str
+    total_damage: float
+    characters: List[SimulatedCharacterDetail]
+
+class OptimizedPlayerResult(BaseModel):
+    player_id: int
+    player_name: str
+    total_damage: float
+    # False when the time budget ran out before the assignment was proven best.
+    optimal: bool
+    nodes: int
+    teams: List[OptimizedTeam]
+
+class TeamOptimizationResponse(BaseModel):
+    results: List[OptimizedPlayerResult]
+    all_optimal: bool
+    elapsed_ms: float
+
 class UnionCreate(BaseModel):
     name: str
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""
+JSON encoding of plain row tuples, bypassing pydantic models.
+
+The encoder uses the same settings as FastAPI's JSONResponse, so rows
+encoded here produce the same bytes as the equivalent response_model
+output, as long as fields come in model order.
+"""
+from typing import Iterable, Iterator, List, Sequence
+
+import json
+
+_encode = json.JSONEncoder(ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode
+
+ROW_CHUNK_SIZE = 500
+
+
+def iter_json_rows(fields: List[str], rows: Sequence[tuple], chunk_size: int = ROW_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Encodes rows as a JSON array of objects, `chunk_size` rows per yielded chunk.
+    """
+    yield b"["
+    for start in range(0, len(rows), chunk_size):
+        chunk = [dict(zip(fields, row)) for row in rows[start:start + chunk_size]]
+        body = _encode(chunk)[1:-1]
+        yield (body if start == 0 else "," + body).encode("utf-8")
+    yield b"]"
+
+
+def iter_json_columns(fields: List[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    """
+    Encodes rows column by column as {"count": n, "columns": {field: [values, ...], ...}},
+    one column per yielded chunk.
+    """
+    rows = list(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    yield f'{{"count":{len(rows)},"columns":{{'.encode("utf-8")
+    for index, (field, values) in enumerate(zip(fields, columns)):
+        prefix = "" if index == 0 else ","
+        yield f"{prefix}{_encode(field)}:{_encode(list(values))}".encode("utf-8")
+    yield b"}}"
+
+
+def iter_ndjson(objects: Iterable[dict]) -> Iterator[bytes]:
+    """
+    Encodes each object as one line of newline-delimited JSON, one line per yielded chunk.
+    """
+    for obj in objects:
+        yield (_encode(obj) + "\n").encode("utf-8")
@@ -1,45 +1,38 @@
+import base64
+import hashlib
+import io
+import json
 import logging
-from sqlalchemy.orm import Session
+import os
+import time
+import zipfile
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from typing import List, Optional
+
+from sqlalchemy import Float, Integer, and_, bindparam, column, delete, func, insert, literal, literal_column, null, or_, select, union_all, update, values
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session, joinedload
-from backend import models, schemas
-from backend.final_attack import calculate_final_attack
 
-def update_or_create_player(db: Session, player_name: str, synchro_level: int, resilience_cube_level: int, bastion_cube_level: int, union_id: int = None):
+from backend import batch_engine, instrumentation, models, schemas, versions
+from backend.compute_pool import get_compute_pool, shutdown_compute_pool
+from backend.final_attack import attack_cache, calculate_final_attack
+from backend.utils import get_catalog, reload_static_data
+
+def engine_item_level(item_level: Optional[int]) -> int:
     """
-    Updates an existing player or creates a new one.
-    Also deletes old character data for the player to ensure a clean sync.
+    The item level the formulas use for an uploaded or stored one: exports
+    without it, stored as NULL, count as level 1.
     """
-    player = db.query(models.Player).filter(models.Player.name == player_name).first()
+    return 1 if item_level is None else item_level
 
-    if not player:
-        player = models.Player(
-            name=player_name,
-            synchro_level=synchro_level,
-            resilience_cube_level=resilience_cube_level,
-            bastion_cube_level=bastion_cube_level,
-            union_id=union_id
-        )
-        db.add(player)
-        db.commit()
-        db.refresh(player)
-    else:
-        player.synchro_level = synchro_level
-        player.resilience_cube_level = resilience_cube_level
-        player.bastion_cube_level = bastion_cube_level
-        player.union_id = union_id
-        db.commit()
-        # Delete old character data for this player to re-sync
-        db.query(models.Character).filter(models.Character.player_id == player.id).delete()
-        db.commit()
-        
-    return player
-from backend.utils import NIKKE_STATIC_DATA, NUMBER_DATA, RANK_DATA, EQUIPMENT_DATA, SUPER_DATA, CUBE_DATA
 
-def calculate_character_attributes(char_data: dict, sync_level: int, cube_superiority_increase: float,max_cube_level: int, coor_level: int = 0):
+def sum_equipment_stats(char_data: dict):
     """
-    Calculates various character attributes based on raw data and static game data.
-    Returns a dictionary of calculated attributes.
+    Returns (total_stat_atk, total_inc_element_dmg, total_stat_ammo_load) over all equipment lines.
     """
     total_stat_atk = 0
     total_inc_element_dmg = 0
@@ -53,11 +46,21 @@ def calculate_character_attributes(char_data: dict, sync_level: int, cube_superi
                 total_inc_element_dmg += equip_data.get("function_value", 0)
             elif equip_data.get("function_type") == "StatAmmoLoad":
                 total_stat_ammo_load += equip_data.get("function_value", 0)
+    return total_stat_atk, total_inc_element_dmg, total_stat_ammo_load
+
+def calculate_character_attributes(char_data: dict, sync_level: int, cube_superiority_increase: float,max_cube_level: int, coor_level: int = 0):
+    """
+    Calculates various character attributes based on raw data and static game data.
+    Returns a dictionary of calculated attributes.
+    This is the scalar reference for batch_engine.compute_batch().
+    """
+    total_stat_atk, total_inc_element_dmg, total_stat_ammo_load = sum_equipment_stats(char_data)
     
     total_superiority = total_inc_element_dmg + 10 + cube_superiority_increase
 
+    catalog = get_catalog()
     character_id = char_data.get("id")
-    static_data = NIKKE_STATIC_DATA.get(character_id, {})
+    static_data = catalog.character(character_id)
 
     # Calculate breakthrough_coefficient
     grade = char_data.get("limit_break", {}).get("grade", 0) or 0
@@ -65,39 +68,21 @@ def calculate_character_attributes(char_data: dict, sync_level: int, cube_superi
     breakthrough_coefficient = 1 + (grade * 0.03) + (core * 0.02)
 
     # Calculate syncAttack
-    sync_level_idx = sync_level - 1  # Adjust for 0-based index
-    char_class = static_data.get("class")
-    sync_attack_list_name = f"{char_class}_level_attack_list"
-    sync_attack_list = NUMBER_DATA.get(sync_attack_list_name, [])
-    sync_attack = sync_attack_list[sync_level_idx] if sync_level_idx < len(sync_attack_list) else 0
-    
-    # Calculate itemAttack
-    item_rare = char_data.get("item_rare")
-    item_level_idx = char_data.get("item_level", 1) - 1  # Adjust for 0-based index
-    item_attack = 0
-    if item_rare == "SSR":
-        item_attack = 9688
-    elif item_rare == "SR":
-        item_atk_list = NUMBER_DATA.get("item_atk", [])
-        item_attack = item_atk_list[item_level_idx] if item_level_idx < len(item_atk_list) else 0
+    sync_attack = catalog.sync_attack_for(static_data.character_class, sync_level)
 
     # Calculate final_attack
     final_attack = calculate_final_attack(
         sync_attack=sync_attack,
         grade=grade,
-        corporation=static_data.get("corporation"),
+        corporation=static_data.corporation,
         character_id=character_id,
-        super_character_ids=SUPER_DATA.get("super", []),
-        character_class_en=static_data.get("class"),
-        rank_data=RANK_DATA,
+        character_class_en=static_data.character_class,
         coor_level=coor_level,
-        equipment_data=EQUIPMENT_DATA,
-        item_rare=item_rare,
-        item_level=char_data.get("item_level", 1),
-        number_data=NUMBER_DATA,
+        item_rare=char_data.get("item_rare"),
+        item_level=engine_item_level(char_data.get("item_level")),
         core=core,
         cube_level=max_cube_level,
-        cube_data=CUBE_DATA
+        catalog=catalog
     )
 
     # Calculate relative_training_degree and absolute_training_degree
@@ -117,116 +102,81 @@ def calculate_character_attributes(char_data: dict, sync_level: int, cube_superi
         "static_data": static_data,
         "breakthrough_coefficient": breakthrough_coefficient
     }
-def create_character_with_equipment(db: Session, player: models.Player, char_data: dict, attributes: dict, element_from_user: str, is_c_settings: dict):
+RED_HOOD_ID = 201601
+RED_HOOD_VIRTUAL_ID = 201602
+
+# Number of uploaded files parsed and written together before their data is released.
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "8"))
+# Largest single export accepted from a bulk import archive.
+MAX_IMPORT_ENTRY_BYTES = 10 * 1024 * 1024
+# Read size used to skip past the rest of an oversized NDJSON line.
+NDJSON_SKIP_CHUNK_BYTES = 1024 * 1024
+
+
+class IngestStats:
     """
-    Creates a character and its associated equipment in the database.
-    Handles special character logic like Rapi: Red Hood.
+    Collects row counts and per-phase timings for one upload; the phases
+    also go to the current request's Server-Timing as ingest-<phase>.
     """
-    character_id = char_data.get("id")
-    static_data = attributes["static_data"]
-
-    new_char = models.Character(
-        player_id=player.id,
-        character_id=character_id,
-        name_cn=char_data.get("name_cn"),
-        element=static_data.get("element"),
-        element_from_user=element_from_user,
-        skill1_level=char_data.get("skill1_level"),
-        skill2_level=char_data.get("skill2_level"),
-        skill_burst_level=char_data.get("skill_burst_level"),
-        limit_break_grade=char_data.get("limit_break", {}).get("grade"),
-        core=char_data.get("limit_break", {}).get("core"),
-        item_level=char_data.get("item_level"),
-        item_rare=char_data.get("item_rare"),
-        total_stat_atk=attributes["total_stat_atk"],
-        total_inc_element_dmg=attributes["total_inc_element_dmg"],
-        total_stat_ammo_load=attributes["total_stat_ammo_load"],
-        total_superiority=attributes["total_superiority"],
-        final_attack=attributes["final_attack"],
-        absolute_training_degree=attributes["absolute_training_degree"],
-        relative_training_degree=attributes["relative_training_degree"],
-        general_relative_training_degree=attributes["general_relative_training_degree"],
-        class_=static_data.get("class"),
-        corporation=static_data.get("corporation"),
-        weapon_type=static_data.get("weapon_type"),
-        original_rare=static_data.get("original_rare"),
-        use_burst_skill=static_data.get("use_burst_skill"),
-        is_C=is_c_settings.get(character_id, False) if element_from_user == 'Utility' else is_c_settings.get(character_id, True)
+    COUNTERS = (
+        "players_created", "players_updated", "characters_unchanged", "characters_updated",
+        "characters_added", "characters_removed", "equipments_written", "files_unchanged",
     )
-    db.add(new_char)
-    db.commit()
-    db.refresh(new_char)
 
-    for slot, equipments in char_data.get("equipments", {}).items():
-        for equip_data in equipments:
-            new_equip = models.Equipment(
-                character_id=new_char.id,
-                equipment_slot=int(slot),
-                function_type=equip_data.get("function_type"),
-                function_value=equip_data.get("function_value"),
-                level=equip_data.get("level"),
-            )
-            db.add(new_equip)
-    
-    # If the character is "Rapi: Red Hood", create a virtual copy with "Iron" element
-    if character_id == 201601:
-        virtual_char_id = 201602
-        virtual_static_data = NIKKE_STATIC_DATA.get(virtual_char_id, {})
-        if virtual_static_data:
-            virtual_char = models.Character(
-                player_id=player.id,
-                character_id=virtual_char_id,
-                name_cn=virtual_static_data.get("name_cn"),
-                element=virtual_static_data.get("element"),
-                element_from_user="Iron",
-                skill1_level=char_data.get("skill1_level"),
-                skill2_level=char_data.get("skill2_level"),
-                skill_burst_level=char_data.get("skill_burst_level"),
-                limit_break_grade=char_data.get("limit_break", {}).get("grade"),
-                core=char_data.get("limit_break", {}).get("core"),
-                item_level=char_data.get("item_level"),
-                item_rare=char_data.get("item_rare"),
-                total_stat_atk=attributes["total_stat_atk"],
-                total_inc_element_dmg=attributes["total_inc_element_dmg"],
-                total_stat_ammo_load=attributes["total_stat_ammo_load"],
-                total_superiority=attributes["total_superiority"],
-                final_attack=attributes["final_attack"],
-                absolute_training_degree=attributes["absolute_training_degree"],
-                relative_training_degree=attributes["relative_training_degree"],
-                general_relative_training_degree=attributes["general_relative_training_degree"],
-                class_=virtual_static_data.get("class"),
-                corporation=virtual_static_data.get("corporation"),
-                weapon_type=virtual_static_data.get("weapon_type"),
-                original_rare=virtual_static_data.get("original_rare"),
-                use_burst_skill=virtual_static_data.get("use_burst_skill"),
-                is_C=is_c_settings.get(virtual_char_id, True)
-            )
-            db.add(virtual_char)
-            db.commit()
-            db.refresh(virtual_char)
-
-            for slot, equipments in char_data.get("equipments", {}).items():
-                for equip_data in equipments:
-                    new_equip = models.Equipment(
-                        character_id=virtual_char.id,
-                        equipment_slot=int(slot),
-                        function_type=equip_data.get("function_type"),
-                        function_value=equip_data.get("function_value"),
-                        level=equip_data.get("level"),
-                    )
-                    db.add(new_equip)
-    db.commit()
-from backend.utils import CUBE_LEVEL_MAP
+    def __init__(self):
+        self.players_created = 0
+        self.players_updated = 0
+        self.characters_unchanged = 0
+        self.characters_updated = 0
+        self.characters_added = 0
+        self.characters_removed = 0
+        self.equipments_written = 0
+        self.files_unchanged = 0
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            instrumentation.record_phase(f"ingest-{name}", elapsed)
+
+    def merge(self, other: "IngestStats", counts: bool = True):
+        """
+        Adds the timings of `other` to these stats, and its row counts unless counts is False.
+        """
+        if counts:
+            for name in self.COUNTERS:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, seconds in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": {
+                "players_created": self.players_created,
+                "players_updated": self.players_updated,
+                "characters": self.characters_added + self.characters_updated,
+                "equipments": self.equipments_written,
+            },
+            "unchanged_files": self.files_unchanged,
+            "characters": {
+                "unchanged": self.characters_unchanged,
+                "updated": self.characters_updated,
+                "added": self.characters_added,
+                "removed": self.characters_removed,
+            },
+            "timings_ms": {name: round(seconds * 1000, 3) for name, seconds in dict(self.timings).items()},
+        }
+
 
-def process_upload_data(db: Session, data: dict, union_id: int, is_c_settings: dict):
+def extract_cube_levels(data: dict):
     """
-    Processes the entire data from a single uploaded file.
+    Returns (resilience_cube_level, bastion_cube_level, max_cube_level) for a player export.
     """
-    player_name = data.get("name")
-    if not player_name:
-        raise ValueError("Player name not found in data.")
-
-    # Extract cube levels and find the max cube level
     resilience_cube_level = 0
     bastion_cube_level = 0
     max_cube_level = 0
@@ -238,18 +188,163 @@ def process_upload_data(db: Session, data: dict, union_id: int, is_c_settings: d
             resilience_cube_level = cube.get("cube_level", 0)
         elif cube.get("name_cn") == "战术巨熊魔方":
             bastion_cube_level = cube.get("cube_level", 0)
-    
-    cube_superiority_increase = CUBE_LEVEL_MAP.get(max_cube_level, {}).get("IncElementDmg", 0)
-
-    player = update_or_create_player(
-        db,
-        player_name=player_name,
-        synchro_level=data.get("synchroLevel"),
-        resilience_cube_level=resilience_cube_level,
-        bastion_cube_level=bastion_cube_level,
-        union_id=union_id
+    return resilience_cube_level, bastion_cube_level, max_cube_level
+
+
+class CharacterSettingsCache:
+    """
+    is_C settings fetched lazily, one query per batch of character ids not seen yet.
+    """
+    def __init__(self, db: Session, initial: Optional[dict] = None):
+        self.db = db
+        self._values = dict(initial or {})
+        self._loaded = set(self._values)
+
+    def prefetch(self, character_ids):
+        missing = set(character_ids) - self._loaded
+        if not missing:
+            return
+        settings = self.db.query(models.CharacterSetting).filter(models.CharacterSetting.character_id.in_(missing)).all()
+        self._values.update({setting.character_id: setting.is_C for setting in settings})
+        self._loaded |= missing
+
+    def get(self, character_id: int, default: bool) -> bool:
+        return self._values.get(character_id, default)
+
+
+def resolve_is_c(character_id: int, element_from_user: str, is_c_settings: dict) -> bool:
+    """
+    Utility characters default to not being C, everything else defaults to C.
+    """
+    if element_from_user == 'Utility':
+        return is_c_settings.get(character_id, False)
+    return is_c_settings.get(character_id, True)
+
+
+def _character_row(char_data: dict, attributes: dict, character_id: int, name_cn: str, static_data, element_from_user: str) -> dict:
+    return {
+        "character_id": character_id,
+        "name_cn": name_cn,
+        "element": static_data.element,
+        "element_from_user": element_from_user,
+        "skill1_level": char_data.get("skill1_level"),
+        "skill2_level": char_data.get("skill2_level"),
+        "skill_burst_level": char_data.get("skill_burst_level"),
+        "limit_break_grade": char_data.get("limit_break", {}).get("grade"),
+        "core": char_data.get("limit_break", {}).get("core"),
+        "item_level": char_data.get("item_level"),
+        "item_rare": char_data.get("item_rare"),
+        "total_stat_atk": attributes["total_stat_atk"],
+        "total_inc_element_dmg": attributes["total_inc_element_dmg"],
+        "total_stat_ammo_load": attributes["total_stat_ammo_load"],
+        "total_superiority": attributes["total_superiority"],
+        "final_attack": attributes["final_attack"],
+        "absolute_training_degree": attributes["absolute_training_degree"],
+        "relative_training_degree": attributes["relative_training_degree"],
+        "general_relative_training_degree": attributes["general_relative_training_degree"],
+        "class_": static_data.character_class,
+        "corporation": static_data.corporation,
+        "weapon_type": static_data.weapon_type,
+        "original_rare": static_data.original_rare,
+        "use_burst_skill": static_data.use_burst_skill,
+    }
+
+
+def _equipment_rows(char_data: dict) -> list:
+    return [
+        {
+            "equipment_slot": int(slot),
+            "function_type": equip_data.get("function_type"),
+            "function_value": equip_data.get("function_value"),
+            "level": equip_data.get("level"),
+        }
+        for slot, equipments in char_data.get("equipments", {}).items()
+        for equip_data in equipments
+    ]
+
+
+def character_content_hash(char_data: dict, character_id: int, element_from_user: str, player_inputs: dict) -> str:
+    """
+    Hashes every upload input that feeds a character row, so a re-upload can
+    tell which characters actually changed.
+    """
+    payload = {
+        "character_id": character_id,
+        "element_from_user": element_from_user,
+        "name_cn": char_data.get("name_cn"),
+        "skills": [char_data.get("skill1_level"), char_data.get("skill2_level"), char_data.get("skill_burst_level")],
+        "limit_break": char_data.get("limit_break", {}),
+        "item": [char_data.get("item_rare"), char_data.get("item_level")],
+        "equipments": char_data.get("equipments", {}),
+        "coor_level": char_data.get("coor_level", 0),
+        "player": player_inputs,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def build_character_rows(char_data: dict, attributes: dict, element_from_user: str, player_inputs: dict) -> list:
+    """
+    Builds (character_row, equipment_rows) pairs for one uploaded character.
+    Rows carry neither player_id nor is_C; both are filled in when writing.
+    "Rapi: Red Hood" also yields a virtual copy with "Iron" element.
+    """
+    character_id = char_data.get("id")
+    equipment_rows = _equipment_rows(char_data)
+    row = _character_row(char_data, attributes, character_id, char_data.get("name_cn"), attributes["static_data"], element_from_user)
+    row["coor_level"] = char_data.get("coor_level", 0)
+    row["content_hash"] = character_content_hash(char_data, character_id, element_from_user, player_inputs)
+    rows = [(row, equipment_rows)]
+
+    if character_id == RED_HOOD_ID:
+        virtual_static_data = get_catalog().characters.get(RED_HOOD_VIRTUAL_ID)
+        if virtual_static_data:
+            virtual_row = _character_row(char_data, attributes, RED_HOOD_VIRTUAL_ID, virtual_static_data.name_cn, virtual_static_data, "Iron")
+            virtual_row["coor_level"] = row["coor_level"]
+            virtual_row["content_hash"] = character_content_hash(char_data, RED_HOOD_VIRTUAL_ID, "Iron", player_inputs)
+            rows.append((virtual_row, equipment_rows))
+    return rows
+
+
+def character_engine_inputs(char_data: dict, sync_level: int, max_cube_level: int, equipment_stats: tuple) -> tuple:
+    """
+    Encodes an uploaded character for batch_engine, mirroring the arguments
+    calculate_character_attributes() passes to the scalar formulas.
+    """
+    character_id = char_data.get("id")
+    static_data = get_catalog().character(character_id)
+    return batch_engine.character_inputs(
+        sync_level=sync_level,
+        character_class=static_data.character_class,
+        grade=char_data.get("limit_break", {}).get("grade", 0) or 0,
+        core=char_data.get("limit_break", {}).get("core", 0) or 0,
+        corporation=static_data.corporation,
+        character_id=character_id,
+        item_rare=char_data.get("item_rare"),
+        item_level=engine_item_level(char_data.get("item_level")),
+        cube_level=max_cube_level,
+        coor_level=char_data.get('coor_level', 0),
+        total_stat_atk=equipment_stats[0],
+        total_inc_element_dmg=equipment_stats[1],
     )
 
+
+def compute_document_rows(data: dict) -> dict:
+    """
+    Computes the player fields and all character/equipment rows of one export.
+    Pure function of the export and the static game data, no database access.
+    All characters of the export go through batch_engine in one call.
+    """
+    resilience_cube_level, bastion_cube_level, max_cube_level = extract_cube_levels(data)
+    sync_level = data.get("synchroLevel", 1)
+    player_inputs = {
+        "synchro_level": sync_level,
+        "max_cube_level": max_cube_level,
+    }
+
+    catalog = get_catalog()
+    uploaded = []
+    inputs = []
     for element, characters_in_element in data.get("elements", {}).items():
         for char_data in characters_in_element:
             # 新增的过滤逻辑
@@ -259,27 +354,794 @@ def process_upload_data(db: Session, data: dict, union_id: int, is_c_settings: d
             if "id" not in char_data or "name_cn" not in char_data:
                 continue
 
-            coor_level = char_data.get('coor_level', 0)
-            attributes = calculate_character_attributes(
-                char_data=char_data,
-                sync_level=data.get("synchroLevel", 1),
-                cube_superiority_increase=cube_superiority_increase,
-                max_cube_level=max_cube_level,
-                coor_level=coor_level
+            equipment_stats = sum_equipment_stats(char_data)
+            uploaded.append((char_data, element, equipment_stats))
+            inputs.append(character_engine_inputs(char_data, sync_level, max_cube_level, equipment_stats))
+
+    results = batch_engine.compute_batch(batch_engine.to_columns(inputs))
+    results = {name: values.tolist() for name, values in results.items()}
+
+    characters = []
+    for index, (char_data, element, equipment_stats) in enumerate(uploaded):
+        attributes = {
+            "total_stat_atk": equipment_stats[0],
+            "total_inc_element_dmg": equipment_stats[1],
+            "total_stat_ammo_load": equipment_stats[2],
+            "total_superiority": results["total_superiority"][index],
+            "final_attack": results["final_attack"][index],
+            "absolute_training_degree": results["absolute_training_degree"][index],
+            "relative_training_degree": results["relative_training_degree"][index],
+            "general_relative_training_degree": results["general_relative_training_degree"][index],
+            "static_data": catalog.character(char_data.get("id")),
+            "breakthrough_coefficient": results["breakthrough_coefficient"][index],
+        }
+        characters.extend(build_character_rows(char_data, attributes, element, player_inputs))
+
+    return {
+        "player": {
+            "name": data.get("name"),
+            "synchro_level": data.get("synchroLevel"),
+            "resilience_cube_level": resilience_cube_level,
+            "bastion_cube_level": bastion_cube_level,
+            "max_cube_level": max_cube_level,
+        },
+        "characters": characters,
+    }
+
+
+def compute_documents(documents: list) -> list:
+    """
+    Runs compute_document_rows over a batch, fanned out to the compute pool when one is configured.
+    """
+    pool = get_compute_pool()
+    if pool is not None and len(documents) > 1:
+        try:
+            return list(pool.map(compute_document_rows, documents))
+        except BrokenProcessPool:
+            # A worker died; drop the pool so the next batch starts a fresh one.
+            logging.exception("Compute pool broke, falling back to in-process computation")
+            shutdown_compute_pool()
+        except CancelledError:
+            # A static reload shut the pool down under this batch; it is already gone.
+            logging.warning("Compute pool was shut down mid-batch, falling back to in-process computation")
+    return [compute_document_rows(data) for data in documents]
+
+
+def _resolve_players(db: Session, player_rows: list, union_id: Optional[int], stats: IngestStats):
+    """
+    Creates or updates all players of a batch.
+    Returns a mapping of player name to player id, the ids that already
+    existed and the unions those existing players were in before.
+    """
+    names = [row["name"] for row in player_rows]
+    player_ids = {}
+    previous_union_ids = set()
+    for name, player_id, previous_union_id in db.execute(
+        select(models.Player.name, models.Player.id, models.Player.union_id).where(models.Player.name.in_(names))
+    ):
+        player_ids[name] = player_id
+        previous_union_ids.add(previous_union_id)
+
+    existing_rows = [dict(row, id=player_ids[row["name"]], union_id=union_id) for row in player_rows if row["name"] in player_ids]
+    new_rows = [dict(row, union_id=union_id) for row in player_rows if row["name"] not in player_ids]
+
+    if existing_rows:
+        db.execute(update(models.Player), existing_rows)
+
+    if new_rows:
+        player_ids.update(db.execute(
+            insert(models.Player).returning(models.Player.name, models.Player.id),
+            new_rows,
+        ).all())
+
+    stats.players_updated += len(existing_rows)
+    stats.players_created += len(new_rows)
+    return player_ids, [row["id"] for row in existing_rows], previous_union_ids
+
+
+def hash_upload(fileobj) -> str:
+    """
+    SHA-256 of an uploaded file's raw bytes. Leaves the file positioned at the start.
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def find_unchanged_upload(db: Session, content_hash: str, union_id: Optional[int]) -> Optional[str]:
+    """
+    Returns the name of the player whose latest processed upload had exactly
+    these bytes and who is still in the requested union, or None.
+    """
+    query = (
+        select(models.Player.name)
+        .join(models.UploadFingerprint, models.UploadFingerprint.player_id == models.Player.id)
+        .where(models.UploadFingerprint.content_hash == content_hash)
+    )
+    if union_id is None:
+        query = query.where(models.Player.union_id.is_(None))
+    else:
+        query = query.where(models.Player.union_id == union_id)
+    return db.execute(query.limit(1)).scalar()
+
+
+def _record_upload_fingerprints(db: Session, hashes_by_player: dict):
+    """
+    Replaces the fingerprints of the given players. Players ingested without a
+    file hash lose theirs, since their rows no longer match any earlier file.
+    """
+    db.execute(delete(models.UploadFingerprint).where(models.UploadFingerprint.player_id.in_(list(hashes_by_player))))
+    rows = [
+        {"player_id": player_id, "content_hash": content_hash, "processed_at": datetime.now(timezone.utc)}
+        for player_id, content_hash in hashes_by_player.items()
+        if content_hash
+    ]
+    if rows:
+        db.execute(insert(models.UploadFingerprint), rows)
+
+
+def _character_key(row) -> tuple:
+    return (row["player_id"], row["character_id"], row["element_from_user"])
+
+
+def _delete_characters(db: Session, character_ids: list):
+    # Bulk deletes bypass the ORM cascade, so remove equipments explicitly.
+    db.execute(delete(models.Equipment).where(models.Equipment.character_id.in_(character_ids)))
+    db.execute(delete(models.Character).where(models.Character.id.in_(character_ids)))
+
+
+def _upsert(db: Session, table):
+    """
+    The INSERT construct of the session's dialect, which supports ON CONFLICT.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
+def _update_character_catalog(db: Session, deltas: dict, names: dict):
+    """
+    Applies changes to the character_catalog table. `deltas` maps
+    (character_id, element_from_user) to how many stored characters were
+    added (positive) or removed (negative), `names` maps keys to the
+    (name_cn, element) they should show. Counts are adjusted in the
+    database, so concurrent writers do not overwrite each other's changes.
+    Entries left with no characters are dropped.
+    """
+    keys = {key for key in set(deltas) | set(names) if key[1] is not None}
+    if not keys:
+        return
+    entry = models.CharacterCatalogEntry
+    table = entry.__table__
+    params = []
+    for key in keys:
+        name_cn, element = names.get(key, (None, None))
+        params.append({
+            "character_id": key[0], "element_from_user": key[1],
+            "name_cn": name_cn, "element": element, "character_count": deltas.get(key, 0),
+        })
+    statement = _upsert(db, table)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.character_id, table.c.element_from_user],
+            set_={
+                "character_count": table.c.character_count + statement.excluded.character_count,
+                # Keys without a new name keep the stored one.
+                "name_cn": func.coalesce(statement.excluded.name_cn, table.c.name_cn),
+                "element": func.coalesce(statement.excluded.element, table.c.element),
+            },
+        ),
+        params,
+    )
+    if any(values["character_count"] <= 0 for values in params):
+        db.execute(delete(entry).where(
+            entry.character_id.in_({character_id for character_id, _ in keys}),
+            entry.character_count <= 0,
+        ))
+
+
+def release_player_characters(db: Session, player_ids: list):
+    """
+    Takes the characters of the given players out of character_catalog, before they are deleted.
+    """
+    deltas = {
+        (character_id, element_from_user): -count
+        for character_id, element_from_user, count in db.execute(
+            select(models.Character.character_id, models.Character.element_from_user, func.count())
+            .where(models.Character.player_id.in_(player_ids))
+            .group_by(models.Character.character_id, models.Character.element_from_user)
+        )
+    }
+    _update_character_catalog(db, deltas, {})
+
+
+def refresh_character_catalog(db: Session, character_ids):
+    """
+    Rebuilds the character_catalog entries of the given character ids from the stored characters.
+    """
+    character_ids = set(character_ids)
+    if not character_ids:
+        return
+    entry = models.CharacterCatalogEntry
+    db.execute(delete(entry).where(entry.character_id.in_(character_ids)))
+    db.execute(insert(entry).from_select(
+        ["character_id", "element_from_user", "name_cn", "element", "character_count"],
+        models.character_catalog_select(models.Character.character_id.in_(character_ids)),
+    ))
+
+
+def ingest_documents(db: Session, documents: list, union_id: Optional[int], settings: CharacterSettingsCache, stats: Optional[IngestStats] = None, file_hashes: Optional[list] = None) -> IngestStats:
+    """
+    Writes a batch of player exports with multi-row statements.
+    Existing players are diffed against the stored content hashes: only
+    characters whose inputs changed are updated, new ones are inserted and
+    ones missing from the export are deleted.
+    file_hashes, parallel to documents, records each export's raw-bytes hash
+    so a byte-identical re-upload can be skipped later.
+    Nothing is committed here; the caller owns the transaction.
+    """
+    if stats is None:
+        stats = IngestStats()
+
+    for data in documents:
+        if not data.get("name"):
+            raise ValueError("Player name not found in data.")
+
+    with stats.phase("compute"):
+        # A player appearing twice in one batch keeps the last export, like a re-upload would.
+        computed = {}
+        hashes = {}
+        for index, (data, rows) in enumerate(zip(documents, compute_documents(documents))):
+            computed[data["name"]] = rows
+            hashes[data["name"]] = file_hashes[index] if file_hashes else None
+
+    if not computed:
+        return stats
+
+    with stats.phase("resolve_players"):
+        player_ids, existing_player_ids, previous_union_ids = _resolve_players(db, [doc["player"] for doc in computed.values()], union_id, stats)
+        _record_upload_fingerprints(db, {player_ids[name]: content_hash for name, content_hash in hashes.items()})
+        versions.bump(db, previous_union_ids | {union_id})
+
+    with stats.phase("diff"):
+        stored = {}
+        removed = []
+        if existing_player_ids:
+            for row in db.execute(
+                select(
+                    models.Character.id,
+                    models.Character.player_id,
+                    models.Character.character_id,
+                    models.Character.element_from_user,
+                    models.Character.content_hash,
+                ).where(models.Character.player_id.in_(existing_player_ids))
+            ).mappings():
+                key = _character_key(row)
+                if key in stored:
+                    removed.append(row)
+                else:
+                    stored[key] = row
+
+        added = []
+        updated = []
+        for name, doc in computed.items():
+            # An export listing the same character twice under one element keeps
+            # the last entry, so every key maps to one row and one equipment group.
+            entries = {}
+            for row, equipment_rows in doc["characters"]:
+                row = dict(row, player_id=player_ids[name])
+                entries[_character_key(row)] = (row, equipment_rows)
+            for row, equipment_rows in entries.values():
+                current = stored.pop(_character_key(row), None)
+                if current is None:
+                    added.append((row, equipment_rows))
+                elif current["content_hash"] != row["content_hash"]:
+                    updated.append((dict(row, id=current["id"]), equipment_rows))
+                else:
+                    stats.characters_unchanged += 1
+        removed.extend(stored.values())
+
+    with stats.phase("load_settings"):
+        settings.prefetch(row["character_id"] for row, _ in added + updated)
+
+    with stats.phase("write"):
+        for row, _ in added + updated:
+            row["is_C"] = resolve_is_c(row["character_id"], row["element_from_user"], settings)
+
+        catalog_deltas = {}
+        catalog_names = {}
+        for row in removed:
+            key = (row["character_id"], row["element_from_user"])
+            catalog_deltas[key] = catalog_deltas.get(key, 0) - 1
+        for row, _ in added:
+            key = (row["character_id"], row["element_from_user"])
+            catalog_deltas[key] = catalog_deltas.get(key, 0) + 1
+        for row, _ in added + updated:
+            catalog_names[(row["character_id"], row["element_from_user"])] = (row["name_cn"], row["element"])
+        _update_character_catalog(db, catalog_deltas, catalog_names)
+
+        if removed:
+            _delete_characters(db, [row["id"] for row in removed])
+
+        equipment_rows = []
+        if updated:
+            db.execute(update(models.Character), [row for row, _ in updated])
+            db.execute(delete(models.Equipment).where(models.Equipment.character_id.in_([row["id"] for row, _ in updated])))
+            equipment_rows.extend(
+                dict(equip, character_id=row["id"])
+                for row, group in updated
+                for equip in group
             )
-            
-            create_character_with_equipment(
-                db=db,
-                player=player,
-                char_data=char_data,
-                attributes=attributes,
-                element_from_user=element,
-                is_c_settings=is_c_settings
+
+        if added:
+            # Map returned ids back through the natural key instead of relying on
+            # RETURNING order, which SQLite can only guarantee one row at a time.
+            returned = db.execute(
+                insert(models.Character).returning(
+                    models.Character.id,
+                    models.Character.player_id,
+                    models.Character.character_id,
+                    models.Character.element_from_user,
+                ),
+                [row for row, _ in added],
+            ).mappings().all()
+            new_character_ids = {_character_key(row): row["id"] for row in returned}
+            equipment_rows.extend(
+                dict(equip, character_id=new_character_ids[_character_key(row)])
+                for row, group in added
+                for equip in group
             )
 
+        if equipment_rows:
+            db.execute(insert(models.Equipment), equipment_rows)
 
-def get_characters_service(
-   db: Session,
+        stats.characters_added += len(added)
+        stats.characters_updated += len(updated)
+        stats.characters_removed += len(removed)
+        stats.equipments_written += len(equipment_rows)
+
+    return stats
+
+
+class RejectedFile:
+    """
+    Stands in for an upload refused before it was read; ingest_files() fails it with `error`.
+    """
+    def __init__(self, error: str):
+        self.error = error
+
+    def close(self):
+        pass
+
+
+def read_upload_document(filename: str, fileobj) -> dict:
+    """
+    Decodes one uploaded player export from a binary file object.
+    Raises ValueError if the file is not a usable export.
+    """
+    try:
+        data = json.load(fileobj)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError(f"Failed to decode JSON from file {filename}")
+    if not isinstance(data, dict) or not data.get("name"):
+        raise ValueError(f"Failed to process file {filename}: Player name not found in data.")
+    return data
+
+
+def ingest_files(db: Session, files, union_id: Optional[int], stats: Optional[IngestStats] = None, on_file=None, commit_per_batch: bool = False, force: bool = False, batch_size: Optional[int] = None):
+    """
+    Streams (filename, file object) pairs through ingest_documents in batches of
+    batch_size (UPLOAD_BATCH_SIZE by default). Each file is closed once decoded and each batch is
+    dropped once written.
+
+    A file whose bytes match the player's last processed upload is skipped
+    without being parsed, unless force is set.
+
+    By default the caller owns the transaction and any database error is
+    raised. With commit_per_batch every batch is committed on its own and a
+    failing batch only fails its own files; its rows are not counted in stats.
+
+    on_file(position, filename, status, error, timings) is called once per file
+    when its fate is known; status is "done", "unchanged" or "failed".
+    Returns (successful_files, failed_files); unchanged files count as successful.
+    """
+    if stats is None:
+        stats = IngestStats()
+    if batch_size is None:
+        batch_size = UPLOAD_BATCH_SIZE
+    settings = CharacterSettingsCache(db)
+    successful_files = 0
+    failed_files = 0
+    batch = []
+
+    def notify(position, filename, status, error, timings):
+        if on_file is not None:
+            on_file(position, filename, status, error, timings)
+
+    def write_batch():
+        nonlocal successful_files, failed_files
+        start = time.perf_counter()
+        # A batch committed on its own only counts once the commit went through.
+        batch_stats = IngestStats() if commit_per_batch else stats
+        try:
+            ingest_documents(
+                db, [data for _, _, data, _, _ in batch], union_id, settings, batch_stats,
+                file_hashes=[content_hash for _, _, _, content_hash, _ in batch],
+            )
+            if commit_per_batch:
+                with batch_stats.phase("commit"):
+                    db.commit()
+        except Exception as e:
+            if not commit_per_batch:
+                raise
+            db.rollback()
+            stats.merge(batch_stats, counts=False)
+            logging.exception("Failed to write upload batch")
+            failed_files += len(batch)
+            error = f"Failed to process batch: {e}"
+        else:
+            if commit_per_batch:
+                stats.merge(batch_stats)
+            successful_files += len(batch)
+            error = None
+        batch_ms = round((time.perf_counter() - start) * 1000, 3)
+        for position, filename, _, _, parse_ms in batch:
+            notify(position, filename, "failed" if error else "done", error, {"parse_ms": parse_ms, "batch_ms": batch_ms})
+        batch.clear()
+
+    for position, (filename, fileobj) in enumerate(files):
+        if isinstance(fileobj, RejectedFile):
+            failed_files += 1
+            logging.warning(fileobj.error)
+            notify(position, filename, "failed", fileobj.error, {})
+            continue
+        start = time.perf_counter()
+        with stats.phase("dedup"):
+            content_hash = hash_upload(fileobj)
+            unchanged_player = None if force else find_unchanged_upload(db, content_hash, union_id)
+        if unchanged_player is not None:
+            fileobj.close()
+            successful_files += 1
+            stats.files_unchanged += 1
+            notify(position, filename, "unchanged", None, {"dedup_ms": round((time.perf_counter() - start) * 1000, 3)})
+            continue
+
+        with stats.phase("parse"):
+            try:
+                data = read_upload_document(filename, fileobj)
+            except ValueError as e:
+                data = None
+                error = str(e)
+            finally:
+                fileobj.close()
+        parse_ms = round((time.perf_counter() - start) * 1000, 3)
+
+        if data is None:
+            failed_files += 1
+            logging.warning(error)
+            notify(position, filename, "failed", error, {"parse_ms": parse_ms})
+            continue
+
+        batch.append((position, filename, data, content_hash, parse_ms))
+        if len(batch) >= batch_size:
+            write_batch()
+
+    if batch:
+        write_batch()
+    return successful_files, failed_files
+
+
+DERIVED_COLUMNS = (
+    "total_superiority",
+    "final_attack",
+    "absolute_training_degree",
+    "relative_training_degree",
+    "general_relative_training_degree",
+)
+
+
+# Stored character and player columns stored_engine_inputs() reads.
+ENGINE_INPUT_COLUMNS = (
+    models.Character.character_id,
+    models.Character.limit_break_grade,
+    models.Character.core,
+    models.Character.item_rare,
+    models.Character.item_level,
+    models.Character.coor_level,
+    models.Character.total_stat_atk,
+    models.Character.total_inc_element_dmg,
+    models.Player.synchro_level,
+    models.Player.max_cube_level,
+)
+
+
+def missing_engine_inputs(row, coor_level: Optional[int] = None) -> bool:
+    """
+    Whether a row of ENGINE_INPUT_COLUMNS lacks an input stored_engine_inputs()
+    cannot default. Rows stored before max_cube_level and coor_level existed
+    hold NULL there until their player is uploaded again.
+    """
+    return row["max_cube_level"] is None or (coor_level is None and row["coor_level"] is None)
+
+
+def stored_engine_inputs(row, catalog, coor_level: Optional[int] = None) -> tuple:
+    """
+    batch_engine.character_inputs() for a row of ENGINE_INPUT_COLUMNS,
+    optionally with another coor_level than the stored one. The row must
+    not be missing_engine_inputs().
+    """
+    # The virtual Red Hood copy shares the real character's numbers.
+    character_id = RED_HOOD_ID if row["character_id"] == RED_HOOD_VIRTUAL_ID else row["character_id"]
+    static_data = catalog.character(character_id)
+    return batch_engine.character_inputs(
+        sync_level=row["synchro_level"] if row["synchro_level"] is not None else 1,
+        character_class=static_data.character_class,
+        grade=row["limit_break_grade"] or 0,
+        core=row["core"] or 0,
+        corporation=static_data.corporation,
+        character_id=character_id,
+        item_rare=row["item_rare"],
+        item_level=engine_item_level(row["item_level"]),
+        cube_level=row["max_cube_level"],
+        coor_level=row["coor_level"] if coor_level is None else coor_level,
+        total_stat_atk=row["total_stat_atk"] or 0,
+        total_inc_element_dmg=row["total_inc_element_dmg"] or 0,
+        catalog=catalog,
+    )
+
+
+def recompute_characters(db: Session, where=None, batch_size: int = 1000, catalog=None) -> dict:
+    """
+    Recomputes the derived columns of stored characters from their stored
+    inputs (and their player's sync level and cube level) with batch_engine
+    and `catalog` or the live one, writing back only rows whose values
+    changed. `where` optionally narrows the characters considered. Rows missing_engine_inputs() are left as
+    they are and reported with their players. Nothing is committed here.
+    """
+    if catalog is None:
+        catalog = get_catalog()
+    scanned = 0
+    updated = 0
+    skipped = 0
+    skipped_player_ids = set()
+    last_id = 0
+    while True:
+        query = (
+            select(
+                models.Character.id,
+                models.Character.player_id,
+                *ENGINE_INPUT_COLUMNS,
+                *(getattr(models.Character, column) for column in DERIVED_COLUMNS),
+            )
+            .join(models.Player, models.Character.player_id == models.Player.id)
+            .where(models.Character.id > last_id)
+            .order_by(models.Character.id)
+            .limit(batch_size)
+        )
+        if where is not None:
+            query = query.where(where)
+        rows = db.execute(query).mappings().all()
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        scanned += len(rows)
+
+        complete = []
+        for row in rows:
+            if missing_engine_inputs(row):
+                skipped += 1
+                skipped_player_ids.add(row["player_id"])
+            else:
+                complete.append(row)
+        rows = complete
+        if not rows:
+            continue
+
+        inputs = [stored_engine_inputs(row, catalog) for row in rows]
+        results = batch_engine.compute_batch(batch_engine.to_columns(inputs), catalog)
+        results = {column: results[column].tolist() for column in DERIVED_COLUMNS}
+
+        changes = []
+        for index, row in enumerate(rows):
+            values = {column: results[column][index] for column in DERIVED_COLUMNS}
+            if any(row[column] != value for column, value in values.items()):
+                changes.append(dict(values, id=row["id"]))
+        if changes:
+            db.execute(update(models.Character), changes)
+            updated += len(changes)
+
+    if updated:
+        versions.bump(db, shared=True)
+    return {"scanned": scanned, "updated": updated, "skipped": skipped, "skipped_player_ids": sorted(skipped_player_ids)}
+
+
+STATIC_COLUMNS = ("element", "class_", "corporation", "weapon_type", "original_rare", "use_burst_skill")
+
+
+def _update_static_columns(db: Session, catalog, character_ids: set):
+    """
+    Rewrites the list.json fields copied into character rows for the given
+    ids, and name_cn so character_name searches (which match the list.json
+    names) find what the rows show. Ids no longer in list.json keep their name.
+    """
+    if not character_ids:
+        return
+    table = models.Character.__table__
+    params = []
+    for character_id in character_ids:
+        record = catalog.character(character_id)
+        row = {f"new_{column}": getattr(record, "character_class" if column == "class_" else column) for column in STATIC_COLUMNS}
+        row["new_name_cn"] = record.name_cn
+        row["target_character_id"] = character_id
+        params.append(row)
+    values = {column: bindparam(f"new_{column}") for column in STATIC_COLUMNS}
+    values["name_cn"] = func.coalesce(bindparam("new_name_cn"), table.c.name_cn)
+    db.execute(
+        table.update()
+        .where(table.c.character_id == bindparam("target_character_id"))
+        .values(values),
+        params,
+    )
+
+
+def static_change_filter(catalog, changes: dict):
+    """
+    Builds a condition over characters joined with players that selects
+    every row whose derived columns depend on something in `changes`
+    (see StaticCatalog.diff), or None when no row is affected.
+    """
+    def with_virtual(ids):
+        # The virtual Red Hood copy is computed from the real character.
+        return ids | {RED_HOOD_VIRTUAL_ID} if RED_HOOD_ID in ids else ids
+
+    character_ids = set(changes["characters"]) | set(changes["super_ids"])
+    for character_class in changes["favor_classes"] | changes["equipment_classes"]:
+        character_ids |= catalog.character_ids_of_class(character_class)
+
+    conditions = []
+    for character_class, levels in changes["sync_levels"].items():
+        class_ids = catalog.character_ids_of_class(character_class)
+        if levels is None:
+            character_ids |= class_ids
+        elif class_ids - character_ids:
+            conditions.append(and_(
+                models.Character.character_id.in_(sorted(with_virtual(class_ids))),
+                models.Player.synchro_level.in_(sorted(levels)),
+            ))
+    if character_ids:
+        conditions.append(models.Character.character_id.in_(sorted(with_virtual(character_ids))))
+    if changes["sr_item_levels"]:
+        item_level_changed = models.Character.item_level.in_(sorted(changes["sr_item_levels"]))
+        if 1 in changes["sr_item_levels"]:
+            # A NULL item level is computed as level 1, see engine_item_level().
+            item_level_changed = or_(item_level_changed, models.Character.item_level.is_(None))
+        conditions.append(and_(models.Character.item_rare == "SR", item_level_changed))
+    if changes["cube_levels"]:
+        conditions.append(models.Player.max_cube_level.in_(sorted(changes["cube_levels"])))
+    return or_(*conditions) if conditions else None
+
+
+def reload_static_data_and_recompute(db: Session, expected_version: Optional[int] = None, batch_size: int = 1000) -> dict:
+    """
+    Reloads the static JSON files and, if they changed, refreshes the stored
+    characters they affect: list.json fields are rewritten and derived columns
+    recomputed from the stored inputs. Unaffected rows are not touched.
+    The refresh is committed before the new catalog goes live; if it fails,
+    the session is rolled back and the previous catalog stays live.
+    """
+    result = {
+        "changes": {},
+        "static_columns_updated": 0,
+        "recompute": {"scanned": 0, "updated": 0, "skipped": 0, "skipped_player_ids": []},
+    }
+
+    def refresh(previous, current):
+        # Dropped again below if the refresh fails: entries are keyed by catalog version,
+        # and a retry builds the same version number from possibly different files.
+        attack_cache.clear()
+        try:
+            # Cached responses were built from the old catalog's names and attributes.
+            versions.bump(db, shared=True)
+            changes = previous.diff(current)
+            result["changes"] = {
+                name: (
+                    {character_class: sorted(levels) if levels is not None else None for character_class, levels in value.items()}
+                    if isinstance(value, dict) else sorted(value)
+                )
+                for name, value in changes.items()
+            }
+            _update_static_columns(db, current, changes["characters"])
+            refresh_character_catalog(db, changes["characters"])
+            result["static_columns_updated"] = len(changes["characters"])
+
+            where = static_change_filter(current, changes)
+            if where is not None:
+                result["recompute"] = recompute_characters(db, where, batch_size, current)
+            db.commit()
+        except Exception:
+            db.rollback()
+            attack_cache.clear()
+            raise
+
+    previous, current = reload_static_data(expected_version, before_publish=refresh)
+    if previous is not current:
+        # Workers hold their own copy of the static data; the next ingest respawns them.
+        shutdown_compute_pool()
+    return dict(
+        previous_version=previous.version,
+        version=current.version,
+        reloaded=previous is not current,
+        **result,
+    )
+
+
+def detect_archive_format(filename: Optional[str], fileobj) -> str:
+    """
+    Returns "zip" or "ndjson" for a bulk import, from the file signature first and the name second.
+    """
+    fileobj.seek(0)
+    signature = fileobj.read(4)
+    fileobj.seek(0)
+    if signature == b"PK\x03\x04" or (filename or "").lower().endswith(".zip"):
+        return "zip"
+    return "ndjson"
+
+
+def _entry_too_large(name: str, size: int) -> str:
+    return f"Failed to process file {name}: {size} bytes is over the {MAX_IMPORT_ENTRY_BYTES} byte limit for an archive entry."
+
+
+def iter_archive_files(fileobj, archive_format: str):
+    """
+    Yields (name, file object) pairs for every player export in a ZIP of
+    JSON files or an NDJSON stream with one export per line. Entries are
+    read one at a time so only the current export is held in memory.
+    Entries over MAX_IMPORT_ENTRY_BYTES come as a RejectedFile.
+    """
+    if archive_format == "zip":
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".json"):
+                    continue
+                if info.file_size > MAX_IMPORT_ENTRY_BYTES:
+                    # Never inflate oversized entries.
+                    yield info.filename, RejectedFile(_entry_too_large(info.filename, info.file_size))
+                    continue
+                yield info.filename, io.BytesIO(archive.read(info))
+    elif archive_format == "ndjson":
+        fileobj.seek(0)
+        line_number = 0
+        while True:
+            # Bounded reads: an oversized line is skipped in chunks, never held whole.
+            line = fileobj.readline(MAX_IMPORT_ENTRY_BYTES + 1)
+            if not line:
+                break
+            line_number += 1
+            if len(line) > MAX_IMPORT_ENTRY_BYTES:
+                size = len(line)
+                while line and not line.endswith(b"\n"):
+                    line = fileobj.readline(NDJSON_SKIP_CHUNK_BYTES)
+                    size += len(line)
+                yield f"line {line_number}", RejectedFile(_entry_too_large(f"line {line_number}", size))
+            elif line.strip():
+                yield f"line {line_number}", io.BytesIO(line)
+    else:
+        raise ValueError(f"Unsupported import format: {archive_format}")
+
+
+def process_upload_data(db: Session, data: dict, union_id: int, is_c_settings: Optional[dict] = None):
+    """
+    Processes the entire data from a single uploaded file.
+    """
+    stats = ingest_documents(db, [data], union_id, CharacterSettingsCache(db, is_c_settings))
+    db.commit()
+    return stats
+
+
+def _character_filters(
    player_name: Optional[str] = None,
    union_ids: Optional[str] = None,
    character_name: Optional[str] = None,
@@ -287,187 +1149,322 @@ def get_characters_service(
    element: Optional[str] = None,
    weapon_type: Optional[str] = None,
    use_burst_skill: Optional[str] = None,
-   sort_by: str = "absolute_training_degree",
-   order: str = "desc"
-) -> List[models.Character]:
+):
    """
-   Retrieves and filters characters from the database.
+   Returns (conditions, needs_player_join) for the /api/characters/ filters.
    """
-   query = db.query(models.Character).options(joinedload(models.Character.player).joinedload(models.Player.union))
+   conditions = []
+   needs_player = False
 
    if union_ids:
        try:
            union_id_list = [int(uid.strip()) for uid in union_ids.split(',') if uid.strip()]
-           if union_id_list:
-               query = query.join(models.Player).filter(models.Player.union_id.in_(union_id_list))
        except ValueError:
            # Let the caller handle the HTTPException
            raise ValueError("Invalid union_ids format. Must be comma-separated integers.")
+       if union_id_list:
+           conditions.append(models.Player.union_id.in_(union_id_list))
+           needs_player = True
 
    if player_name:
        player_names = [name.strip() for name in player_name.split(',') if name.strip()]
        if player_names:
-           # Ensure we join Player to filter by name
-           query = query.join(models.Player).filter(models.Player.name.in_(player_names))
+           conditions.append(models.Player.name.in_(player_names))
+           needs_player = True
 
    if character_name:
-       query = query.filter(models.Character.name_cn.contains(character_name))
+       # name_cn is copied from the game export, which uses the list.json names (and a
+       # static reload rewrites it), so the search runs over the small static catalog and
+       # the indexed character_id column instead of a LIKE '%...%' scan of every stored
+       # character. Characters missing from list.json are matched on their stored name,
+       # narrowed through character_catalog. Either way `character_name` is a literal,
+       # case-insensitive substring: % and _ are not wildcards.
+       catalog = get_catalog()
+       entry = models.CharacterCatalogEntry
+       unknown_ids = select(entry.character_id).where(entry.character_id.not_in(list(catalog.characters)))
+       conditions.append(or_(
+           models.Character.character_id.in_(catalog.character_ids_matching(character_name)),
+           and_(
+               models.Character.character_id.in_(unknown_ids),
+               func.lower(models.Character.name_cn).contains(character_name.lower(), autoescape=True),
+           ),
+       ))
    if class_:
-       query = query.filter(models.Character.class_ == class_)
+       conditions.append(models.Character.class_ == class_)
    if element:
-       query = query.filter(models.Character.element == element)
+       conditions.append(models.Character.element == element)
    if weapon_type:
-       query = query.filter(models.Character.weapon_type == weapon_type)
+       conditions.append(models.Character.weapon_type == weapon_type)
    if use_burst_skill:
-       query = query.filter(models.Character.use_burst_skill == use_burst_skill)
+       conditions.append(models.Character.use_burst_skill == use_burst_skill)
+   return conditions, needs_player
 
-   sort_column = getattr(models.Character, sort_by, None)
-   if sort_column is None:
+
+def _sort_column(sort_by: str):
+   column = models.Character.__table__.columns.get(sort_by)
+   if column is None:
        raise ValueError(f"Invalid sort key: {sort_by}")
+   return getattr(models.Character, sort_by)
+
+
+def get_characters_service(
+   db: Session,
+   player_name: Optional[str] = None,
+   union_ids: Optional[str] = None,
+   character_name: Optional[str] = None,
+   class_: Optional[str] = None,
+   element: Optional[str] = None,
+   weapon_type: Optional[str] = None,
+   use_burst_skill: Optional[str] = None,
+   sort_by: str = "absolute_training_degree",
+   order: str = "desc"
+) -> List[models.Character]:
+   """
+   Retrieves and filters characters from the database.
+   """
+   query = db.query(models.Character).options(joinedload(models.Character.player).joinedload(models.Player.union))
+
+   conditions, needs_player = _character_filters(
+       player_name, union_ids, character_name, class_, element, weapon_type, use_burst_skill
+   )
+   if needs_player:
+       query = query.join(models.Player)
+   if conditions:
+       query = query.filter(*conditions)
 
+   sort_column = _sort_column(sort_by)
+
+   # NULLs last and id to break ties, the same order query_character_rows() pages through.
    if order == "desc":
-       query = query.order_by(sort_column.desc())
+       query = query.order_by(sort_column.desc().nulls_last(), models.Character.id.desc())
    else:
-       query = query.order_by(sort_column.asc())
+       query = query.order_by(sort_column.asc().nulls_last(), models.Character.id.asc())
        
    return query.all()
 
-def run_damage_simulation(db: Session, request: schemas.DamageSimulationRequest) -> schemas.DamageSimulationResponse:
+
+# CharacterResponse fields served from joined tables or computed after the query.
+PLAYER_FIELDS = {
+    "player_name": models.Player.name,
+    "union_id": models.Player.union_id,
+}
+UNION_FIELDS = {
+    "union_name": models.Union.name,
+}
+COMPUTED_FIELDS = {
+    "breakthrough_coefficient": ("limit_break_grade", "core"),
+}
+MAX_CHARACTER_PAGE_SIZE = 1000
+
+
+def character_response_fields() -> List[str]:
+    return list(schemas.CharacterResponse.model_fields)
+
+
+def encode_character_cursor(sort_by: str, order: str, value, character_db_id: int) -> str:
+    payload = json.dumps([sort_by, order, value, character_db_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_character_cursor(cursor: str, sort_by: str, order: str):
     """
-    Runs the damage simulation based on the provided request data.
-    1. Calculates the 'att_weight' for each character in the base player's teams.
-    2. Fetches all players in the specified union.
-    3. For each player, calculates the simulated damage for each character.
-    4. Assembles and returns the simulation results.
+    Returns (sort value, id) of the last row of the previous page.
     """
-    # Step 1: Calculate att_weight for each base character
-    att_weights = {}
-    for team in request.teams:
-        for char_input in team.characters:
-            base_char_stats = db.query(models.Character).filter(
-                models.Character.player_id == request.base_player_id,
-                models.Character.character_id == char_input.character_id
-            ).first()
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort_by, cursor_order, value, character_db_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if cursor_sort_by != sort_by or cursor_order != order or not isinstance(character_db_id, int):
+        raise ValueError("Cursor does not match the requested sort_by and order.")
+    return value, character_db_id
 
-            if not base_char_stats:
-                continue
 
-            # Avoid division by zero
-            if not base_char_stats.final_attack:
-                att_weights[char_input.character_id] = 0
-                continue
+def _after_cursor(sort_column, descending: bool, value, character_db_id: int):
+    """
+    Rows that come after (value, id) in "sort_column, id" order with NULLs last.
+    """
+    id_column = models.Character.id
+    id_after = id_column < character_db_id if descending else id_column > character_db_id
+    if value is None:
+        return and_(sort_column.is_(None), id_after)
+    # Bound explicitly: comparing a column with a bare True or False only allows '=' and '!='.
+    value = literal(value, sort_column.type)
+    value_after = sort_column < value if descending else sort_column > value
+    return or_(value_after, and_(sort_column == value, id_after), sort_column.is_(None))
 
-            # Determine element_weight
-            element_weight = 1 if base_char_stats.element == team.element else 0
-            
-            # Unwind the formula to find att_weight
-            # damage = final_attack * (1 + total_stat_atk) * (1 + element_weight * total_superiority) * att_weight
-            
-            superiority_multiplier = 1 + (element_weight * (base_char_stats.total_superiority or 0) / 100)
-            attack_multiplier = 1 + ((base_char_stats.total_stat_atk or 0) / 100)
-
-            # Handle potential division by zero
-            denominator = base_char_stats.final_attack * superiority_multiplier * attack_multiplier
-            if denominator == 0:
-                att_weights[char_input.character_id] = 0
-                continue
 
-            # Perform the calculation
-            try:
-                att_weight = char_input.damage / denominator
-                att_weights[char_input.character_id] = att_weight
-                logging.warning(
-                    f"[DEBUG] att_weight calc for char {char_input.character_id}: "
-                    f"att_weight={att_weight}, damage={char_input.damage}, "
-                    f"final_attack={base_char_stats.final_attack}, "
-                    f"sup_multi={superiority_multiplier}, "
-                    f"atk_multi={attack_multiplier}"
-                )
-            except (ZeroDivisionError, TypeError):
-                att_weights[char_input.character_id] = 0
-
-    # Step 2: Fetch all players in the union
-    players_in_union = db.query(models.Player).filter(models.Player.union_id == request.union_id).all()
-
-    # Step 3 & 4: Iterate through players and calculate simulated damage
-    simulation_results = []
-    for player in players_in_union:
-        player_team_damages = {}
-        for team in request.teams:
-            team_total_damage = 0
-            character_details = []
-            team_is_valid = True  # 标志队伍是否完整
-
-            # Get all character stats for the current player in one go
-            player_character_ids = [char.character_id for char in team.characters]
-            player_chars_stats = db.query(models.Character).filter(
-                models.Character.player_id == player.id,
-                models.Character.character_id.in_(player_character_ids)
-            ).all()
-            
-            player_chars_map = {char.character_id: char for char in player_chars_stats}
-
-            for char_input in team.characters:
-                char_id = char_input.character_id
-                att_weight = att_weights.get(char_id)
-
-                # If we don't have a weight, we can't simulate
-                if att_weight is None:
-                    continue
+def query_character_rows(
+    db: Session,
+    filters: dict,
+    sort_by: str = "absolute_training_degree",
+    order: str = "desc",
+    fields: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+):
+    """
+    Selects the requested CharacterResponse fields (plus id) as plain tuples.
 
-                target_char_stats = player_chars_map.get(char_id)
-                
-                # If the player doesn't have this character, the team is invalid
-                if not target_char_stats:
-                    team_is_valid = False
-                    break  # 立即跳出角色循环
+    Rows are ordered by the sort column with NULLs last and then by id, as
+    in get_characters_service(), and `cursor` continues after a previous page.
 
-                if not target_char_stats.final_attack:
-                    simulated_damage = 0
-                else:
-                    element_weight = 1 if target_char_stats.element == team.element else 0
-                    
-                    # Forward calculation
-                    attack_multiplier = (1 + (target_char_stats.total_stat_atk or 0) / 100)
-                    superiority_multiplier_forward = (1 + element_weight * (target_char_stats.total_superiority or 0) / 100)
-                    
-                    logging.warning(
-                        f"[DEBUG] Damage sim for player '{player.name}' char {char_id}: "
-                        f"final_attack={target_char_stats.final_attack}, "
-                        f"attack_multiplier={attack_multiplier}, "
-                        f"sup_multi={superiority_multiplier_forward}, "
-                        f"att_weight={att_weight}"
-                    )
-
-                    simulated_damage = (
-                        target_char_stats.final_attack *
-                        attack_multiplier *
-                        superiority_multiplier_forward *
-                        att_weight
-                    )
-                    # Ensure damage is not negative
-                    simulated_damage = max(0, simulated_damage)
-
-                team_total_damage += simulated_damage
-                character_details.append(schemas.SimulatedCharacterDetail(
-                    character_id=char_id,
-                    name_cn=target_char_stats.name_cn,
-                    simulated_damage=simulated_damage
-                ))
-
-            # 如果队伍不完整，总伤害设为 None
-            if not team_is_valid:
-                team_total_damage = None
-
-            player_team_damages[team.element] = schemas.SimulatedTeamDamage(
-                total_damage=team_total_damage,
-                characters=character_details
-            )
+    Returns (field names in CharacterResponse order, row tuples,
+    next cursor or None, total matching rows or None).
+    """
+    known_fields = character_response_fields()
+    requested = set(fields or known_fields)
+    unknown = sorted(requested.difference(known_fields))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    requested.add("id")
+    output_fields = [field for field in known_fields if field in requested]
+    stored_fields = [field for field in output_fields if field not in COMPUTED_FIELDS]
+    computed_fields = [field for field in output_fields if field in COMPUTED_FIELDS]
 
-        simulation_results.append(schemas.SimulationPlayerResult(
-            player_id=player.id,
-            player_name=player.name,
-            team_damages=player_team_damages
-        ))
+    sort_column = _sort_column(sort_by)
+    descending = order == "desc"
+    conditions, needs_player = _character_filters(**filters)
+
+    selected = {}
+    for field in stored_fields:
+        selected[field] = PLAYER_FIELDS.get(field, UNION_FIELDS.get(field, getattr(models.Character, field, None)))
+    # Inputs of computed fields and the sort value for the cursor follow the output columns.
+    extra_names = [name for field in computed_fields for name in COMPUTED_FIELDS[field]] + [sort_by]
+    for name in extra_names:
+        if name not in selected:
+            selected[name] = getattr(models.Character, name)
+    positions = {name: index for index, name in enumerate(selected)}
+
+    needs_union = any(field in UNION_FIELDS for field in output_fields)
+    needs_player = needs_player or needs_union or any(field in PLAYER_FIELDS for field in output_fields)
+
+    def with_joins(query):
+        if needs_player:
+            query = query.outerjoin(models.Player, models.Character.player_id == models.Player.id)
+        if needs_union:
+            query = query.outerjoin(models.Union, models.Player.union_id == models.Union.id)
+        return query.where(*conditions)
+
+    total = None
+    if include_total:
+        count_query = select(func.count(models.Character.id)).select_from(models.Character)
+        if needs_player:
+            count_query = count_query.outerjoin(models.Player, models.Character.player_id == models.Player.id)
+        total = db.execute(count_query.where(*conditions)).scalar_one()
+
+    query = with_joins(select(*(column.label(name) for name, column in selected.items())).select_from(models.Character))
+    if cursor:
+        value, character_db_id = decode_character_cursor(cursor, sort_by, order)
+        query = query.where(_after_cursor(sort_column, descending, value, character_db_id))
+    if descending:
+        query = query.order_by(sort_column.desc().nulls_last(), models.Character.id.desc())
+    else:
+        query = query.order_by(sort_column.asc().nulls_last(), models.Character.id.asc())
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    # A Core execute on the session's connection skips ORM result processing.
+    rows = db.connection().execute(query).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_character_cursor(sort_by, order, last[positions[sort_by]], last[positions["id"]])
+
+    width = len(stored_fields)
+    if computed_fields:
+        # breakthrough_coefficient is the only computed field.
+        grade_index, core_index = positions["limit_break_grade"], positions["core"]
+        rows = [
+            tuple(row[:width]) + (1 + ((row[grade_index] or 0) * 0.03) + ((row[core_index] or 0) * 0.02),)
+            for row in rows
+        ]
+    elif len(selected) > width:
+        rows = [tuple(row[:width]) for row in rows]
+    return output_fields, rows, next_cursor, total
+
+
+def get_characters_page(
+    db: Session,
+    filters: dict,
+    sort_by: str = "absolute_training_degree",
+    order: str = "desc",
+    fields: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+):
+    """
+    Keyset-paginated, projected variant of get_characters_service().
+    Returns (rows as dicts, next cursor or None, total matching rows or None).
+    """
+    output_fields, rows, next_cursor, total = query_character_rows(
+        db, filters, sort_by, order, fields, limit, cursor, include_total
+    )
+    return [dict(zip(output_fields, row)) for row in rows], next_cursor, total
+
+
+# Character columns /api/element-training-analysis/ can sum.
+TRAINING_TYPES = ("absolute_training_degree", "relative_training_degree", "general_relative_training_degree")
+ANALYSIS_ELEMENTS = ("Fire", "Water", "Wind", "Electronic", "Iron")
+
+
+def element_training_analysis(db: Session, union_ids: Optional[str], coefficients: dict, training_type: str) -> list:
+    """
+    For every player (of the given unions), the sum of training_type times
+    the character's coefficient over their characters listed in
+    `coefficients`, by element. The coefficients are joined in as a VALUES
+    CTE and summed with GROUP BY in a single query, so only one row per
+    player and element leaves the database.
+    """
+    if training_type not in TRAINING_TYPES:
+        raise ValueError(f"training_type must be one of: {', '.join(TRAINING_TYPES)}.")
+    if not coefficients:
+        return []
+    try:
+        coefficient_rows = [(int(key), float(value)) for key, value in coefficients.items() if value is not None]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid character_coefficients format.")
+    conditions = []
+    if union_ids:
+        try:
+            union_id_list = [int(uid.strip()) for uid in union_ids.split(',') if uid.strip()]
+        except ValueError:
+            raise ValueError("Invalid union_ids format.")
+        if union_id_list:
+            conditions.append(models.Player.union_id.in_(union_id_list))
+
+    # Every player gets a row without element, so players without any of the characters are listed with zeros.
+    players = select(models.Player.id, models.Player.name, null(), null()).where(*conditions)
+    if not coefficient_rows:
+        query = players.order_by(models.Player.id)
+    else:
+        coefficient_table = values(
+            column("character_id", Integer), column("coefficient", Float), name="coefficients"
+        ).data(coefficient_rows).cte("coefficients")
+        weighted = (
+            select(
+                models.Player.id,
+                models.Player.name,
+                models.Character.element,
+                func.sum(getattr(models.Character, training_type) * coefficient_table.c.coefficient),
+            )
+            .select_from(models.Character)
+            .join(coefficient_table, coefficient_table.c.character_id == models.Character.character_id)
+            .join(models.Player, models.Character.player_id == models.Player.id)
+            .where(*conditions)
+            .group_by(models.Player.id, models.Player.name, models.Character.element)
+        )
+        query = union_all(players, weighted).order_by(literal_column("1"), literal_column("3"))
 
-    return schemas.DamageSimulationResponse(simulation_results=simulation_results)
\ No newline at end of file
+    results = {}
+    for row in db.connection().execute(query):
+        _, player_name, element, total = row
+        entry = results.get(player_name)
+        if entry is None:
+            entry = results[player_name] = {"player_name": player_name, "elements": dict.fromkeys(ANALYSIS_ELEMENTS, 0)}
+        if element is not None and total is not None:
+            entry["elements"][element] = total
+    return list(results.values())
@@ -0,0 +1,391 @@
+"""
+Set-based damage simulation.
+
+The base player's recorded damage of each team member is unwound into an
+att_weight, which is then applied to the same character of every player
+of a union:
+
+    damage = final_attack * (1 + total_stat_atk / 100)
+             * (1 + element_weight * total_superiority / 100) * att_weight
+
+where element_weight is 1 when the character's element is the team's.
+All characters involved are loaded with one query and each team is
+evaluated for every player at once with NumPy, applying the operations
+in the same order as the scalar formula so results are identical to it.
+
+run_batch_simulation() evaluates many scenarios over one load of every
+player and character they involve. A scenario may set a hypothetical
+coor_level for the simulated players, whose final_attack is then
+recomputed with batch_engine; the base player keeps the stats its
+recorded damage was dealt with.
+
+Results are produced player by player, so the endpoints can stream them
+as NDJSON (format=ndjson) instead of building the whole response first.
+
+Single-request results are kept in simulation_cache, keyed on a hash of
+the request and the data versions (see versions.py) of the simulated
+union, the base player's union and the shared data. Uploads, player
+deletes and is_C changes bump those versions, so a cached result is
+never served once its data has changed; SIMULATION_CACHE_TTL bounds how
+long an unchanged result is kept.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend import batch_engine, instrumentation, models, schemas, services, versions
+from backend.cache import LRUCache
+from backend.utils import get_catalog
+
+SIMULATION_COLUMNS = ("name_cn", "element", "final_attack", "total_stat_atk", "total_superiority")
+MAX_SIMULATION_SCENARIOS = 200
+
+SIMULATION_CACHE_SIZE = int(os.getenv("SIMULATION_CACHE_SIZE", "128"))
+SIMULATION_CACHE_TTL = float(os.getenv("SIMULATION_CACHE_TTL", "600"))
+
+simulation_cache = LRUCache(SIMULATION_CACHE_SIZE, ttl=SIMULATION_CACHE_TTL)
+
+
+class CharacterStats:
+    """
+    Per-player arrays of one character's stats; `owned` is False for players without it.
+    """
+    __slots__ = ("owned", "name_cn", "element", "final_attack", "total_stat_atk", "total_superiority")
+
+    def __init__(self, player_count: int):
+        self.owned = np.zeros(player_count, dtype=bool)
+        self.name_cn = [None] * player_count
+        self.element = [None] * player_count
+        self.final_attack = np.zeros(player_count)
+        self.total_stat_atk = np.zeros(player_count)
+        self.total_superiority = np.zeros(player_count)
+
+
+def requested_character_ids(teams: List[schemas.SimulationTeam]) -> set:
+    return {char_input.character_id for team in teams for char_input in team.characters}
+
+
+def load_union_players(db: Session, union_ids: Iterable[int]) -> list:
+    """
+    (id, name, union_id) of the players of the given unions in id order.
+    """
+    return db.execute(
+        select(models.Player.id, models.Player.name, models.Player.union_id)
+        .where(models.Player.union_id.in_(set(union_ids)))
+        .order_by(models.Player.id)
+    ).all()
+
+
+def load_character_rows(db: Session, player_ids: Iterable[int], character_ids: set, engine_inputs: bool = False) -> Dict[tuple, tuple]:
+    """
+    Maps (player_id, character_id) to a tuple of the character's
+    SIMULATION_COLUMNS, in a single query. With engine_inputs the tuple
+    ends with a mapping of its services.ENGINE_INPUT_COLUMNS. A character
+    the export lists under two elements keeps its lowest row id; both rows
+    hold the same stats.
+    """
+    player_ids = set(player_ids)
+    if not player_ids or not character_ids:
+        return {}
+    query = select(
+        models.Character.player_id,
+        models.Character.character_id,
+        *(getattr(models.Character, column) for column in SIMULATION_COLUMNS),
+    )
+    if engine_inputs:
+        query = query.add_columns(
+            *(column for column in services.ENGINE_INPUT_COLUMNS if column is not models.Character.character_id)
+        ).join(models.Player, models.Character.player_id == models.Player.id)
+    # A Core execute on the session's connection skips ORM result processing.
+    rows = db.connection().execute(
+        query.where(
+            models.Character.player_id.in_(player_ids),
+            models.Character.character_id.in_(character_ids),
+        )
+        .order_by(models.Character.id)
+    ).all()
+    found = {}
+    for row in rows:
+        key = (row[0], row[1])
+        if key not in found:
+            values = tuple(row[2:2 + len(SIMULATION_COLUMNS)])
+            found[key] = values + (row._mapping,) if engine_inputs else values
+    return found
+
+
+def check_what_if_inputs(rows: Dict[tuple, tuple], coor_level: int):
+    """
+    Raises ValueError naming the players whose rows, loaded with
+    engine_inputs, lack an input the what-if would otherwise have to guess.
+    """
+    incomplete = sorted({key[0] for key, row in rows.items() if services.missing_engine_inputs(row[-1], coor_level)})
+    if incomplete:
+        raise ValueError(
+            f"Players {incomplete} were stored without a cube level; upload them again before a coor_level what-if."
+        )
+
+
+def what_if_final_attack(rows: Dict[tuple, tuple], coor_level: int) -> Dict[tuple, float]:
+    """
+    final_attack of every row, loaded with engine_inputs, recomputed as if its
+    coor_level were `coor_level`. Rows must have passed check_what_if_inputs().
+    """
+    if not rows:
+        return {}
+    catalog = get_catalog()
+    inputs = [services.stored_engine_inputs(row[-1], catalog, coor_level) for row in rows.values()]
+    final_attack = batch_engine.compute_batch(batch_engine.to_columns(inputs))["final_attack"].tolist()
+    return dict(zip(rows, final_attack))
+
+
+def att_weights_for(teams: List[schemas.SimulationTeam], base_rows: Dict[int, tuple]) -> Dict[int, float]:
+    """
+    att_weight of every team member the base player owns, keyed by character id.
+    A character listed in several teams keeps the weight of the last one.
+    """
+    att_weights = {}
+    for team in teams:
+        for char_input in team.characters:
+            base = base_rows.get(char_input.character_id)
+            if base is None:
+                continue
+            _, element, final_attack, total_stat_atk, total_superiority = base[:len(SIMULATION_COLUMNS)]
+            if not final_attack:
+                att_weights[char_input.character_id] = 0
+                continue
+
+            element_weight = 1 if element == team.element else 0
+            superiority_multiplier = 1 + (element_weight * (total_superiority or 0) / 100)
+            attack_multiplier = 1 + ((total_stat_atk or 0) / 100)
+            denominator = final_attack * superiority_multiplier * attack_multiplier
+            if denominator == 0:
+                att_weights[char_input.character_id] = 0
+                continue
+            att_weights[char_input.character_id] = char_input.damage / denominator
+    return att_weights
+
+
+def stats_by_character(
+    player_ids: list, character_ids: set, rows: Dict[tuple, tuple], final_attack: Optional[Dict[tuple, float]] = None,
+) -> Dict[int, CharacterStats]:
+    """
+    One CharacterStats per character id for the given players, with
+    final_attack taken from `final_attack` instead of the rows when given.
+    """
+    positions = {player_id: index for index, player_id in enumerate(player_ids)}
+    stats = {character_id: CharacterStats(len(player_ids)) for character_id in character_ids}
+    for key, row in rows.items():
+        player_id, character_id = key
+        index = positions.get(player_id)
+        entry = stats.get(character_id)
+        if index is None or entry is None:
+            continue
+        name_cn, element, stored_final_attack, total_stat_atk, total_superiority = row[:len(SIMULATION_COLUMNS)]
+        entry.owned[index] = True
+        entry.name_cn[index] = name_cn
+        entry.element[index] = element
+        value = stored_final_attack if final_attack is None else final_attack[key]
+        entry.final_attack[index] = value or 0
+        entry.total_stat_atk[index] = total_stat_atk or 0
+        entry.total_superiority[index] = total_superiority or 0
+    return stats
+
+
+def member_damage(entry: CharacterStats, team_element: str, att_weight: float) -> np.ndarray:
+    """
+    Per-player damage of one character placed in a team of `team_element`.
+    """
+    element_weight = np.array([1 if element == team_element else 0 for element in entry.element])
+    attack_multiplier = 1 + entry.total_stat_atk / 100
+    superiority_multiplier = 1 + element_weight * entry.total_superiority / 100
+    damage = entry.final_attack * attack_multiplier * superiority_multiplier * att_weight
+    return np.where((entry.final_attack != 0) & (damage > 0), damage, 0.0)
+
+
+def simulate_team(team: schemas.SimulationTeam, att_weights: Dict[int, float], stats: Dict[int, CharacterStats], player_count: int):
+    """
+    Evaluates one team for every player.
+    Returns the list of (character_id, per-player damages) of the members
+    with a weight, in team order, how many of them each player gets
+    credited for (members before their first missing one), and each
+    player's total damage, NaN where a member is missing.
+    """
+    members = []
+    credited = np.zeros(player_count, dtype=np.int64)
+    complete = np.ones(player_count, dtype=bool)
+    total = np.zeros(player_count)
+    for char_input in team.characters:
+        att_weight = att_weights.get(char_input.character_id)
+        if att_weight is None:
+            continue
+        entry = stats[char_input.character_id]
+        damage = member_damage(entry, team.element, att_weight)
+
+        complete &= entry.owned
+        credited += complete
+        total = total + damage
+        members.append((char_input.character_id, damage))
+    return members, credited, np.where(complete, total, np.nan)
+
+
+def iter_player_results(
+    players: list, base_player_id: int, teams: List[schemas.SimulationTeam], rows: Dict[tuple, tuple],
+    final_attack: Optional[Dict[tuple, float]] = None,
+) -> Iterator[schemas.SimulationPlayerResult]:
+    """
+    Simulates `teams` for `players` ((id, name, ...) rows) from loaded
+    character rows, yielding each player's result in player order.
+    A team is incomplete for a player missing one of its weighted members;
+    its total_damage is then None and only the members before the missing one are listed.
+    """
+    with instrumentation.phase("simulation"), instrumentation.span("simulation", teams=len(teams), players=len(players)) as trace:
+        player_ids = [player[0] for player in players]
+        character_ids = requested_character_ids(teams)
+        base_rows = {character_id: rows[(base_player_id, character_id)] for character_id in character_ids if (base_player_id, character_id) in rows}
+        att_weights = att_weights_for(teams, base_rows)
+        stats = stats_by_character(player_ids, character_ids, rows, final_attack)
+        if trace is not None:
+            trace.attributes["att_weights"] = att_weights
+
+        team_results = [(team.element, simulate_team(team, att_weights, stats, len(players))) for team in teams]
+
+    for index, (player_id, player_name, *_) in enumerate(players):
+        team_damages = {}
+        for element, (members, credited, total) in team_results:
+            team_damages[element] = schemas.SimulatedTeamDamage(
+                total_damage=None if np.isnan(total[index]) else total[index].item(),
+                characters=[
+                    schemas.SimulatedCharacterDetail(
+                        character_id=character_id,
+                        name_cn=stats[character_id].name_cn[index],
+                        simulated_damage=damage[index].item(),
+                    )
+                    for character_id, damage in members[:credited[index]]
+                ],
+            )
+        yield schemas.SimulationPlayerResult(
+            player_id=player_id,
+            player_name=player_name,
+            team_damages=team_damages,
+        )
+
+
+def simulate_players(
+    players: list, base_player_id: int, teams: List[schemas.SimulationTeam], rows: Dict[tuple, tuple],
+    final_attack: Optional[Dict[tuple, float]] = None,
+) -> List[schemas.SimulationPlayerResult]:
+    return list(iter_player_results(players, base_player_id, teams, rows, final_attack))
+
+
+def simulation_cache_key(db: Session, request: schemas.DamageSimulationRequest) -> tuple:
+    """
+    Cache key of `request`: a hash of its canonical JSON, the static
+    catalog version and the current data versions it depends on. A base
+    player without a union is covered by the global version instead.
+    """
+    canonical = json.dumps(request.model_dump(), sort_keys=True, separators=(",", ":"))
+    base_union_id = db.scalar(select(models.Player.union_id).where(models.Player.id == request.base_player_id))
+    scopes = [versions.SHARED, versions.union_scope(request.union_id)]
+    scopes.append(versions.GLOBAL if base_union_id is None else versions.union_scope(base_union_id))
+    found = versions.get_versions(db, scopes)
+    return (
+        hashlib.sha256(canonical.encode("utf-8")).hexdigest(),
+        get_catalog().version,
+        tuple(sorted(found.items())),
+    )
+
+
+def _iter_and_cache(key: tuple, results: Iterator[schemas.SimulationPlayerResult]) -> Iterator[schemas.SimulationPlayerResult]:
+    collected = []
+    for result in results:
+        collected.append(result)
+        yield result
+    simulation_cache.put(key, schemas.DamageSimulationResponse(simulation_results=collected))
+
+
+def iter_damage_simulation(db: Session, request: schemas.DamageSimulationRequest) -> Iterator[schemas.SimulationPlayerResult]:
+    """
+    Reads everything `request` needs, with one query for the players and
+    one for all the characters involved, and returns an iterator of the
+    per-player results, which are cached once fully iterated. A cached
+    result is returned without reading characters. The database is not
+    used once this returns.
+    """
+    key = simulation_cache_key(db, request)
+    cached = simulation_cache.get(key)
+    if cached is not None:
+        return iter(cached.simulation_results)
+    with instrumentation.phase("simulation-load"):
+        players = load_union_players(db, [request.union_id])
+        rows = load_character_rows(
+            db, [player.id for player in players] + [request.base_player_id], requested_character_ids(request.teams)
+        )
+    return _iter_and_cache(key, iter_player_results(players, request.base_player_id, request.teams, rows))
+
+
+def run_damage_simulation(db: Session, request: schemas.DamageSimulationRequest) -> schemas.DamageSimulationResponse:
+    """
+    Simulates every team of `request` for every player of its union.
+    """
+    return schemas.DamageSimulationResponse(simulation_results=list(iter_damage_simulation(db, request)))
+
+
+def iter_batch_simulation(db: Session, request: schemas.BatchSimulationRequest) -> Iterator[tuple]:
+    """
+    Validates `request` and reads all the players and characters its
+    scenarios involve at once, then returns an iterator of (scenario
+    index, SimulationPlayerResult) pairs, scenario by scenario. The
+    database is not used once this returns; what-if final_attack values
+    are computed once per distinct coor_level as the iteration reaches them.
+    """
+    if len(request.scenarios) > MAX_SIMULATION_SCENARIOS:
+        raise ValueError(f"At most {MAX_SIMULATION_SCENARIOS} scenarios per request.")
+    for index, scenario in enumerate(request.scenarios):
+        if not scenario.union_ids:
+            raise ValueError(f"Scenario {index} has no union_ids.")
+
+    with instrumentation.phase("simulation-load"):
+        players = load_union_players(db, {union_id for scenario in request.scenarios for union_id in scenario.union_ids})
+        character_ids = set()
+        for scenario in request.scenarios:
+            character_ids |= requested_character_ids(scenario.teams)
+        rows = load_character_rows(
+            db, [player.id for player in players] + [scenario.base_player_id for scenario in request.scenarios], character_ids,
+            engine_inputs=any(scenario.coor_level is not None for scenario in request.scenarios),
+        )
+    for scenario in request.scenarios:
+        if scenario.coor_level is not None:
+            # Checked before streaming starts, so the error can still be a 400.
+            check_what_if_inputs(rows, scenario.coor_level)
+            break
+    return _iter_scenario_results(request.scenarios, players, rows)
+
+
+def _iter_scenario_results(scenarios: List[schemas.SimulationScenario], players: list, rows: Dict[tuple, tuple]) -> Iterator[tuple]:
+    what_if = {}
+    for index, scenario in enumerate(scenarios):
+        union_ids = set(scenario.union_ids)
+        scenario_players = [player for player in players if player.union_id in union_ids]
+        final_attack = None
+        if scenario.coor_level is not None:
+            if scenario.coor_level not in what_if:
+                what_if[scenario.coor_level] = what_if_final_attack(rows, scenario.coor_level)
+            final_attack = what_if[scenario.coor_level]
+        for result in iter_player_results(scenario_players, scenario.base_player_id, scenario.teams, rows, final_attack):
+            yield index, result
+
+
+def run_batch_simulation(db: Session, request: schemas.BatchSimulationRequest) -> schemas.BatchSimulationResponse:
+    """
+    Evaluates every scenario of `request` over a single load of all the
+    players and characters they involve.
+    """
+    results = [schemas.ScenarioResult(name=scenario.name, simulation_results=[]) for scenario in request.scenarios]
+    for index, result in iter_batch_simulation(db, request):
+        results[index].simulation_results.append(result)
+    return schemas.BatchSimulationResponse(scenarios=results)
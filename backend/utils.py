@@ -1,37 +1,400 @@
+import hashlib
 import json
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
 from pathlib import Path
+from types import MappingProxyType
+from typing import Optional
 
-def load_static_data():
+logger = logging.getLogger(__name__)
+
+STATIC_DATA_DIR = Path(__file__).parent
+STATIC_DATA_FILES = ('list.json', 'cube.json', 'number.json', 'rank.json', 'equipment.json', 'super.json')
+
+# Parsed static data cached between processes; set to an empty string to disable.
+STATIC_SNAPSHOT_PATH = os.getenv("STATIC_SNAPSHOT_PATH", str(STATIC_DATA_DIR / ".static_snapshot.marshal"))
+SNAPSHOT_FORMAT = 1
+
+
+def read_static_files() -> dict:
+    """Reads the raw bytes of every static JSON file, keyed by file name."""
+    return {name: (STATIC_DATA_DIR / name).read_bytes() for name in STATIC_DATA_FILES}
+
+
+def static_data_fingerprint(raw_files: dict) -> str:
+    """Content hash over all static JSON files."""
+    digest = hashlib.sha256()
+    for name in STATIC_DATA_FILES:
+        digest.update(f"{name}:{len(raw_files[name])}:".encode())
+        digest.update(raw_files[name])
+    return digest.hexdigest()
+
+
+def load_static_data(raw_files: dict = None):
     """Loads all static JSON data files."""
-    current_dir = Path(__file__).parent
-    
+    if raw_files is None:
+        raw_files = read_static_files()
+
     # Load nikke list for static data
-    with open(current_dir / 'list.json', 'r', encoding='utf-8') as f:
-        nikke_list_data = json.load(f)
+    nikke_list_data = json.loads(raw_files['list.json'].decode('utf-8'))
     nikke_static_data = {nikke['id']: nikke for nikke in nikke_list_data['nikkes']}
     
     # Load cube data
-    with open(current_dir / 'cube.json', 'r', encoding='utf-8') as f:
-        cube_data = json.load(f)
+    cube_data = json.loads(raw_files['cube.json'].decode('utf-8'))
     cube_level_map = {item['cube_level']: item for item in cube_data}
     
     # Load number data
-    with open(current_dir / 'number.json', 'r', encoding='utf-8') as f:
-        number_data = json.load(f)
+    number_data = json.loads(raw_files['number.json'].decode('utf-8'))
 
     # Load rank data
-    with open(current_dir / 'rank.json', 'r', encoding='utf-8') as f:
-        rank_data = json.load(f)
+    rank_data = json.loads(raw_files['rank.json'].decode('utf-8'))
 
     # Load equipment data
-    with open(current_dir / 'equipment.json', 'r', encoding='utf-8') as f:
-        equipment_data = json.load(f)
+    equipment_data = json.loads(raw_files['equipment.json'].decode('utf-8'))
 
     # Load super data
-    with open(current_dir / 'super.json', 'r', encoding='utf-8') as f:
-        super_data = json.load(f)
+    super_data = json.loads(raw_files['super.json'].decode('utf-8'))
         
     return nikke_list_data, nikke_static_data, cube_data, cube_level_map, number_data, rank_data, equipment_data, super_data
 
-# Load data on module import
-NIKKE_LIST_DATA, NIKKE_STATIC_DATA, CUBE_DATA, CUBE_LEVEL_MAP, NUMBER_DATA, RANK_DATA, EQUIPMENT_DATA, SUPER_DATA = load_static_data()
\ No newline at end of file
+
+class StaticDataVersionConflict(Exception):
+    """Raised when a reload expects a catalog version that is no longer current."""
+
+
+class _Frozen:
+    """
+    Base for catalog objects: attributes are set once in __init__ and are read-only afterwards.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+
+class CharacterRecord(_Frozen):
+    """
+    Static data of one character from list.json.
+    """
+    __slots__ = (
+        "id", "name_code", "name_cn", "name_en", "character_class", "element",
+        "use_burst_skill", "corporation", "weapon_type", "original_rare",
+    )
+
+    def __init__(self, nikke: dict):
+        for name in self.__slots__:
+            self._set(name, nikke.get("class" if name == "character_class" else name))
+
+    def as_dict(self) -> dict:
+        return {"class" if name == "character_class" else name: getattr(self, name) for name in self.__slots__}
+
+
+# Stand-in for ids missing from list.json: every field is None.
+EMPTY_CHARACTER = CharacterRecord({})
+
+
+class StaticCatalog(_Frozen):
+    """
+    Lookup tables compiled from the static JSON files.
+
+    Per-class tables are tuples indexed by CLASS_INDEX; sync attack is indexed
+    by sync level - 1, favor attack by favor rank, cube tables by cube level.
+    Missing entries are 0, matching what lookups in the raw JSON return.
+    `version` starts at 1 and goes up by one on every reload that changed data.
+    """
+    CLASSES = ("Attacker", "Defender", "Supporter")
+    CLASS_INDEX = {name: index for index, name in enumerate(CLASSES)}
+    CLASS_NAMES_CN = {"Attacker": "火力型", "Supporter": "辅助型", "Defender": "防御型"}
+    EQUIPMENT_KEYS = {"Attacker": "attackers", "Defender": "defenders", "Supporter": "supports"}
+
+    __slots__ = (
+        "characters", "super_ids", "sync_attack", "favor_attack", "equipment_attack",
+        "sr_item_attack", "cube_attack", "cube_superiority",
+        "version", "fingerprint", "loaded_at",
+    )
+
+    def __init__(
+        self, nikke_list_data: dict, cube_data: list, number_data: dict, rank_data: dict, equipment_data: dict, super_data: dict,
+        version: int = 1, fingerprint: str = None,
+    ):
+        self._set("version", version)
+        self._set("fingerprint", fingerprint)
+        self._set("loaded_at", time.time())
+        self._set("characters", MappingProxyType({nikke["id"]: CharacterRecord(nikke) for nikke in nikke_list_data["nikkes"]}))
+        self._set("super_ids", frozenset(super_data.get("super", [])))
+
+        self._set("sync_attack", tuple(
+            tuple(number_data.get(f"{name}_level_attack_list", [])) for name in self.CLASSES
+        ))
+
+        max_rank = max((int(rank) for rank in rank_data), default=0)
+        favor_attack = []
+        for name in self.CLASSES:
+            values = [0.0] * (max_rank + 1)
+            for rank, by_class in rank_data.items():
+                values[int(rank)] = float(by_class.get(self.CLASS_NAMES_CN[name], {}).get("attack", 0))
+            favor_attack.append(tuple(values))
+        self._set("favor_attack", tuple(favor_attack))
+
+        self._set("equipment_attack", tuple(int(equipment_data.get(self.EQUIPMENT_KEYS[name], 0)) for name in self.CLASSES))
+        self._set("sr_item_attack", tuple(number_data.get("item_atk", [])))
+
+        max_cube_level = max([item.get("cube_level", 0) for item in cube_data] + [0])
+        cube_attack = [0] * (max_cube_level + 1)
+        # The first entry of a level wins, as in a linear scan of cube.json.
+        for item in reversed(cube_data):
+            cube_attack[item["cube_level"]] = item.get("atk", 0)
+        self._set("cube_attack", tuple(cube_attack))
+        cube_superiority = [0] * (max_cube_level + 1)
+        for item in cube_data:
+            cube_superiority[item["cube_level"]] = item.get("IncElementDmg", 0)
+        self._set("cube_superiority", tuple(cube_superiority))
+
+    def character(self, character_id: int) -> CharacterRecord:
+        return self.characters.get(character_id, EMPTY_CHARACTER)
+
+    def character_ids_of_class(self, character_class: str) -> set:
+        return {character_id for character_id, record in self.characters.items() if record.character_class == character_class}
+
+    def character_ids_matching(self, name: str) -> list:
+        """
+        Ids whose name_cn contains `name` as a literal substring, ignoring case.
+        """
+        needle = name.casefold()
+        return [character_id for character_id, record in self.characters.items() if needle in (record.name_cn or "").casefold()]
+
+    def diff(self, other: "StaticCatalog") -> dict:
+        """
+        What differs between this catalog and `other`:
+        - characters: ids whose list.json entry changed, appeared or disappeared
+        - super_ids: ids added to or removed from super.json
+        - sync_levels: class -> changed sync levels, or None when the list
+          length changed (negative levels wrap around, so any level may move)
+        - favor_classes / equipment_classes: classes whose table changed
+        - sr_item_levels / cube_levels: changed item and cube levels
+        """
+        def changed_indexes(old, new):
+            length = max(len(old), len(new))
+            old = tuple(old) + (0,) * (length - len(old))
+            new = tuple(new) + (0,) * (length - len(new))
+            return {index for index, (a, b) in enumerate(zip(old, new)) if a != b}
+
+        sync_levels = {}
+        for index, name in enumerate(self.CLASSES):
+            old, new = self.sync_attack[index], other.sync_attack[index]
+            if len(old) != len(new):
+                sync_levels[name] = None
+            else:
+                levels = {level + 1 for level in changed_indexes(old, new)}
+                if levels:
+                    sync_levels[name] = levels
+
+        return {
+            "characters": {
+                character_id for character_id in set(self.characters) | set(other.characters)
+                if self.character(character_id).as_dict() != other.character(character_id).as_dict()
+            },
+            "super_ids": set(self.super_ids ^ other.super_ids),
+            "sync_levels": sync_levels,
+            "favor_classes": {
+                name for index, name in enumerate(self.CLASSES)
+                if changed_indexes(self.favor_attack[index], other.favor_attack[index])
+            },
+            "equipment_classes": {
+                name for index, name in enumerate(self.CLASSES)
+                if self.equipment_attack[index] != other.equipment_attack[index]
+            },
+            "sr_item_levels": {level + 1 for level in changed_indexes(self.sr_item_attack, other.sr_item_attack)},
+            "cube_levels": (
+                changed_indexes(self.cube_attack, other.cube_attack)
+                | changed_indexes(self.cube_superiority, other.cube_superiority)
+            ),
+        }
+
+    def class_index(self, character_class: str) -> int:
+        """
+        Index into the per-class tables, or -1 for an unknown class.
+        """
+        return self.CLASS_INDEX.get(character_class, -1)
+
+    def sync_attack_for(self, character_class: str, sync_level: int) -> float:
+        index = self.CLASS_INDEX.get(character_class)
+        values = self.sync_attack[index] if index is not None else ()
+        # Same indexing as the raw level list, negative levels included.
+        return values[sync_level - 1] if sync_level - 1 < len(values) else 0
+
+    def favor_attack_for(self, character_class: str, rank: int) -> float:
+        index = self.CLASS_INDEX.get(character_class)
+        if index is None:
+            return 0.0
+        values = self.favor_attack[index]
+        return values[rank] if 0 <= rank < len(values) else 0.0
+
+    def equipment_attack_for(self, character_class: str) -> int:
+        index = self.CLASS_INDEX.get(character_class)
+        return self.equipment_attack[index] if index is not None else 0
+
+    def sr_item_attack_for(self, item_level: int) -> int:
+        index = item_level - 1
+        return self.sr_item_attack[index] if 0 <= index < len(self.sr_item_attack) else 0
+
+    def cube_attack_for(self, cube_level: int) -> int:
+        return self.cube_attack[cube_level] if 0 <= cube_level < len(self.cube_attack) else 0
+
+    def cube_superiority_for(self, cube_level: int) -> float:
+        return self.cube_superiority[cube_level] if 0 <= cube_level < len(self.cube_superiority) else 0
+
+    def is_uncapped_favor(self, corporation: str, character_id: int) -> bool:
+        """
+        Pilgrims and super characters are not capped at favor rank 30.
+        """
+        return corporation == "PILGRIM" or character_id in self.super_ids
+
+
+# Names of the load_static_data() results, published as module attributes on first use.
+STATIC_DATA_NAMES = (
+    "NIKKE_LIST_DATA", "NIKKE_STATIC_DATA", "CUBE_DATA", "CUBE_LEVEL_MAP",
+    "NUMBER_DATA", "RANK_DATA", "EQUIPMENT_DATA", "SUPER_DATA",
+)
+
+_catalog = None
+_load_lock = threading.RLock()
+
+
+def _snapshot_key() -> dict:
+    # marshal's format is only stable within one Python version.
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "python": list(sys.version_info[:2]),
+        "marshal": marshal.version,
+        "source_dir": str(STATIC_DATA_DIR),
+    }
+
+
+def _source_stats() -> dict:
+    stats = {}
+    for name in STATIC_DATA_FILES:
+        stat = (STATIC_DATA_DIR / name).stat()
+        stats[name] = [stat.st_mtime_ns, stat.st_size]
+    return stats
+
+
+def _read_snapshot() -> Optional[dict]:
+    if not STATIC_SNAPSHOT_PATH:
+        return None
+    try:
+        with open(STATIC_SNAPSHOT_PATH, 'rb') as f:
+            # One read and loads(): marshal.load() on a file reads in small pieces.
+            snapshot = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("key") != _snapshot_key():
+        return None
+    return snapshot
+
+
+def _write_snapshot(stats: dict, fingerprint: str, loaded: tuple):
+    if not STATIC_SNAPSHOT_PATH:
+        return
+    snapshot = {"key": _snapshot_key(), "stats": stats, "fingerprint": fingerprint, "data": loaded}
+    tmp_path = f"{STATIC_SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(marshal.dumps(snapshot))
+        os.replace(tmp_path, STATIC_SNAPSHOT_PATH)
+    except OSError as e:
+        logger.info("Could not write static data snapshot %s: %s", STATIC_SNAPSHOT_PATH, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _load_static_data_cached(force_read: bool = False):
+    """
+    Returns (load_static_data() result, fingerprint). The parsed data comes
+    from the snapshot while the source files keep the size and mtime it
+    recorded, or their content still hashes to its fingerprint.
+    """
+    stats = _source_stats()
+    snapshot = _read_snapshot()
+    if snapshot is not None and snapshot["stats"] == stats and not force_read:
+        return tuple(snapshot["data"]), snapshot["fingerprint"]
+
+    raw_files = read_static_files()
+    fingerprint = static_data_fingerprint(raw_files)
+    if snapshot is not None and snapshot["fingerprint"] == fingerprint:
+        loaded = tuple(snapshot["data"])
+    else:
+        loaded = load_static_data(raw_files)
+    if snapshot is None or snapshot["stats"] != stats or snapshot["fingerprint"] != fingerprint:
+        _write_snapshot(stats, fingerprint, loaded)
+    return loaded, fingerprint
+
+
+def _publish(loaded: tuple, catalog: StaticCatalog):
+    global _catalog
+    globals().update(zip(STATIC_DATA_NAMES, loaded))
+    _catalog = catalog
+
+
+def _build_catalog(loaded: tuple, fingerprint: str, version: int = 1) -> StaticCatalog:
+    nikke_list_data, _, cube_data, _, number_data, rank_data, equipment_data, super_data = loaded
+    return StaticCatalog(
+        nikke_list_data, cube_data, number_data, rank_data, equipment_data, super_data,
+        version=version, fingerprint=fingerprint,
+    )
+
+
+def get_catalog() -> StaticCatalog:
+    """
+    Returns the compiled static-data catalog, loading it on first use.
+    """
+    catalog = _catalog
+    if catalog is None:
+        with _load_lock:
+            if _catalog is None:
+                loaded, fingerprint = _load_static_data_cached()
+                _publish(loaded, _build_catalog(loaded, fingerprint))
+            catalog = _catalog
+    return catalog
+
+
+def __getattr__(name):
+    # NIKKE_LIST_DATA and friends are loaded on first access.
+    if name in STATIC_DATA_NAMES:
+        get_catalog()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def reload_static_data(expected_version: int = None, before_publish=None):
+    """
+    Re-reads the static JSON files and swaps in a new catalog if their content changed.
+    Returns (previous catalog, current catalog); both are the same object when nothing changed.
+    Raises StaticDataVersionConflict if expected_version is given and is not the current version.
+    before_publish(previous, current), if given, runs before a new catalog goes live;
+    if it raises, the previous catalog stays live and the exception propagates.
+    """
+    with _load_lock:
+        previous = get_catalog()
+        if expected_version is not None and expected_version != previous.version:
+            raise StaticDataVersionConflict(
+                f"Static data is at version {previous.version}, not {expected_version}."
+            )
+        loaded, fingerprint = _load_static_data_cached(force_read=True)
+        if fingerprint == previous.fingerprint:
+            return previous, previous
+
+        current = _build_catalog(loaded, fingerprint, version=previous.version + 1)
+        if before_publish is not None:
+            before_publish(previous, current)
+        _publish(loaded, current)
+    return previous, current
@@ -0,0 +1,58 @@
+"""
+Data version counters stored in the data_versions table.
+
+Write paths call bump() inside their transaction, so the new version
+becomes visible together with the data; every process reads the same
+counters. Read caches key their entries on these versions.
+"""
+from typing import Iterable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from backend import models
+
+GLOBAL = "global"
+SHARED = "shared"
+
+
+def union_scope(union_id: int) -> str:
+    return f"union:{union_id}"
+
+
+def bump(db: Session, union_ids: Iterable[Optional[int]] = (), shared: bool = False):
+    """
+    Increments the global version, plus the shared version and the given unions' versions.
+    """
+    scopes = [GLOBAL]
+    if shared:
+        scopes.append(SHARED)
+    scopes.extend(sorted({union_scope(union_id) for union_id in union_ids if union_id is not None}))
+
+    existing = set(db.scalars(select(models.DataVersion.scope).where(models.DataVersion.scope.in_(scopes))))
+    if existing:
+        db.execute(
+            update(models.DataVersion)
+            .where(models.DataVersion.scope.in_(existing))
+            .values(version=models.DataVersion.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    for scope in scopes:
+        if scope not in existing:
+            db.add(models.DataVersion(scope=scope, version=1))
+    db.flush()
+
+
+def get_versions(db: Session, scopes: Iterable[str]) -> dict:
+    """
+    Current version of each scope; scopes never bumped are at 0.
+    """
+    scopes = list(scopes)
+    found = dict(db.execute(
+        select(models.DataVersion.scope, models.DataVersion.version).where(models.DataVersion.scope.in_(scopes))
+    ).all())
+    return {scope: found.get(scope, 0) for scope in scopes}
+
+
+def get_version(db: Session, scope: str = GLOBAL) -> int:
+    return get_versions(db, [scope])[scope]
@@ -0,0 +1,43 @@
+import copy
+import glob
+import io
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.main import app
+
+INPUT_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "input", "*.json")))
+
+
+def export_without_item_levels(path: str) -> dict:
+    """
+    The export at `path` under another player name, with the item level
+    left out of every other character, as older exports do.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = copy.deepcopy(json.load(f))
+    data["name"] = data["name"] + " (no item levels)"
+    for characters in data["elements"].values():
+        for char_data in characters[::2]:
+            char_data.pop("item_level", None)
+    return data
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    A TestClient over the default in-memory database, holding a union with
+    a few sample exports and one whose characters partly lack an item level.
+    """
+    with TestClient(app) as client:
+        union_id = client.post("/api/unions/", json={"name": "Test union"}).json()["id"]
+        files = [("files", (os.path.basename(path), open(path, "rb"), "application/json")) for path in INPUT_FILES[:4]]
+        legacy = json.dumps(export_without_item_levels(INPUT_FILES[4]), ensure_ascii=False).encode("utf-8")
+        files.append(("files", ("legacy.json", io.BytesIO(legacy), "application/json")))
+        response = client.post("/api/upload/", files=files, data={"union_id": str(union_id)})
+        assert response.status_code == 200, response.text
+        assert response.json()["failed_files"] == 0
+        yield client
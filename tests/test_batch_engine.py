@@ -0,0 +1,94 @@
+"""
+batch_engine.compute_batch() must match the scalar calculate_character_attributes() bit for bit.
+"""
+import pytest
+
+from backend import batch_engine, services
+from backend.final_attack import attack_cache
+from backend.utils import CUBE_LEVEL_MAP, NIKKE_STATIC_DATA
+
+COLUMNS = (
+    "final_attack", "total_superiority", "breakthrough_coefficient",
+    "relative_training_degree", "absolute_training_degree", "general_relative_training_degree",
+)
+CHARACTER_ID = next(iter(NIKKE_STATIC_DATA))
+UNKNOWN_CHARACTER_ID = 999999
+
+
+def character(**overrides) -> dict:
+    char_data = {
+        "id": CHARACTER_ID,
+        "limit_break": {"grade": 3, "core": 7},
+        "item_rare": "SR",
+        "item_level": 9,
+        "coor_level": 4,
+        "equipments": {"0": [
+            {"function_type": "StatAtk", "function_value": 12.5},
+            {"function_type": "IncElementDmg", "function_value": 31.2},
+        ]},
+    }
+    char_data.update(overrides)
+    return char_data
+
+
+def without(key: str, **overrides) -> dict:
+    char_data = character(**overrides)
+    del char_data[key]
+    return char_data
+
+
+CASES = {
+    "typical": (character(), 400, 10),
+    "null item level": (character(item_level=None), 400, 10),
+    "missing item level": (without("item_level"), 400, 10),
+    "no cube": (character(), 400, 0),
+    "cube level past the table": (character(), 400, 99),
+    "SSR item": (character(item_rare="SSR", item_level=None), 400, 10),
+    "SR item past the table": (character(item_level=99), 400, 10),
+    "no item": (character(item_rare=None), 400, 10),
+    "unknown character": (character(id=UNKNOWN_CHARACTER_ID), 400, 10),
+    "no limit break": (without("limit_break"), 1, 10),
+    "sync level past the table": (character(), 5000, 10),
+}
+
+
+def scalar(char_data: dict, sync_level: int, max_cube_level: int) -> dict:
+    cube_superiority_increase = CUBE_LEVEL_MAP.get(max_cube_level, {}).get("IncElementDmg", 0)
+    return services.calculate_character_attributes(
+        char_data, sync_level, cube_superiority_increase, max_cube_level, char_data.get("coor_level", 0)
+    )
+
+
+def batch(cases) -> dict:
+    inputs = [
+        services.character_engine_inputs(char_data, sync_level, max_cube_level, services.sum_equipment_stats(char_data))
+        for char_data, sync_level, max_cube_level in cases
+    ]
+    return batch_engine.compute_batch(batch_engine.to_columns(inputs))
+
+
+def test_unknown_character_is_not_in_the_static_data():
+    assert UNKNOWN_CHARACTER_ID not in NIKKE_STATIC_DATA
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_batch_matches_scalar(name):
+    case = CASES[name]
+    attack_cache.clear()
+    results = batch([case])
+    attack_cache.clear()
+    expected = scalar(*case)
+    for column in COLUMNS:
+        assert results[column][0].item() == expected[column], column
+
+
+def test_batch_of_all_cases_matches_scalar_with_a_warm_cache():
+    cases = list(CASES.values())
+    attack_cache.clear()
+    batch(cases)
+    # Served from attack_cache this time.
+    results = batch(cases)
+    for index, case in enumerate(cases):
+        expected = scalar(*case)
+        for column in COLUMNS:
+            assert results[column][index].item() == expected[column], (list(CASES)[index], column)
@@ -0,0 +1,36 @@
+import pytest
+
+from backend import models
+
+SORT_COLUMNS = [column.name for column in models.Character.__table__.columns]
+
+
+def fetch_pages(client, sort_by: str, order: str, limit: int) -> list:
+    ids = []
+    cursor = None
+    while True:
+        params = {"sort_by": sort_by, "order": order, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/characters/", params=params)
+        assert response.status_code == 200, response.text
+        ids.extend(row["id"] for row in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", SORT_COLUMNS)
+def test_pages_add_up_to_the_full_list(client, sort_by, order):
+    full = [row["id"] for row in client.get("/api/characters/", params={"sort_by": sort_by, "order": order}).json()]
+    paged = fetch_pages(client, sort_by, order, 13)
+    assert len(paged) == len(set(paged))
+    assert paged == full
+
+
+def test_sample_data_covers_booleans_and_nulls(client):
+    rows = client.get("/api/characters/", params={"fields": "is_C,item_level", "limit": 1000}).json()
+    assert {row["is_C"] for row in rows} == {True, False}
+    assert any(row["item_level"] is None for row in rows)
+    assert any(row["item_level"] is not None for row in rows)
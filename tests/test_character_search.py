@@ -0,0 +1,51 @@
+import json
+
+from backend import utils
+
+
+def names(client, character_name: str) -> set:
+    response = client.get("/api/characters/", params={"character_name": character_name})
+    assert response.status_code == 200, response.text
+    return {row["name_cn"] for row in response.json()}
+
+
+def test_search_is_a_literal_substring(client):
+    everything = names(client, "")
+    assert everything
+    assert names(client, "%") == set()
+    assert names(client, "_") == set()
+
+
+def test_search_ignores_case(client):
+    ascii_names = sorted(name for name in names(client, "") if any(char.isascii() and char.isalpha() for char in name))
+    if ascii_names:
+        name = ascii_names[0]
+        assert name in names(client, name.lower())
+        assert name in names(client, name.upper())
+
+
+def test_static_reload_renames_stored_characters(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "STATIC_SNAPSHOT_PATH", str(tmp_path / "snapshot.marshal"))
+    row = client.get("/api/characters/", params={"limit": 1, "fields": "character_id,name_cn"}).json()[0]
+    original_read = utils.read_static_files
+
+    def renamed_files():
+        files = dict(original_read())
+        data = json.loads(files["list.json"])
+        for nikke in data["nikkes"]:
+            if nikke["id"] == row["character_id"]:
+                nikke["name_cn"] = "改名测试"
+        files["list.json"] = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        return files
+
+    monkeypatch.setattr(utils, "read_static_files", renamed_files)
+    try:
+        assert client.post("/api/admin/static-data/reload").json()["reloaded"]
+        renamed = client.get("/api/characters/", params={"character_name": "改名测试"}).json()
+        assert renamed and {item["character_id"] for item in renamed} == {row["character_id"]}
+        assert {item["name_cn"] for item in renamed} == {"改名测试"}
+        assert names(client, row["name_cn"]).isdisjoint({row["name_cn"]})
+    finally:
+        monkeypatch.setattr(utils, "read_static_files", original_read)
+        assert client.post("/api/admin/static-data/reload").json()["reloaded"]
+    assert row["name_cn"] in names(client, row["name_cn"])
@@ -0,0 +1,45 @@
+"""
+Work handed to the compute pool falls back to in-process when the pool goes away under it.
+"""
+import json
+import time
+from concurrent.futures import CancelledError
+
+from backend import optimizer, services
+
+from conftest import INPUT_FILES
+
+
+class CancelledPool:
+    """A pool shut down with cancel_futures=True while a batch was queued on it."""
+
+    def map(self, fn, *iterables):
+        raise CancelledError()
+
+    def submit(self, fn, *args, **kwargs):
+        raise CancelledError()
+
+
+def load_documents() -> list:
+    documents = []
+    for path in INPUT_FILES[:2]:
+        with open(path, encoding="utf-8") as f:
+            documents.append(json.load(f))
+    return documents
+
+
+def test_compute_documents_survives_cancelled_pool(monkeypatch):
+    documents = load_documents()
+    expected = [services.compute_document_rows(data) for data in documents]
+    monkeypatch.setattr(services, "get_compute_pool", lambda: CancelledPool())
+    assert services.compute_documents(documents) == expected
+
+
+def test_search_players_survives_cancelled_pool(monkeypatch):
+    tasks = [[[3.0, 1.0], [2.0, 4.0], [5.0, 0.5]], [[1.0, 2.0], [0.5, 0.25], [3.0, 3.5]]]
+    capacities = [1, 2]
+    deadline = time.time() + 30
+    expected = [optimizer.best_assignment(values, capacities, deadline) for values in tasks]
+    monkeypatch.setattr(optimizer, "get_compute_pool", lambda workers=None: CancelledPool())
+    results = optimizer._search_players(tasks, capacities, deadline)
+    assert results == expected
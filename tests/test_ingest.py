@@ -0,0 +1,88 @@
+import copy
+import io
+import json
+
+from sqlalchemy import func, select
+
+from backend import models, services
+
+from conftest import INPUT_FILES
+
+
+def export_with_duplicate_entry() -> dict:
+    """
+    A sample export under a new name whose first character appears twice
+    under the same element, the second entry with less equipment.
+    """
+    with open(INPUT_FILES[0], encoding="utf-8") as f:
+        data = json.load(f)
+    data["name"] = data["name"] + " (duplicate entry)"
+    characters = next(characters for characters in data["elements"].values() if characters)
+    duplicate = copy.deepcopy(characters[0])
+    for slot, equipments in list(duplicate.get("equipments", {}).items()):
+        duplicate["equipments"][slot] = equipments[:1]
+    characters.append(duplicate)
+    return data
+
+
+def upload(client, data: dict) -> dict:
+    content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    response = client.post(
+        "/api/upload/", files=[("files", ("export.json", io.BytesIO(content), "application/json"))], data={"force": "true"},
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["failed_files"] == 0
+    return response.json()["ingest"]
+
+
+def test_duplicate_entries_are_stored_once(client):
+    data = export_with_duplicate_entry()
+    upload(client, data)
+
+    characters = next(characters for characters in data["elements"].values() if characters)
+    last_entry = characters[-1]
+    db = models.SessionLocal()
+    try:
+        counts = db.execute(
+            select(func.count(models.Equipment.id))
+            .select_from(models.Character)
+            .join(models.Player, models.Character.player_id == models.Player.id)
+            .outerjoin(models.Equipment, models.Equipment.character_id == models.Character.id)
+            .where(models.Player.name == data["name"], models.Character.character_id == last_entry["id"])
+            .group_by(models.Character.id)
+        ).scalars().all()
+    finally:
+        db.close()
+    assert counts == [sum(len(equipments) for equipments in last_entry.get("equipments", {}).values())]
+
+    again = upload(client, data)
+    assert again["characters"]["added"] == 0
+    assert again["characters"]["removed"] == 0
+    assert again["characters"]["updated"] == 0
+
+
+class ReadCounter(io.BytesIO):
+    """Records the largest chunk handed out, to check that reads stay bounded."""
+
+    largest_read = 0
+
+    def readline(self, size=-1):
+        line = super().readline(size)
+        self.largest_read = max(self.largest_read, len(line))
+        return line
+
+
+def test_oversized_ndjson_line_is_skipped_in_bounded_reads(monkeypatch):
+    monkeypatch.setattr(services, "MAX_IMPORT_ENTRY_BYTES", 64)
+    monkeypatch.setattr(services, "NDJSON_SKIP_CHUNK_BYTES", 16)
+    oversized = b'{"name": "' + b"x" * 1000 + b'"}\n'
+    stream = ReadCounter(b'{"name": "a"}\n' + oversized + b"\n" + b'{"name": "b"}')
+
+    entries = list(services.iter_archive_files(stream, "ndjson"))
+
+    assert [name for name, _ in entries] == ["line 1", "line 2", "line 4"]
+    assert entries[0][1].read() == b'{"name": "a"}\n'
+    assert isinstance(entries[1][1], services.RejectedFile)
+    assert str(len(oversized)) in entries[1][1].error
+    assert entries[2][1].read() == b'{"name": "b"}'
+    assert stream.largest_read <= 65